@@ -1,13 +1,20 @@
 import streamlit as st
-import yt_dlp
 import subprocess
 import os
 import time
-import shutil
-import urllib.request
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import multiprocessing
-import platform
+import atexit
+
+from whisper_ultra import MEDIA_EXTENSIONS, JobQueue, TranscriptCache, WhisperServerPool, tracing
+from whisper_ultra.autotune import load_tuning_profile
+from whisper_ultra.capabilities import get_capabilities
+from whisper_ultra.cascade import CASCADE_THRESHOLD
+from whisper_ultra.follow import FOLLOW_MAX_LAG_SECONDS, FOLLOW_WINDOW_SECONDS
+from whisper_ultra.models import ModelDownloader
+from whisper_ultra.playlist import DOWNLOAD_CONCURRENCY, download_batch
+from whisper_ultra.remote import RemoteWorkerPool
+from whisper_ultra.reporting import Reporter
+from whisper_ultra.scheduler import default_cpu_slots
+from whisper_ultra.search import SearchIndex, format_position
 
 st.set_page_config(page_title="Trascrizione Whisper Ultra", layout="wide")
 
@@ -59,47 +66,22 @@ def check_and_install_whisper_cpp():
 
 def download_model_if_missing(model="tiny"):
     """Scarica automaticamente il modello Whisper se non esiste"""
-    model_dir = "whisper.cpp/models"
-    model_path = f"{model_dir}/ggml-{model}.bin"
-    
-    if os.path.exists(model_path):
+    if model in get_capabilities()["models"]:
         return True
     
-    os.makedirs(model_dir, exist_ok=True)
-    
     st.warning(f"Modello {model} non trovato. Download automatico in corso...")
     
-    url = f"https://huggingface.co/ggerganov/whisper.cpp/resolve/main/ggml-{model}.bin"
-    
-    progress_bar = st.progress(0)
-    status_text = st.empty()
-    
-    def reporthook(block_num, block_size, total_size):
-        if total_size > 0:
-            downloaded = block_num * block_size
-            percent = min(int(downloaded / total_size * 100), 100)
-            downloaded_mb = downloaded / (1024 * 1024)
-            total_mb = total_size / (1024 * 1024)
-            progress_bar.progress(percent)
-            status_text.text(f"Scaricamento: {percent}% ({downloaded_mb:.1f} MB / {total_mb:.1f} MB)")
-    
-    try:
-        urllib.request.urlretrieve(url, model_path, reporthook)
-        status_text.empty()
-        progress_bar.empty()
-        st.success(f"Modello {model} scaricato!")
+    # Download condiviso: altre sessioni che chiedono lo stesso modello lo seguono invece di ripeterlo
+    reporter = StreamlitReporter()
+    if get_model_downloader().ensure(model, reporter):
         time.sleep(1)
         st.rerun()
         return True
-    except Exception as e:
-        st.error(f"Errore download: {e}")
-        return False
+    return False
 
 def check_coreml_available(model="base"):
     """Verifica se il modello CoreML per GPU è disponibile"""
-    model_dir = "whisper.cpp/models"
-    coreml_path = f"{model_dir}/ggml-{model}-encoder.mlmodelc"
-    return os.path.exists(coreml_path)
+    return get_capabilities()["models"].get(model, {}).get("coreml", False)
 
 def convert_model_to_coreml(model="base"):
     """Converte il modello per uso GPU CoreML"""
@@ -153,12 +135,92 @@ def convert_model_to_coreml(model="base"):
         st.error(f"Errore conversione: {e}")
         return False
 
-# Setup iniziale
-if not check_and_install_whisper_cpp():
-    st.error("Impossibile installare whisper.cpp. Verifica i prerequisiti.")
-    st.stop()
+class StreamlitReporter(Reporter):
+    """Messaggi della pipeline come st.info/st.success, avanzamento con una progress bar"""
+    
+    def __init__(self):
+        self._bar = None
+        self._status = None
+    
+    def info(self, message):
+        st.info(message)
+    
+    def success(self, message):
+        st.success(message)
+    
+    def warning(self, message):
+        st.warning(message)
+    
+    def error(self, message):
+        st.error(message)
+    
+    def progress(self, fraction, text=""):
+        if self._bar is None:
+            self._bar = st.progress(0)
+            self._status = st.empty()
+        self._bar.progress(min(fraction, 1.0))
+        self._status.text(text)
+    
+    def progress_done(self):
+        if self._bar is not None:
+            self._bar.empty()
+            self._status.empty()
+            self._bar = None
+            self._status = None
+
+@st.cache_resource
+def get_transcript_cache():
+    """Cache condivisa tra sessioni e rerun di Streamlit"""
+    return TranscriptCache()
+
+@st.cache_resource
+def get_whisper_pool():
+    """Pool condiviso tra sessioni e rerun di Streamlit
+
+    Dimensionato una volta sul budget CPU dei job: ogni chunk tiene almeno uno
+    slot, quindi più server di così non lavorerebbero mai insieme.
+    """
+    pool = WhisperServerPool(size=default_cpu_slots())
+    atexit.register(pool.shutdown)
+    return pool
+
+@st.cache_resource
+def get_cascade_pool():
+    """Pool del modello grande della cascata, separato per non ricaricare i modelli a ogni chunk
+
+    I suoi server contano nel budget di memoria dello scheduler dei job come
+    quelli del pool principale: ogni chunk della cascata li dichiara nel suo slot.
+    """
+    pool = WhisperServerPool(size=default_cpu_slots())
+    atexit.register(pool.shutdown)
+    return pool
+
+@st.cache_resource
+def get_remote_pool():
+    """Nodi `python -m whisper_ultra.remote` elencati in WHISPER_ULTRA_REMOTE (URL separati da virgola)"""
+    return RemoteWorkerPool(REMOTE_WORKERS)
+
+@st.cache_resource
+def get_search_index():
+    """Indice delle trascrizioni condiviso da ricerca e coda di job"""
+    return SearchIndex()
+
+@st.cache_resource
+def get_model_downloader():
+    """Download dei modelli condivisi tra sessioni e rerun di Streamlit"""
+    return ModelDownloader()
+
+REMOTE_WORKERS = [url.strip() for url in os.environ.get("WHISPER_ULTRA_REMOTE", "").split(",") if url.strip()]
 
-if not os.path.exists("whisper.cpp/models/ggml-base.bin"):
+# Setup iniziale: sondaggio in cache, ripetuto solo se cambiano i file di whisper.cpp
+capabilities = get_capabilities()
+if not capabilities["cli"]:
+    if not check_and_install_whisper_cpp():
+        st.error("Impossibile installare whisper.cpp. Verifica i prerequisiti.")
+        st.stop()
+    capabilities = get_capabilities()
+
+if "base" not in capabilities["models"]:
     download_model_if_missing("base")
     st.stop()
 
@@ -175,18 +237,17 @@ with col_info2:
     st.metric("⚡ Processing", "Parallelo")
     
 with col_info3:
-    cpu_count = multiprocessing.cpu_count()
+    cpu_count = capabilities["cores"]
     st.metric("🖥️ CPU Cores", f"{cpu_count}")
     
 with col_info4:
-    chip = platform.processor()
-    if "arm" in chip.lower():
+    if capabilities["arm"]:
         st.metric("💻 Chip", "Apple Silicon")
     else:
         st.metric("💻 Chip", "Intel")
 
 # Avviso GPU
-if not gpu_available and "arm" in platform.processor().lower():
+if not gpu_available and capabilities["arm"]:
     with st.expander("⚡ Attiva GPU per 10-15x velocità", expanded=False):
         st.warning("**GPU non attiva!** Puoi attivarla per velocità 10-15x superiori.")
         st.write("**Opzioni:**")
@@ -197,11 +258,41 @@ if not gpu_available and "arm" in platform.processor().lower():
             convert_model_to_coreml("base")
             st.rerun()
 
-operation = st.selectbox("Scegli un'operazione:", ["Trascrivi Audio", "Scarica Video"])
+operation = st.selectbox("Scegli un'operazione:", ["Trascrivi Audio", "Scarica Video", "Cerca nelle trascrizioni"])
 
 if operation == "Scarica Video":
-    video_url = st.text_input("URL video YouTube:")
+    video_urls = st.text_area(
+        "URL (uno per riga: video, playlist o canali):",
+        help="Playlist e canali vengono espansi; quelli già scaricati in questa cartella vengono saltati"
+    )
     save_path = st.text_input("Cartella destinazione:", os.path.expanduser("~/Videos"))
+    download_concurrency = st.slider("📥 Download in parallelo:", min_value=1, max_value=8, value=DOWNLOAD_CONCURRENCY)
+
+if operation == "Cerca nelle trascrizioni":
+    search_index = get_search_index()
+    if st.button("🗂️ Indicizza archivio", help="Aggiunge all'indice le trascrizioni salvate prima, o cambiate"):
+        with st.spinner("Indicizzazione..."):
+            index_stats = search_index.index_archive()
+        st.success(
+            f"✅ {index_stats['indexed']} indicizzate, {index_stats['unchanged']} invariate, "
+            f"{index_stats['removed']} rimosse"
+        )
+    index_stats = search_index.stats()
+    st.caption(f"🗂️ Indice: {index_stats['documents']} trascrizioni, {index_stats['segments']} righe")
+    
+    search_query = st.text_input("🔎 Cerca:", placeholder="parole da cercare (parola* per i prefissi)")
+    if search_query:
+        hits = search_index.search(search_query, limit=50)
+        if not hits:
+            st.info("Nessun risultato")
+        for hit in hits:
+            details = " • ".join(filter(None, [hit["model"], hit["language"]]))
+            st.markdown(
+                f"**{hit['video_name']}** ⏱️ `{format_position(hit['start_ms'])}`"
+                + (f" • {details}" if details else "")
+                + f"\n\n> {hit['snippet']}"
+            )
+            st.caption(f"💾 {hit['path']}")
 
 if operation == "Trascrivi Audio":
     source_type = st.radio("Fonte:", ["YouTube (URL)", "Carica file", "File locale"])
@@ -214,7 +305,9 @@ if operation == "Trascrivi Audio":
         
         uploaded_file = st.file_uploader(
             "Carica video/audio",
-            type=["mp4", "mkv", "avi", "mov", "m4a", "mp3", "wav"]
+            type=[extension.lstrip(".") for extension in MEDIA_EXTENSIONS],
+            # Chiave nuova dopo ogni invio: Streamlit libera il file già passato al job
+            key=f"uploader_{st.session_state.get('upload_round', 0)}"
         )
         
         if uploaded_file:
@@ -237,6 +330,26 @@ if operation == "Trascrivi Audio":
         elif local_file_path:
             st.error("❌ File non trovato")
     
+    follow_mode = source_type != "Carica file" and st.checkbox(
+        "🔴 Segui mentre cresce",
+        value=False,
+        help="Per registrazioni ancora in corso e dirette: trascrive a finestre mentre l'audio arriva"
+    )
+    if follow_mode:
+        follow_window = st.slider(
+            "Finestra (secondi):",
+            min_value=10,
+            max_value=120,
+            value=FOLLOW_WINDOW_SECONDS,
+            step=5,
+            help="Finestre più corte: testo con meno ritardo, ma più chiamate a whisper"
+        )
+        follow_catch_up = st.checkbox(
+            "🐇 Se resta indietro, passa a tiny",
+            value=True,
+            help=f"Oltre {FOLLOW_MAX_LAG_SECONDS}s di ritardo le finestre vanno al modello tiny finché non recupera"
+        )
+    
     st.subheader("⚙️ Impostazioni Avanzate")
     
     col1, col2, col3 = st.columns(3)
@@ -262,344 +375,288 @@ if operation == "Trascrivi Audio":
         else:
             st.warning(f"⚠️ GPU non attiva (userà CPU)")
             if st.button(f"🔥 Attiva GPU per {model_name}", key=f"convert_{model_name}"):
-                if not os.path.exists(f"whisper.cpp/models/ggml-{model_name}.bin"):
+                if model_name not in capabilities["models"]:
                     download_model_if_missing(model_name)
                 convert_model_to_coreml(model_name)
                 st.rerun()
+        
+        # Modelli più grandi di quello scelto, per la cascata
+        larger_models = ["tiny", "base", "small"][["tiny", "base", "small"].index(model_name) + 1:]
+        use_cascade = st.checkbox(
+            "🪜 Cascata di modelli",
+            value=False,
+            disabled=not larger_models,
+            help="Trascrive tutto con il modello scelto e ridecodifica con uno più grande solo i segmenti incerti"
+        )
+        cascade_model = None
+        cascade_threshold = CASCADE_THRESHOLD
+        if use_cascade and larger_models:
+            cascade_model = st.selectbox("Modello per i segmenti incerti:", larger_models, index=len(larger_models) - 1)
+            cascade_threshold = st.slider(
+                "Soglia di confidenza:",
+                min_value=0.3,
+                max_value=0.9,
+                value=CASCADE_THRESHOLD,
+                step=0.05,
+                help="Segmenti con confidenza media dei token sotto soglia vengono ridecodificati"
+            )
+            if cascade_model not in capabilities["models"]:
+                st.warning(f"⚠️ Modello {cascade_model} non scaricato")
+                if st.button(f"📥 Scarica {cascade_model}", key=f"download_{cascade_model}"):
+                    download_model_if_missing(cascade_model)
     
     with col2:
         language = st.selectbox("Lingua:", ["auto", "it", "en"])
     
     with col3:
+        auto_tune = st.checkbox(
+            "🎛️ Autotuning hardware",
+            value=True,
+            help="Calibra worker × thread e durata chunk per questa macchina e questo modello"
+        )
+        
+        tuning_profile = load_tuning_profile(model_name)
+        if auto_tune and tuning_profile:
+            st.caption(
+                f"Profilo: {tuning_profile['workers']} worker × {tuning_profile['threads']} thread "
+                f"({tuning_profile['throughput']:.1f}x realtime)"
+            )
+        elif auto_tune:
+            st.caption("Calibrazione al primo avvio con questo modello")
+        
         chunk_duration = st.selectbox(
             "Durata chunk:",
             [15, 20, 30, 45],
             index=2,
+            disabled=auto_tune,
             help="Chunk più piccoli = più parallelo = più veloce"
         )
-        st.caption(f"Audio diviso in segmenti da {chunk_duration}min")
-    
-    max_workers = st.slider(
-        "🔀 Worker paralleli:",
-        min_value=1,
-        max_value=min(cpu_count, 6),
-        value=min(cpu_count - 1, 4),
-        help=f"Max consigliato: {min(cpu_count - 1, 4)} (lascia 1 core libero)"
-    )
-    st.caption(f"⚡ Processa fino a {max_workers} chunk contemporaneamente")
-
-def download_video(video_url, save_path):
-    st.info("📥 Scaricamento...")
-    os.makedirs(save_path, exist_ok=True)
-    
-    ydl_opts = {
-        'outtmpl': os.path.join(save_path, '%(title)s.%(ext)s'),
-        'format': 'bestvideo+bestaudio/best',
-        'merge_output_format': 'mp4'
-    }
-    
-    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-        info = ydl.extract_info(video_url, download=True)
-        downloaded_file = ydl.prepare_filename(info)
-    
-    st.success(f"✅ Salvato in: {save_path}")
-    return downloaded_file
-
-def save_uploaded_file(uploaded_file):
-    os.makedirs("uploads", exist_ok=True)
-    file_path = os.path.join("uploads", uploaded_file.name)
-    
-    with open(file_path, "wb") as f:
-        shutil.copyfileobj(uploaded_file, f)
-    
-    return file_path
-
-def get_audio_duration(audio_path):
-    """Ottieni durata audio in secondi"""
-    command = [
-        'ffprobe', '-i', audio_path,
-        '-show_entries', 'format=duration',
-        '-v', 'quiet',
-        '-of', 'csv=p=0'
-    ]
-    result = subprocess.run(command, capture_output=True, text=True)
-    try:
-        return float(result.stdout.strip())
-    except:
-        return 0
-
-def split_audio_chunks(audio_path, chunk_duration_minutes=30):
-    """Divide audio in chunk usando ffmpeg"""
-    st.info(f"📂 Divisione in segmenti da {chunk_duration_minutes} minuti...")
-    
-    duration = get_audio_duration(audio_path)
-    if duration == 0:
-        st.warning("Impossibile determinare durata, uso file intero")
-        return [audio_path]
-    
-    duration_minutes = duration / 60
-    
-    if duration_minutes <= chunk_duration_minutes:
-        st.info("✅ Audio breve, nessuna divisione necessaria")
-        return [audio_path]
-    
-    chunk_duration_sec = chunk_duration_minutes * 60
-    num_chunks = int(duration / chunk_duration_sec) + 1
-    
-    st.write(f"🔪 Creazione di {num_chunks} segmenti...")
-    
-    chunks = []
-    os.makedirs("chunks", exist_ok=True)
+        if not auto_tune:
+            st.caption(f"Audio diviso in segmenti da {chunk_duration}min")
+        
+        skip_silence = st.checkbox(
+            "🔇 Salta silenzi (VAD)",
+            value=True,
+            help="Taglia i chunk nelle pause e non trascrive le parti senza parlato"
+        )
     
-    progress_bar = st.progress(0)
+    col_workers, col_threads = st.columns(2)
     
-    for i in range(num_chunks):
-        start_time = i * chunk_duration_sec
-        chunk_path = f"chunks/chunk_{i:03d}.wav"
-        
-        command = [
-            'ffmpeg', '-i', audio_path,
-            '-ss', str(start_time),
-            '-t', str(chunk_duration_sec),
-            '-ar', '16000', '-ac', '1',
-            '-c:a', 'pcm_s16le',
-            chunk_path, '-y'
-        ]
-        
-        result = subprocess.run(
-            command, 
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL
+    with col_workers:
+        max_workers = st.slider(
+            "🔀 Worker paralleli:",
+            min_value=1,
+            max_value=cpu_count,
+            value=min(cpu_count - 1, 4),
+            disabled=auto_tune,
+            help=f"Max consigliato: {min(cpu_count - 1, 4)} (lascia 1 core libero)"
         )
-        
-        if result.returncode == 0 and os.path.exists(chunk_path):
-            chunks.append(chunk_path)
-        
-        progress_bar.progress((i + 1) / num_chunks)
     
-    progress_bar.empty()
-    st.success(f"✅ {len(chunks)} segmenti pronti")
+    with col_threads:
+        worker_threads = st.select_slider(
+            "🧵 Thread per worker:",
+            options=[1, 2, 4, 8],
+            value=2,
+            disabled=auto_tune
+        )
     
-    return chunks
-
-def convert_audio(video_path, output_path="audio.wav"):
-    """Estrae audio ottimizzato per Whisper"""
-    st.info("🎵 Estrazione audio...")
+    if not auto_tune:
+        st.caption(f"⚡ Processa fino a {max_workers} chunk contemporaneamente")
     
-    command = [
-        'ffmpeg', '-i', video_path,
-        '-ar', '16000',
-        '-ac', '1',
-        '-c:a', 'pcm_s16le',
-        output_path, '-y'
-    ]
+    persistent_workers = capabilities["server"] and st.checkbox(
+        "♻️ Worker residenti (whisper-server)",
+        value=True,
+        help="Il modello viene caricato una sola volta per worker invece che a ogni chunk"
+    )
     
-    result = subprocess.run(
-        command, 
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL
+    remote_workers = bool(REMOTE_WORKERS) and st.checkbox(
+        "🌐 Worker remoti",
+        value=True,
+        help=f"I chunk vengono trascritti da {len(REMOTE_WORKERS)} nodi remoti invece che da questa macchina"
+    )
+    if remote_workers:
+        remote_pool = get_remote_pool()
+        st.caption(f"🌐 {len(REMOTE_WORKERS)} nodi, {remote_pool.size} slot")
+    
+    stream_pcm = st.checkbox(
+        "🌊 Streaming PCM (niente WAV su disco)",
+        value=True,
+        help="I chunk passano da ffmpeg a whisper in memoria: ai whisper-server via HTTP, a whisper-cli da stdin"
     )
     
-    if result.returncode == 0:
-        return output_path
-    return None
+    use_cache = st.checkbox(
+        "💾 Cache trascrizioni",
+        value=True,
+        help="Riusa trascrizioni di file e chunk con lo stesso audio, modello e lingua"
+    )
+    if use_cache:
+        cache_stats = get_transcript_cache().stats()
+        st.caption(
+            f"Cache: {cache_stats['entries']} voci ({cache_stats['bytes']/(1024*1024):.1f} MB) • "
+            f"hit {cache_stats['hits']} • miss {cache_stats['misses']}"
+        )
 
-def transcribe_chunk(args):
-    """Trascrivi un singolo chunk - ottimizzato per parallelizzazione"""
-    chunk_path, language, model, chunk_number, total_chunks = args
-    
-    model_path = f"whisper.cpp/models/ggml-{model}.bin"
-    
-    command = [
-        './whisper.cpp/build/bin/whisper-cli',
-        '-m', model_path,
-        '-f', chunk_path,
-        '--output-txt',
-        '--language', language,
-        '-t', '2',
-        '-p', '1'
-    ]
-    
-    try:
-        result = subprocess.run(
-            command, 
-            capture_output=True, 
-            text=True,
-            timeout=600
+@st.cache_resource
+def get_job_queue():
+    """Coda di job condivisa da tutte le sessioni dell'istanza"""
+    metrics_port = os.environ.get("WHISPER_ULTRA_METRICS_PORT")
+    if metrics_port:
+        # /metrics per Prometheus, a parte dalla porta di Streamlit; in rete solo con WHISPER_ULTRA_METRICS_HOST
+        tracing.tracer.serve_metrics(
+            int(metrics_port), os.environ.get("WHISPER_ULTRA_METRICS_HOST", tracing.METRICS_HOST)
         )
-        
-        transcript_file = f"{chunk_path}.txt"
-        
-        if os.path.exists(transcript_file):
-            with open(transcript_file, "r") as f:
-                text = f.read()
-            
-            try:
-                os.remove(transcript_file)
-            except:
-                pass
-            
-            return (chunk_number, text, True)
-        else:
-            return (chunk_number, f"[Errore chunk {chunk_number}]", False)
-    
-    except subprocess.TimeoutExpired:
-        return (chunk_number, f"[Timeout chunk {chunk_number}]", False)
-    except Exception as e:
-        return (chunk_number, f"[Errore {chunk_number}: {str(e)}]", False)
+    return JobQueue(index=get_search_index())
 
-def transcribe_parallel(chunks, language, model, max_workers=4):
-    """Trascrizione parallela con progress bar"""
-    
-    if len(chunks) == 1:
-        st.info("🎙️ Trascrizione in corso...")
-        result = transcribe_chunk((chunks[0], language, model, 0, 1))
-        return result[1] if result[2] else None
-    
-    st.info(f"🚀 Trascrizione parallela con {max_workers} worker...")
-    
-    chunk_args = [
-        (chunk, language, model, i, len(chunks)) 
-        for i, chunk in enumerate(chunks)
-    ]
+def show_job(job, job_queue):
+    """Stato di un job in background e, se finito, la trascrizione"""
+    for level, message in job.messages:
+        getattr(st, level)(message)
+    
+    if job.status == "queued":
+        eta = job_queue.estimated_start(job)
+        eta_text = f", avvio stimato tra ~{eta/60:.0f} min" if eta is not None else ""
+        st.info(f"⏳ In coda (posizione {job_queue.position(job)}{eta_text})")
+        return
+    if job.status == "running":
+        st.progress(job.progress)
+        st.text(job.progress_text or "🎬 Avvio...")
+        if job.follow and job.transcript_path and os.path.exists(job.transcript_path):
+            with open(job.transcript_path, encoding="utf-8") as f:
+                live_text = f.read()
+            # Solo la coda: il testo cresce per tutta la diretta
+            st.code(live_text[-4000:] or "…", language=None)
+            if st.button("⏹️ Ferma", key=f"stop_{job.job_id}", help="Trascrive l'audio già arrivato e chiude"):
+                job_queue.stop(job)
+        cpu = job_queue.scheduler.status(job.job_id)
+        if cpu["owner_waiting"]:
+            eta_text = f", prossimo tra ~{cpu['eta_seconds']:.0f}s" if cpu["eta_seconds"] is not None else ""
+            st.caption(
+                f"🧮 CPU condivisa con {cpu['jobs'] - 1} altri job: {cpu['used_cpu']}/{cpu['cpu_slots']} slot occupati, "
+                f"{cpu['owner_waiting']} segmenti in attesa (posizione {cpu['position']}{eta_text})"
+            )
+        return
+    
+    result = job.result
+    if not result:
+        return
+    if not result["num_chunks"]:
+        st.error("❌ Errore nell'estrazione audio")
+        return
+    
+    text = result["text"]
+    if not text:
+        st.error("❌ Errore durante la trascrizione")
+        return
+    
+    duration = result["duration"]
+    elapsed = result["elapsed"]
+    if duration > 0:
+        speed_factor = duration / elapsed
+        st.success(f"🎉 COMPLETATO in {elapsed/60:.1f} minuti (velocità: {speed_factor:.1f}x)")
+    else:
+        st.success(f"🎉 COMPLETATO in {elapsed/60:.1f} minuti")
     
-    progress_bar = st.progress(0)
-    status_text = st.empty()
+    st.subheader("📝 Trascrizione")
     
-    results = {}
-    completed = 0
+    word_count = len(text.split())
+    char_count = len(text)
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(transcribe_chunk, arg): arg for arg in chunk_args}
-        
-        for future in as_completed(futures):
-            chunk_number, text, success = future.result()
-            results[chunk_number] = text
-            
-            completed += 1
-            progress = completed / len(chunks)
-            progress_bar.progress(progress)
-            status_text.text(f"✅ Completati: {completed}/{len(chunks)} segmenti ({progress*100:.0f}%)")
-            
-            if not success:
-                st.warning(f"⚠️ Problema con segmento {chunk_number}")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("📊 Parole", f"{word_count:,}")
+    with col2:
+        st.metric("📊 Caratteri", f"{char_count:,}")
+    with col3:
+        if duration > 0:
+            st.metric("⚡ Velocità", f"{speed_factor:.1f}x")
     
-    progress_bar.empty()
-    status_text.empty()
+    st.caption(
+        f"💽 Chunk scritti su disco: {result['bytes_written']/(1024*1024):.1f} MB • "
+        f"🔎 Trace {job.trace_id}"
+    )
     
-    sorted_results = [results[i] for i in sorted(results.keys())]
-    full_text = "\n\n".join(sorted_results)
+    st.text_area("", text, height=400, key=f"text_{job.job_id}")
+    st.info(f"💾 Salvato: {job.transcript_path}")
     
-    return full_text
+    st.download_button(
+        "📥 SCARICA TRASCRIZIONE",
+        text,
+        file_name=os.path.basename(job.transcript_path),
+        use_container_width=True,
+        key=f"download_{job.job_id}"
+    )
 
-def cleanup_chunks():
-    """Pulisci directory chunks"""
-    try:
-        if os.path.exists("chunks"):
-            for file in os.listdir("chunks"):
-                try:
-                    os.remove(os.path.join("chunks", file))
-                except:
-                    pass
-            shutil.rmtree("chunks")
-    except:
-        pass
-
-if st.button("▶️ AVVIA TRASCRIZIONE ULTRA-VELOCE", type="primary", use_container_width=True):
-    start_time = time.time()
-    video_path = None
-    video_name = "video"
-    
+if operation != "Cerca nelle trascrizioni" and st.button(
+        "▶️ AVVIA TRASCRIZIONE ULTRA-VELOCE", type="primary", use_container_width=True):
     if operation == "Scarica Video":
-        if video_url:
-            download_video(video_url, save_path)
+        urls = [line.strip() for line in video_urls.splitlines() if line.strip()]
+        if urls:
+            download_batch(urls, save_path, download_concurrency, reporter=StreamlitReporter())
     
     elif operation == "Trascrivi Audio":
+        job_queue = get_job_queue()
+        job_options = {
+            "model": model_name,
+            "language": language,
+            "chunk_duration_minutes": chunk_duration,
+            "max_workers": max_workers,
+            "threads": worker_threads,
+            "vad": skip_silence,
+            "stream": stream_pcm,
+            "auto_tune": auto_tune,
+            "pool": get_remote_pool() if remote_workers else get_whisper_pool() if persistent_workers else None,
+            "cache": get_transcript_cache() if use_cache else None,
+            "cascade_model": cascade_model,
+            "cascade_threshold": cascade_threshold,
+            "cascade_pool": (
+                get_remote_pool() if remote_workers
+                else get_cascade_pool() if persistent_workers else None
+            ) if cascade_model else None
+        }
+        if follow_mode:
+            job_options.update(
+                window_seconds=follow_window,
+                catch_up_model="tiny" if follow_catch_up and model_name != "tiny" else None
+            )
+        job = None
+        
         if source_type == "YouTube (URL)" and video_url:
-            os.makedirs("temp", exist_ok=True)
-            video_path = download_video(video_url, "temp")
-            video_name = os.path.splitext(os.path.basename(video_path))[0]
+            job = job_queue.create(**job_options)
+            job_queue.submit(job, url=video_url, follow=follow_mode)
         
         elif source_type == "Carica file" and 'uploaded_file' in st.session_state:
             uploaded = st.session_state['uploaded_file']
-            video_path = save_uploaded_file(uploaded)
-            video_name = os.path.splitext(uploaded.name)[0]
+            job = job_queue.create(os.path.splitext(uploaded.name)[0], **job_options)
+            job_queue.submit(job, upload=uploaded)
+            del st.session_state['uploaded_file']
+            st.session_state['upload_round'] = st.session_state.get('upload_round', 0) + 1
         
         elif source_type == "File locale" and 'local_file_path' in st.session_state:
             local_path = st.session_state['local_file_path']
-            video_name = os.path.splitext(os.path.basename(local_path))[0]
-            video_path = local_path
+            job = job_queue.create(os.path.splitext(os.path.basename(local_path))[0], **job_options)
+            job_queue.submit(job, video_path=local_path, follow=follow_mode)
         
-        if video_path and os.path.exists(video_path):
-            audio_path = convert_audio(video_path)
-            
-            if audio_path:
-                duration = get_audio_duration(audio_path)
-                if duration > 0:
-                    st.info(f"⏱️ Durata audio: {duration/60:.1f} minuti")
-                
-                chunks = split_audio_chunks(audio_path, chunk_duration)
-                
-                text = transcribe_parallel(chunks, language, model_name, max_workers)
-                
-                cleanup_chunks()
-                
-                if text:
-                    elapsed = time.time() - start_time
-                    
-                    if duration > 0:
-                        speed_factor = duration / elapsed
-                        st.success(f"🎉 COMPLETATO in {elapsed/60:.1f} minuti (velocità: {speed_factor:.1f}x)")
-                    else:
-                        st.success(f"🎉 COMPLETATO in {elapsed/60:.1f} minuti")
-                    
-                    os.makedirs("trascrizioni", exist_ok=True)
-                    timestamp = time.strftime("%Y%m%d_%H%M%S")
-                    final_path = f"trascrizioni/{video_name}_{timestamp}.txt"
-                    
-                    with open(final_path, "w") as f:
-                        f.write(text)
-                    
-                    st.subheader("📝 Trascrizione")
-                    
-                    word_count = len(text.split())
-                    char_count = len(text)
-                    
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("📊 Parole", f"{word_count:,}")
-                    with col2:
-                        st.metric("📊 Caratteri", f"{char_count:,}")
-                    with col3:
-                        if duration > 0:
-                            st.metric("⚡ Velocità", f"{speed_factor:.1f}x")
-                    
-                    st.text_area("", text, height=400)
-                    st.info(f"💾 Salvato: {final_path}")
-                    
-                    st.download_button(
-                        "📥 SCARICA TRASCRIZIONE",
-                        text,
-                        file_name=os.path.basename(final_path),
-                        use_container_width=True
-                    )
-                else:
-                    st.error("❌ Errore durante la trascrizione")
-                
-                if os.path.exists(video_path) and "temp" in video_path:
-                    try:
-                        os.remove(video_path)
-                    except:
-                        pass
-                if os.path.exists(audio_path):
-                    try:
-                        os.remove(audio_path)
-                    except:
-                        pass
-            else:
-                st.error("❌ Errore nell'estrazione audio")
+        if job:
+            st.session_state.setdefault('job_ids', []).insert(0, job.job_id)
         else:
             st.error("❌ Nessun file valido trovato")
 
+# Job di questa sessione, il più recente per primo
+session_jobs = [
+    job for job in (get_job_queue().get(job_id) for job_id in st.session_state.get('job_ids', []))
+    if job is not None
+]
+if session_jobs:
+    st.subheader("📋 Trascrizioni")
+    for i, job in enumerate(session_jobs):
+        status_icon = {"new": "⏳", "queued": "⏳", "running": "⚙️", "done": "✅", "failed": "❌"}[job.status]
+        with st.expander(f"{status_icon} {job.video_name}", expanded=i == 0):
+            show_job(job, get_job_queue())
+
 st.markdown("---")
-st.caption("🚀 Powered by Whisper.cpp + CoreML + Parallel Processing | Ottimizzato per Apple Silicon")
\ No newline at end of file
+st.caption("🚀 Powered by Whisper.cpp + CoreML + Parallel Processing | Ottimizzato per Apple Silicon")
+
+# I job girano in background: la pagina si aggiorna finché ce n'è uno attivo
+if any(job.active for job in session_jobs):
+    time.sleep(1)
+    st.rerun()
\ No newline at end of file
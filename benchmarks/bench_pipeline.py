@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""Benchmark della pipeline con audio sintetico e whisper-cli finto
+
+Misura l'overhead del codice (decodifica, chunking, scheduling), non la velocità di
+whisper: il modello è sostituito da stub_whisper.py. Per ogni durata e stadio
+riporta tempo, fattore realtime, picco RSS e byte scritti, in JSON.
+
+    python benchmarks/bench_pipeline.py --durations 30m 2h 4h -o main.json
+    python benchmarks/bench_pipeline.py --durations 30m --compare main.json
+
+Serve ffmpeg nel PATH. Gli input sintetici restano in --scratch e vengono riusati.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import struct
+import argparse
+import platform
+import resource
+import threading
+import subprocess
+import multiprocessing
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+STUB_WHISPER = os.path.join(BENCH_DIR, "stub_whisper.py")
+
+DURATIONS = {"30m": 1800, "2h": 7200, "4h": 14400}
+SAMPLE_RATE = 16000
+
+def parse_duration(text):
+    """30m, 2h, 90s o secondi"""
+    if text in DURATIONS:
+        return DURATIONS[text]
+    units = {"s": 1, "m": 60, "h": 3600}
+    if text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+def make_synthetic_wav(path, seconds, speech=20, silence=5, seed=0):
+    """WAV mono 16 kHz: raffiche di rumore modulato (parlato) alternate a quasi silenzio"""
+    rng = np.random.default_rng(seed)
+    samples = int(seconds * SAMPLE_RATE)
+    period = (speech + silence) * SAMPLE_RATE
+    block = 60 * SAMPLE_RATE
+
+    with open(path, "wb") as f:
+        f.write(b"RIFF" + struct.pack("<I", 36 + samples * 2) + b"WAVE")
+        f.write(b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16))
+        f.write(b"data" + struct.pack("<I", samples * 2))
+        for start in range(0, samples, block):
+            n = min(block, samples - start)
+            position = (np.arange(start, start + n) % period) < speech * SAMPLE_RATE
+            # Inviluppo a 4 Hz per somigliare alle sillabe
+            envelope = 0.55 + 0.45 * np.sin(2 * np.pi * 4 * np.arange(start, start + n) / SAMPLE_RATE)
+            amplitude = np.where(position, 3000 * envelope, 3)
+            f.write((rng.standard_normal(n) * amplitude).astype("<i2").tobytes())
+
+def setup_stub_whisper(scratch, model):
+    """Finto whisper.cpp: whisper-cli che lancia lo stub, modello vuoto"""
+    whisper_dir = os.path.join(scratch, "whisper.cpp")
+    bin_dir = os.path.join(whisper_dir, "build", "bin")
+    models_dir = os.path.join(whisper_dir, "models")
+    os.makedirs(bin_dir, exist_ok=True)
+    os.makedirs(models_dir, exist_ok=True)
+
+    cli_path = os.path.join(bin_dir, "whisper-cli")
+    with open(cli_path, "w") as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{STUB_WHISPER}" "$@"\n')
+    os.chmod(cli_path, 0o755)
+    open(os.path.join(models_dir, f"ggml-{model}.bin"), "wb").close()
+    return whisper_dir
+
+def current_rss():
+    """RSS attuale del processo in byte (None dove /proc non c'è)"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def max_rss(who):
+    # ru_maxrss è in KB su Linux, in byte su macOS
+    value = resource.getrusage(who).ru_maxrss
+    return value if sys.platform == "darwin" else value * 1024
+
+def dir_size(path):
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+def stub_bytes(log_path):
+    try:
+        with open(log_path) as f:
+            return sum(int(line) for line in f if line.strip())
+    except OSError:
+        return 0
+
+class StageMeter:
+    """Misura uno stadio: tempo, picco RSS campionato e byte scritti nella cartella di lavoro"""
+
+    def __init__(self, work_dir, stub_log, audio_seconds):
+        self.work_dir = work_dir
+        self.stub_log = stub_log
+        self.audio_seconds = audio_seconds
+        self.result = None
+
+    def _sample(self):
+        while not self._stop.wait(0.05):
+            rss = current_rss()
+            if rss:
+                self._peak = max(self._peak, rss)
+
+    def __enter__(self):
+        self._size = dir_size(self.work_dir)
+        self._stub = stub_bytes(self.stub_log)
+        self._peak = current_rss() or 0
+        self._stop = threading.Event()
+        self._sampler = threading.Thread(target=self._sample, daemon=True)
+        self._sampler.start()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        wall = time.perf_counter() - self._start
+        self._stop.set()
+        self._sampler.join()
+        # Senza /proc resta solo il massimo dall'avvio del processo
+        peak = self._peak or max_rss(resource.RUSAGE_SELF)
+        written = max(dir_size(self.work_dir) - self._size, 0) + stub_bytes(self.stub_log) - self._stub
+        self.result = {
+            "wall_s": round(wall, 3),
+            "realtime_factor": round(self.audio_seconds / wall, 1) if wall > 0 else None,
+            "peak_rss_mb": round(peak / (1024 * 1024), 1),
+            "children_peak_rss_mb": round(max_rss(resource.RUSAGE_CHILDREN) / (1024 * 1024), 1),
+            "bytes_written": written
+        }
+        return False
+
+def run_classic(wu, input_path, work_dir, seconds, args, stub_log):
+    """convert_audio → split_audio_chunks → transcribe_parallel, come l'app originale"""
+    stages = {}
+    audio_path = os.path.join(work_dir, "audio.wav")
+    chunks_dir = os.path.join(work_dir, "chunks")
+
+    with StageMeter(work_dir, stub_log, seconds) as meter:
+        wu.convert_audio(input_path, audio_path)
+    stages["convert"] = meter.result
+
+    with StageMeter(work_dir, stub_log, seconds) as meter:
+        chunks = wu.split_audio_chunks(audio_path, args.chunk_minutes, not args.no_vad, chunks_dir)
+    stages["split"] = meter.result
+    stages["split"]["chunks"] = len(chunks)
+
+    with StageMeter(work_dir, stub_log, seconds) as meter:
+        text = wu.transcribe_parallel(chunks, "it", args.model, args.workers, threads=args.threads)
+    stages["transcribe"] = meter.result
+    stages["transcribe"]["ok"] = bool(text)
+    return stages
+
+def run_pipelined(wu, input_path, work_dir, seconds, args, stub_log):
+    """transcribe_pipelined: decodifica e whisper sovrapposti, chunk in memoria con --stream"""
+    io_stats = {}
+    with StageMeter(work_dir, stub_log, seconds) as meter:
+        text, num_chunks, failed = wu.transcribe_pipelined(
+            input_path, "it", args.model, args.chunk_minutes, args.workers, seconds,
+            not args.no_vad, threads=args.threads, chunks_dir=os.path.join(work_dir, "chunks"),
+            stream=args.stream, io_stats=io_stats
+        )
+    stage = meter.result
+    # I chunk su disco vengono cancellati appena trascritti: li conta la pipeline
+    stage["bytes_written"] += io_stats.get("bytes_written", 0)
+    stage.update(chunks=num_chunks, failed=failed, ok=bool(text))
+    return {"pipeline": stage}
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR,
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline_path, threshold):
+    """Confronta i tempi per stadio con un JSON precedente; True se qualcosa è peggiorato"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    previous = {
+        (run["label"], run["mode"], stage): values
+        for run in baseline["runs"] for stage, values in run["stages"].items()
+    }
+
+    regressed = False
+    print(f"\n{'run':<18}{'stadio':<12}{'prima':>10}{'dopo':>10}{'delta':>9}")
+    for run in results["runs"]:
+        for stage, values in run["stages"].items():
+            old = previous.get((run["label"], run["mode"], stage))
+            if not old:
+                continue
+            delta = (values["wall_s"] - old["wall_s"]) / old["wall_s"] if old["wall_s"] else 0
+            flag = ""
+            if delta > threshold:
+                flag = "  ⚠️"
+                regressed = True
+            print(f"{run['label'] + ' ' + run['mode']:<18}{stage:<12}{old['wall_s']:>9.2f}s"
+                  f"{values['wall_s']:>9.2f}s{delta*100:>+8.1f}%{flag}")
+    return regressed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark della pipeline con whisper finto")
+    parser.add_argument("--durations", nargs="+", default=["30m", "2h", "4h"],
+                        help="durate dell'audio sintetico (30m, 2h, 4h, 90s, ...)")
+    parser.add_argument("--mode", choices=["classic", "pipelined", "both"], default="classic")
+    parser.add_argument("--stream", action="store_true", help="pipelined: chunk in memoria")
+    parser.add_argument("--model", default="base")
+    parser.add_argument("--chunk-minutes", type=int, default=30)
+    parser.add_argument("-w", "--workers", type=int, default=max(1, multiprocessing.cpu_count() - 1))
+    parser.add_argument("-t", "--threads", type=int, default=2)
+    parser.add_argument("--no-vad", action="store_true")
+    parser.add_argument("--stub-speed", type=float, default=0,
+                        help="velocità del whisper finto in x realtime (0 = istantaneo)")
+    parser.add_argument("--scratch", default=os.path.join(REPO_DIR, "bench_scratch"))
+    parser.add_argument("-o", "--output", help="file JSON dei risultati (default: stdout)")
+    parser.add_argument("--compare", help="JSON di riferimento da confrontare")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="peggioramento massimo tollerato con --compare (0.10 = 10%%)")
+    args = parser.parse_args(argv)
+
+    scratch = os.path.abspath(args.scratch)
+    inputs_dir = os.path.join(scratch, "inputs")
+    os.makedirs(inputs_dir, exist_ok=True)
+
+    # Il percorso di whisper.cpp si legge all'import del pacchetto
+    os.environ["WHISPER_CPP_DIR"] = setup_stub_whisper(scratch, args.model)
+    os.environ["BENCH_STUB_SPEED"] = str(args.stub_speed)
+    stub_log = os.path.join(scratch, "stub_bytes.log")
+    os.environ["BENCH_STUB_LOG"] = stub_log
+    sys.path.insert(0, REPO_DIR)
+    import whisper_ultra as wu
+
+    modes = ["classic", "pipelined"] if args.mode == "both" else [args.mode]
+    results = {
+        "meta": {
+            "revision": git_revision(),
+            "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": multiprocessing.cpu_count(),
+            "params": {
+                "model": args.model,
+                "chunk_minutes": args.chunk_minutes,
+                "workers": args.workers,
+                "threads": args.threads,
+                "vad": not args.no_vad,
+                "stream": args.stream,
+                "stub_speed": args.stub_speed
+            }
+        },
+        "runs": []
+    }
+
+    for label in args.durations:
+        seconds = parse_duration(label)
+        input_path = os.path.join(inputs_dir, f"synthetic_{seconds}s.wav")
+        if not os.path.exists(input_path):
+            print(f"🎛️ Generazione audio sintetico {label}...", file=sys.stderr)
+            make_synthetic_wav(input_path, seconds)
+
+        for mode in modes:
+            work_dir = os.path.join(scratch, "run")
+            shutil.rmtree(work_dir, ignore_errors=True)
+            os.makedirs(work_dir)
+
+            print(f"⏱️ {label} {mode}...", file=sys.stderr)
+            start = time.perf_counter()
+            runner = run_classic if mode == "classic" else run_pipelined
+            stages = runner(wu, input_path, work_dir, seconds, args, stub_log)
+            wall = time.perf_counter() - start
+
+            results["runs"].append({
+                "label": label,
+                "mode": mode,
+                "audio_seconds": seconds,
+                "stages": stages,
+                "total": {
+                    "wall_s": round(wall, 3),
+                    "realtime_factor": round(seconds / wall, 1) if wall > 0 else None,
+                    "bytes_written": sum(stage["bytes_written"] for stage in stages.values())
+                }
+            })
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+"""whisper-cli finto per i benchmark: stessa interfaccia, nessun modello
+
+Legge la durata del chunk dall'header WAV (da stdin con -f -), aspetta
+durata / BENCH_STUB_SPEED secondi (0 = risposta immediata) e scrive <chunk>.txt
+(o <prefisso>.txt con -of) con ~2.5 parole al secondo, come farebbe whisper-cli
+con --output-txt. I byte scritti finiscono in BENCH_STUB_LOG, se impostato.
+"""
+
+import os
+import sys
+import time
+import struct
+
+def wav_duration(path):
+    if path == "-":
+        header = sys.stdin.buffer.read()[:44]
+    else:
+        with open(path, "rb") as f:
+            header = f.read(44)
+    if len(header) < 44 or header[:4] != b"RIFF":
+        return 0.0
+    byte_rate = struct.unpack("<I", header[28:32])[0]
+    data_size = struct.unpack("<I", header[40:44])[0]
+    return data_size / byte_rate if byte_rate else 0.0
+
+def main(argv):
+    chunk_path = argv[argv.index("-f") + 1]
+    duration = wav_duration(chunk_path)
+
+    speed = float(os.environ.get("BENCH_STUB_SPEED", "0"))
+    if speed > 0:
+        time.sleep(duration / speed)
+
+    words = int(duration * 2.5)
+    text = " ".join(f"parola{i % 1000}" for i in range(words)) + "\n"
+    output_prefix = argv[argv.index("-of") + 1] if "-of" in argv else chunk_path
+    with open(f"{output_prefix}.txt", "w") as f:
+        f.write(text)
+
+    log_path = os.environ.get("BENCH_STUB_LOG")
+    if log_path:
+        with open(log_path, "a") as log:
+            log.write(f"{len(text.encode())}\n")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,48 @@
+"""Fixture comuni: whisper.cpp finto (benchmarks/stub_whisper.py) e audio sintetico
+
+Il percorso di whisper.cpp si legge all'import del pacchetto: lo stub va
+preparato prima che i test importino whisper_ultra.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, os.path.join(REPO_DIR, "benchmarks"))
+
+from bench_pipeline import make_synthetic_wav, setup_stub_whisper
+
+STUB_SCRATCH = tempfile.mkdtemp(prefix="whisper_ultra_tests_")
+os.environ["WHISPER_CPP_DIR"] = setup_stub_whisper(STUB_SCRATCH, "base")
+os.environ.pop("WHISPER_ULTRA_TRACE", None)
+
+def pytest_sessionfinish(session, exitstatus):
+    shutil.rmtree(STUB_SCRATCH, ignore_errors=True)
+
+@pytest.fixture(autouse=True)
+def work_dir(tmp_path, monkeypatch):
+    """Ogni test gira in una cartella sua: cache/, chunks/ e trascrizioni/ non finiscono nel repo"""
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+@pytest.fixture
+def speech_wav(tmp_path):
+    """Crea un WAV 16 kHz mono con 20 s di parlato e 5 s di silenzio alternati; restituisce il percorso"""
+    def make(seconds, name="speech.wav"):
+        path = str(tmp_path / name)
+        make_synthetic_wav(path, seconds)
+        return path
+    return make
+
+@pytest.fixture
+def speech_bytes(speech_wav):
+    """Come speech_wav, ma il WAV in memoria"""
+    def make(seconds):
+        with open(speech_wav(seconds, "memory.wav"), "rb") as f:
+            return f.read()
+    return make
@@ -0,0 +1,93 @@
+"""Divisione in chunk con il VAD e mappa dei tempi verso il file originale"""
+
+import struct
+
+from whisper_ultra.audio import (
+    VAD_FRAME_SEC, WAV_HEADER_BYTES, build_wav_header, chunk_seconds, chunk_time_to_source, read_wav_info,
+    split_audio_chunks, split_chunk
+)
+
+# make_synthetic_wav: 20 s di parlato e 5 s di silenzio, ripetuti
+PERIOD = 25
+SPEECH = 20
+
+def in_silence(t):
+    """True se t cade nel mezzo di una pausa dell'audio sintetico"""
+    return SPEECH + 1 < t % PERIOD < PERIOD - 1
+
+def test_split_audio_chunks_keeps_speech_and_maps_it(speech_wav, tmp_path):
+    path = speech_wav(300)
+    chunks = split_audio_chunks(path, chunk_duration_minutes=1, vad=True, chunks_dir=str(tmp_path / "chunks"))
+
+    assert [number for _, number, _ in chunks] == list(range(len(chunks)))
+    assert len(chunks) >= 4
+
+    previous_end = 0.0
+    speech = 0.0
+    for chunk_path, _, segment_map in chunks:
+        assert segment_map
+        # La mappa copre tutto il WAV del chunk, senza buchi
+        chunk_time = 0.0
+        for chunk_start, source_start, length in segment_map:
+            assert abs(chunk_start - chunk_time) < 1e-6
+            assert source_start >= previous_end - 1e-6
+            assert not in_silence(source_start) and not in_silence(source_start + length)
+            chunk_time += length
+            previous_end = source_start + length
+        assert abs(read_wav_info(chunk_path)["duration"] - chunk_time) < VAD_FRAME_SEC
+        speech += chunk_time
+
+    # Resta il parlato (più il margine attorno alle parole), il silenzio lungo se ne va
+    assert 300 * SPEECH / PERIOD <= speech < 300 * SPEECH / PERIOD + 12
+
+def test_chunk_time_to_source_follows_the_segment_map(speech_wav, tmp_path):
+    path = speech_wav(120)
+    chunks = split_audio_chunks(path, chunk_duration_minutes=1, vad=True, chunks_dir=str(tmp_path / "chunks"))
+    _, _, segment_map = chunks[-1]
+
+    for chunk_start, source_start, length in segment_map:
+        assert abs(chunk_time_to_source(segment_map, chunk_start) - source_start) < 1e-6
+        assert abs(chunk_time_to_source(segment_map, chunk_start + length / 2) - (source_start + length / 2)) < 1e-6
+    # Oltre la fine: l'ultimo istante di parlato
+    last_start, last_source, last_length = segment_map[-1]
+    assert chunk_time_to_source(segment_map, last_start + last_length + 60) == last_source + last_length
+
+def test_short_audio_without_vad_is_a_single_chunk(speech_wav, tmp_path):
+    path = speech_wav(30)
+    chunks = split_audio_chunks(path, chunk_duration_minutes=1, vad=False, chunks_dir=str(tmp_path / "chunks"))
+
+    assert chunks == [(path, 0, [(0.0, 0.0, read_wav_info(path)["duration"])])]
+
+def test_read_wav_info_skips_extra_chunks_and_clamps_the_size(tmp_path):
+    path = tmp_path / "pipe.wav"
+    header = build_wav_header(0xFFFFFFFF - 36)
+    # Chunk LIST prima di data, come li scrive ffmpeg, e dimensione dei dati lasciata a 0xFFFFFFFF
+    path.write_bytes(header[:36] + b"LIST" + struct.pack("<I", 4) + b"INFO" + header[36:] + b"\0" * 32001)
+
+    info = read_wav_info(str(path))
+    assert info["data_offset"] == 56
+    assert info["data_size"] == 32000
+    assert info["duration"] == 1.0
+
+def test_malformed_wav_header_is_not_a_wav(tmp_path):
+    header = bytearray(build_wav_header(32000))
+    # block_align (byte 32) a zero: prima finiva in ZeroDivisionError
+    header[32:34] = b"\0\0"
+    path = tmp_path / "broken.wav"
+    path.write_bytes(bytes(header) + b"\0" * 32000)
+
+    assert read_wav_info(str(path)) is None
+    assert split_audio_chunks(str(path), chunks_dir=str(tmp_path / "chunks")) == [(str(path), 0, [])]
+
+def test_split_chunk_cuts_in_the_pauses(speech_bytes):
+    wav = speech_bytes(100)
+    pieces = split_chunk(wav, 4)
+
+    assert len(pieces) == 4
+    assert pieces[0][1] == 0.0
+    for _, start in pieces[1:]:
+        # Il punto più silenzioso entro 5 s dal confine è nella pausa
+        assert SPEECH <= start % PERIOD < PERIOD
+    # I pezzi insieme sono esattamente il chunk di partenza
+    assert b"".join(piece[WAV_HEADER_BYTES:] for piece, _ in pieces) == wav[WAV_HEADER_BYTES:]
+    assert abs(sum(chunk_seconds(piece) for piece, _ in pieces) - chunk_seconds(wav)) < 1e-6
@@ -0,0 +1,107 @@
+"""Profili di autotuning: salvataggi concorrenti, calibrazioni fallite e durata minima dei chunk"""
+
+import os
+import time
+import threading
+import multiprocessing
+from types import SimpleNamespace
+
+from whisper_ultra import autotune
+from whisper_ultra.audio import chunk_seconds
+
+def test_concurrent_saves_keep_every_profile(work_dir):
+    models = [f"model{i}" for i in range(8)]
+    barrier = threading.Barrier(len(models))
+
+    def save(model):
+        barrier.wait()
+        autotune.save_tuning_profile(model, {"workers": 2, "threads": 2, "cores": multiprocessing.cpu_count()})
+
+    threads = [threading.Thread(target=save, args=(model,)) for model in models]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for model in models:
+        assert autotune.load_tuning_profile(model)["workers"] == 2
+    # Nessun file temporaneo rimasto accanto al profilo
+    assert os.listdir(work_dir) == [autotune.AUTOTUNE_PROFILE]
+
+def test_failed_calibration_is_not_repeated(monkeypatch):
+    autotune.save_tuning_profile("base", {"cores": multiprocessing.cpu_count(), "failed_at": time.time()})
+
+    def calibrate(*args, **kwargs):
+        raise AssertionError("calibrazione ripetuta")
+
+    monkeypatch.setattr(autotune, "calibrate_workers", calibrate)
+    assert autotune.load_tuning_profile("base") is None
+    assert autotune.calibration_failed("base")
+    assert autotune.tune_for_file("video.mp4", "base", "it", 600) is None
+    # Su un altro modello la calibrazione si fa
+    assert not autotune.calibration_failed("small")
+
+def test_failed_calibration_is_retried_later(monkeypatch):
+    failed_at = time.time() - autotune.AUTOTUNE_RETRY_SECONDS - 1
+    autotune.save_tuning_profile("base", {"cores": multiprocessing.cpu_count(), "failed_at": failed_at})
+    calls = []
+
+    def calibrate(*args, **kwargs):
+        calls.append(args)
+        return {"workers": 3, "threads": 2, "throughput": 10.0, "min_chunk_minutes": 12}
+
+    monkeypatch.setattr(autotune, "calibrate_workers", calibrate)
+    assert autotune.tune_for_file("video.mp4", "base", "it", 3600) == (3, 2, 12)
+    assert len(calls) == 1
+
+def test_min_chunk_minutes_is_measured(speech_wav, tmp_path, monkeypatch):
+    sample = speech_wav(30, "sample.wav")
+    clock = [0.0]
+
+    def transcribe_chunk(args, pool=None, threads=2):
+        # 3 s fissi per chunk più 0.1 s per secondo di audio
+        clock[0] += 3 + 0.1 * chunk_seconds(args[0])
+        return args[3], "testo", True
+
+    monkeypatch.setattr(autotune, "time", SimpleNamespace(time=lambda: clock[0]))
+    monkeypatch.setattr(autotune, "transcribe_chunk", transcribe_chunk)
+    info = autotune.read_wav_info(sample)
+    minutes = autotune.measure_min_chunk_minutes(sample, info, "base", "it", chunks_dir=str(tmp_path))
+
+    # Costo fisso al 5%: 3 / (0.05 × 0.1) = 600 s
+    assert minutes == 10
+    assert not os.path.exists(tmp_path / "autotune_short.wav")
+
+def test_recommended_chunk_minutes_honours_measured_minimum():
+    profile = {"workers": 8, "threads": 2, "min_chunk_minutes": 20}
+    assert autotune.recommended_chunk_minutes(3600, 8) == autotune.MIN_AUTOTUNE_CHUNK_MINUTES
+    assert autotune.profile_chunk_minutes(3600, profile) == 20
+    assert autotune.profile_chunk_minutes(3600, {"workers": 1, "threads": 2}) == 30
+
+def test_calibration_goes_through_the_scheduler(tmp_path, monkeypatch):
+    from bench_pipeline import make_synthetic_wav
+    from whisper_ultra.scheduler import CpuScheduler
+
+    scheduler = CpuScheduler(cpu_slots=2, memory_mb=None)
+    seen = []
+
+    def ffmpeg(command, **kwargs):
+        # Il campione che ffmpeg estrarrebbe dal video
+        make_synthetic_wav(command[-2], 30)
+
+    def transcribe_chunk(args, pool=None, threads=2):
+        seen.append((threads, scheduler.status("calibrazione")))
+        return args[3], "testo", True
+
+    monkeypatch.setattr(autotune, "subprocess", SimpleNamespace(run=ffmpeg, DEVNULL=None))
+    monkeypatch.setattr(autotune, "transcribe_chunk", transcribe_chunk)
+    profile = autotune.calibrate_workers(
+        "video.mp4", "base", "it", 600, chunks_dir=str(tmp_path), scheduler=scheduler, owner="calibrazione"
+    )
+
+    assert profile["workers"] * profile["threads"] <= 2
+    # Ogni prova tiene i suoi slot, senza mai superare quelli dello scheduler
+    assert seen and all(status["held"] >= threads for threads, status in seen)
+    assert all(status["used_cpu"] <= 2 for _, status in seen)
+    assert {threads for threads, _ in seen} == {1, 2}
+    assert scheduler.status()["used_cpu"] == 0
@@ -0,0 +1,93 @@
+"""Cache delle trascrizioni: chiavi, eviction LRU, alias delle sorgenti e contatori"""
+
+import itertools
+from types import SimpleNamespace
+
+from whisper_ultra import cache as cache_module
+from whisper_ultra.cache import TranscriptCache, file_digest
+
+def make_cache(tmp_path, monkeypatch, max_bytes):
+    # Orologio che avanza a ogni accesso: l'ordine LRU non dipende dalla risoluzione di time.time
+    ticks = itertools.count()
+    monkeypatch.setattr(cache_module, "time", SimpleNamespace(time=lambda: float(next(ticks))))
+    return TranscriptCache(str(tmp_path / "cache" / "transcripts.sqlite3"), max_bytes=max_bytes)
+
+def test_key_depends_on_model_language_and_params():
+    key = TranscriptCache.key("pcm", "base", "it")
+    assert key == TranscriptCache.key("pcm", "base", "it")
+    assert len({
+        key,
+        TranscriptCache.key("pcm", "small", "it"),
+        TranscriptCache.key("pcm", "base", "en"),
+        TranscriptCache.key("pcm", "base", "it", params="-bs 5"),
+        TranscriptCache.key("altro", "base", "it"),
+    }) == 5
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, monkeypatch, max_bytes=10)
+    cache.put("a", "aaaaa")
+    cache.put("b", "bbbbb")
+    # Letta per ultima: a diventa la più recente e resta
+    assert cache.get("a") == "aaaaa"
+    cache.put("c", "ccccc")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "aaaaa"
+    assert cache.get("c") == "ccccc"
+    assert cache.stats() == {"hits": 3, "misses": 1, "evictions": 1, "entries": 2, "bytes": 10}
+
+def test_size_counts_utf8_bytes(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, monkeypatch, max_bytes=8)
+    cache.put("a", "però")
+    assert cache.stats()["bytes"] == 5
+    # Insieme fanno 10 byte, oltre il limite di 8: esce la più vecchia
+    cache.put("b", "così")
+    assert cache.stats()["bytes"] == 5
+    assert cache.get("a") is None
+    assert cache.get("b") == "così"
+
+def test_replacing_an_entry_keeps_one_copy(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, monkeypatch, max_bytes=100)
+    cache.put("a", "prima")
+    cache.put("a", "dopo")
+    assert cache.get("a") == "dopo"
+    assert cache.stats()["entries"] == 1
+
+def test_aliases_map_sources_to_pcm_and_persist(tmp_path, monkeypatch):
+    cache = make_cache(tmp_path, monkeypatch, max_bytes=100)
+    assert cache.pcm_digest_for("video") is None
+    cache.add_alias("video", "pcm1")
+    # Lo stesso file ridecodificato diversamente: vale l'ultimo PCM
+    cache.add_alias("video", "pcm2")
+    cache.put(TranscriptCache.key("pcm2", "base", "it"), "testo")
+
+    reopened = TranscriptCache(str(tmp_path / "cache" / "transcripts.sqlite3"))
+    pcm_digest = reopened.pcm_digest_for("video")
+    assert pcm_digest == "pcm2"
+    assert reopened.get(TranscriptCache.key(pcm_digest, "base", "it")) == "testo"
+
+def test_file_digest_from_offset(tmp_path):
+    path = tmp_path / "data.bin"
+    path.write_bytes(b"header" + b"x" * 3000)
+    assert file_digest(str(path), offset=6) == file_digest(str(path), offset=6, block_size=7)
+    assert file_digest(str(path)) != file_digest(str(path), offset=6)
+
+def test_chunk_in_memory_and_on_disk_share_the_entry(tmp_path, speech_wav, monkeypatch):
+    from whisper_ultra import pipeline
+
+    calls = []
+    def transcribe_chunk(args, pool=None, threads=2, timeout=600, cancel=None):
+        calls.append(args[0])
+        return args[3], "testo del chunk", True
+
+    monkeypatch.setattr(pipeline, "transcribe_chunk", transcribe_chunk)
+    cache = TranscriptCache(str(tmp_path / "cache" / "transcripts.sqlite3"))
+    path = speech_wav(10)
+    with open(path, "rb") as f:
+        data = f.read()
+
+    assert pipeline.transcribe_chunk_cached((path, "it", "base", 0, 1), cache) == (0, "testo del chunk", True)
+    assert pipeline.transcribe_chunk_cached((data, "it", "base", 3, 4), cache) == (3, "testo del chunk", True)
+    # Altra lingua: whisper gira di nuovo
+    pipeline.transcribe_chunk_cached((data, "en", "base", 3, 4), cache)
+    assert len(calls) == 2
@@ -0,0 +1,95 @@
+"""Cascata: scelta dei segmenti incerti e sostituzione del loro testo col modello grande"""
+
+import pytest
+
+from whisper_ultra import cascade as cascade_module
+from whisper_ultra.audio import chunk_seconds
+from whisper_ultra.cascade import MIN_SPAN_SECONDS, Cascade, weak_spans
+
+def segment(start, end, text, confidence):
+    return {"start": start, "end": end, "text": text, "confidence": confidence}
+
+def test_weak_spans_merge_neighbours_and_pad():
+    segments = [
+        segment(0.0, 2.0, " sicuro", 0.9),
+        segment(2.0, 4.0, " incerto", 0.3),
+        segment(4.0, 6.0, " anche", 0.5),
+        segment(6.0, 8.0, " sicuro", 0.95),
+        segment(8.0, 8.2, " breve", 0.1),
+        segment(8.2, 9.0, " ", 0.1),
+        segment(9.0, 9.5, " senza", None),
+    ]
+    spans = weak_spans(segments, threshold=0.6, padding=0.3, duration=9.5)
+
+    assert spans[0] == pytest.approx((1.7, 6.3, [1, 2]))
+    # Segmento troppo corto per whisper-cli: allargato al minimo attorno a sé
+    start, end, indexes = spans[1]
+    assert indexes == [4]
+    assert end - start == pytest.approx(MIN_SPAN_SECONDS)
+    assert start < 8.0 and end > 8.2
+    assert len(spans) == 2
+
+def test_weak_spans_stay_inside_the_chunk_and_long_enough():
+    segments = [segment(0.0, 0.5, " a", 0.1), segment(0.5, 9.7, " b", 0.9), segment(9.7, 10.0, " c", 0.1)]
+    spans = weak_spans(segments, duration=10.0)
+    assert [indexes for _, _, indexes in spans] == [[0], [2]]
+    for start, end, _ in spans:
+        assert 0.0 <= start and end <= 10.0
+        assert end - start == pytest.approx(MIN_SPAN_SECONDS)
+
+@pytest.fixture
+def fake_whisper(monkeypatch):
+    """Passaggio veloce con segmenti fissi; il modello grande registra l'audio ricevuto"""
+    calls = {"strong": []}
+    segments = [
+        segment(0.0, 3.0, " uno", 0.9),
+        segment(3.0, 5.0, " due", 0.2),
+        segment(5.0, 7.0, " tre", 0.4),
+        segment(7.0, 10.0, " quattro", 0.95),
+    ]
+
+    def transcribe_segments(chunk_path, language, model, pool=None, threads=2, timeout=600):
+        calls["fast"] = (model, language)
+        return segments
+
+    def transcribe_chunk(args, pool=None, threads=2, timeout=600, cancel=None):
+        wav, language, model, chunk_number, total_chunks = args
+        calls["strong"].append((model, round(chunk_seconds(wav), 2)))
+        if calls.get("fail"):
+            return chunk_number, "[Errore]", False
+        return chunk_number, "  due e tre\n", True
+
+    monkeypatch.setattr(cascade_module, "transcribe_segments", transcribe_segments)
+    monkeypatch.setattr(cascade_module, "transcribe_chunk", transcribe_chunk)
+    return calls
+
+def test_weak_segments_are_redecoded_with_the_big_model(speech_wav, fake_whisper):
+    path = speech_wav(10)
+    cascade = Cascade("small", threshold=0.6)
+
+    chunk_number, text, success = cascade.transcribe((path, "it", "tiny", 2, 5))
+
+    assert (chunk_number, success) == (2, True)
+    assert text == " uno\n due e tre\n quattro\n"
+    assert fake_whisper["fast"] == ("tiny", "it")
+    # Solo l'audio dei segmenti incerti, con il margine: 2.7 s - 7.3 s
+    assert fake_whisper["strong"] == [("small", 4.6)]
+    stats = cascade.stats()
+    assert (stats["segments"], stats["weak_segments"], stats["failed_spans"]) == (4, 2, 0)
+    assert stats["redecoded_seconds"] == pytest.approx(4.6)
+    assert stats["audio_seconds"] == pytest.approx(10.0)
+
+def test_failed_redecode_keeps_the_fast_text(speech_wav, fake_whisper):
+    fake_whisper["fail"] = True
+    cascade = Cascade("small", threshold=0.6)
+
+    _, text, success = cascade.transcribe((speech_wav(10), "it", "tiny", 0, 1))
+
+    assert success
+    assert text == " uno\n due\n tre\n quattro\n"
+    assert cascade.stats()["failed_spans"] == 1
+    assert cascade.stats()["redecoded_seconds"] == 0.0
+
+def test_label_separates_cache_keys():
+    assert Cascade("small", 0.6).label("tiny") == "tiny>small@0.6"
+    assert Cascade("small", 0.5).label("tiny") != Cascade("small", 0.6).label("tiny")
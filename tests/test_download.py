@@ -0,0 +1,91 @@
+"""AudioStream: download a byte range in parallele e ripiego sequenziale se il server non li rispetta"""
+
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from whisper_ultra import download
+
+PAYLOAD = os.urandom(10500)
+RANGE_RE = re.compile(r"bytes=(\d+)-(\d+)")
+
+@pytest.fixture
+def server():
+    """Server HTTP locale; mode decide come tratta l'header Range"""
+    state = {"mode": "ok", "requests": []}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            match = RANGE_RE.match(self.headers.get("Range") or "")
+            state["requests"].append(self.headers.get("Range"))
+            mode = state["mode"]
+            honored = match and mode != "ignore" and not (mode == "late" and int(match.group(1)) >= 3000)
+            if honored:
+                start, end = int(match.group(1)), int(match.group(2))
+                if mode == "shifted":
+                    start, end = start + 1, end + 1
+                body = PAYLOAD[start:end + 1]
+                if mode == "short":
+                    body = body[:-10]
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(PAYLOAD)}")
+            else:
+                body = PAYLOAD
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{httpd.server_port}/audio.webm"
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+@pytest.fixture(autouse=True)
+def small_ranges(monkeypatch):
+    monkeypatch.setattr(download, "RANGE_BLOCK_BYTES", 1000)
+
+def stream(server, **fmt):
+    return download.AudioStream("audio", 1, "test:1", dict({"url": server["url"], "filesize": len(PAYLOAD)}, **fmt),
+                                connections=2)
+
+def test_ranges_are_reassembled_in_order(server):
+    audio = stream(server)
+
+    assert b"".join(audio.blocks()) == PAYLOAD
+    assert audio.bytes_read == len(PAYLOAD)
+    assert len(server["requests"]) == 11
+    assert all(server["requests"])
+
+@pytest.mark.parametrize("mode", ["ignore", "short", "late", "shifted"])
+def test_unreliable_ranges_fall_back_to_a_sequential_get(server, mode):
+    server["mode"] = mode
+    audio = stream(server)
+
+    assert b"".join(audio.blocks()) == PAYLOAD
+    assert audio.bytes_read == len(PAYLOAD)
+    # L'ultima richiesta è il GET sequenziale, senza range
+    assert server["requests"][-1] is None
+
+def test_check_range_accepts_only_the_exact_bytes():
+    class Response:
+        def __init__(self, status, content_range=None):
+            self.status = status
+            self.headers = {"Content-Range": content_range} if content_range else {}
+
+    download._check_range(Response(206, "bytes 0-9/100"), b"x" * 10, 0, 9)
+    with pytest.raises(download.RangeError):
+        download._check_range(Response(200), b"x" * 100, 0, 9)
+    with pytest.raises(download.RangeError):
+        download._check_range(Response(206, "bytes 0-9/100"), b"x" * 9, 0, 9)
+    with pytest.raises(download.RangeError):
+        download._check_range(Response(206, "bytes 1-10/100"), b"x" * 10, 0, 9)
+    assert issubclass(download.RangeError, OSError)
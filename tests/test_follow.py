@@ -0,0 +1,80 @@
+"""GrowingFileSource: lettura di un file mentre un altro thread lo sta ancora scrivendo"""
+
+import os
+import time
+import threading
+
+from whisper_ultra.follow import GrowingFileSource
+
+def writer(path, parts, pause):
+    """Scrive parts in coda a path una alla volta, con pause in mezzo, come un registratore"""
+    def run():
+        for part in parts:
+            time.sleep(pause)
+            with open(path, "ab") as f:
+                f.write(part)
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+def test_reads_what_is_appended_until_the_file_stops_growing(tmp_path):
+    path = str(tmp_path / "riunione.wav")
+    parts = [os.urandom(1000 * (i + 1)) for i in range(5)]
+    with open(path, "wb") as f:
+        f.write(b"RIFF")
+    source = GrowingFileSource(path, idle_seconds=0.5, poll=0.01, block_size=700)
+    thread = writer(path, parts, pause=0.1)
+
+    start = time.time()
+    data = b"".join(source.blocks())
+    thread.join()
+
+    # Anche i byte arrivati dopo che la lettura era già in fondo al file
+    assert data == b"RIFF" + b"".join(parts)
+    assert source.bytes_read == len(data)
+    # Finisce solo dopo idle_seconds senza crescita, non alla prima fine del file
+    assert time.time() - start >= 0.9
+
+def test_stop_ends_the_blocks_while_the_file_still_grows(tmp_path):
+    path = str(tmp_path / "diretta.wav")
+    with open(path, "wb") as f:
+        f.write(b"x" * 100)
+    source = GrowingFileSource(path, idle_seconds=60, poll=0.01)
+    stop_writing = threading.Event()
+
+    def grow():
+        while not stop_writing.is_set():
+            with open(path, "ab") as f:
+                f.write(b"y" * 100)
+            time.sleep(0.02)
+
+    thread = threading.Thread(target=grow)
+    thread.start()
+    read = []
+
+    def consume():
+        for block in source.blocks():
+            read.append(block)
+
+    reader = threading.Thread(target=consume)
+    reader.start()
+    time.sleep(0.3)
+    source.stop()
+    reader.join(2)
+    stop_writing.set()
+    thread.join()
+
+    assert not reader.is_alive()
+    assert read and b"".join(read).startswith(b"x" * 100 + b"y")
+
+def test_identity_and_ffmpeg_options(tmp_path):
+    path = str(tmp_path / "lezione.wav")
+    open(path, "wb").close()
+    source = GrowingFileSource(path)
+
+    assert source.title == "lezione"
+    assert source.digest == GrowingFileSource(path).digest
+    assert source.digest != GrowingFileSource(str(tmp_path / "altra.wav")).digest
+    # L'header di un WAV in registrazione ha una lunghezza provvisoria
+    assert source.input_options == ("-ignore_length", "1")
+    assert GrowingFileSource(str(tmp_path / "lezione.mp3")).input_options != ("-ignore_length", "1")
@@ -0,0 +1,142 @@
+"""Coda di job: cartelle di lavoro, lock per contenuto, upload e salvataggio (transcribe_file simulato)"""
+
+import io
+import os
+import time
+import threading
+
+import pytest
+
+from whisper_ultra import download, jobqueue
+from whisper_ultra.jobqueue import JobQueue
+
+def wait_finished(*jobs, timeout=10):
+    deadline = time.time() + timeout
+    while not all(job.finished_at for job in jobs):
+        assert time.time() < deadline, "job non finiti"
+        time.sleep(0.01)
+
+def result(text="testo", failed=0, num_chunks=1):
+    return {
+        "text": text, "failed": failed, "num_chunks": num_chunks, "job_id": None, "chunks": None,
+        "model": "base", "language": "it", "duration": 10.0
+    }
+
+@pytest.fixture
+def fake_transcribe(monkeypatch):
+    """transcribe_file simulato: registra le chiamate; behaviour(path) dà il risultato"""
+    calls = []
+    state = {"running": 0, "max_running": 0, "behaviour": lambda path: result()}
+    lock = threading.Lock()
+
+    def transcribe_file(video_path, **options):
+        with lock:
+            calls.append((video_path, options))
+            state["running"] += 1
+            state["max_running"] = max(state["max_running"], state["running"])
+        try:
+            # I chunk del job stanno nella sua cartella di lavoro
+            os.makedirs(options["chunks_dir"], exist_ok=True)
+            return state["behaviour"](video_path)
+        finally:
+            with lock:
+                state["running"] -= 1
+
+    monkeypatch.setattr(jobqueue, "transcribe_file", transcribe_file)
+    state["calls"] = calls
+    return state
+
+def write_file(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+    return str(path)
+
+@pytest.mark.parametrize("outcome", ["done", "chunk_failed", "no_chunks", "exception"])
+def test_work_dir_is_always_removed(tmp_path, fake_transcribe, outcome):
+    def behaviour(path):
+        if outcome == "exception":
+            raise RuntimeError("ffmpeg esploso")
+        return {
+            "done": result(),
+            "chunk_failed": result(failed=1, num_chunks=2),
+            "no_chunks": result(text=None, num_chunks=0),
+        }[outcome]
+
+    fake_transcribe["behaviour"] = behaviour
+    queue = JobQueue(str(tmp_path / "work"), concurrency=1)
+    job = queue.create("video", model="base")
+    queue.submit(job, video_path=write_file(tmp_path / "video.wav", b"audio"))
+    wait_finished(job)
+
+    assert not os.path.exists(job.work_dir)
+    assert job.status == ("done" if outcome in ("done", "chunk_failed") else "failed")
+    assert (job.transcript_path is not None) == (outcome in ("done", "chunk_failed"))
+
+def test_same_content_under_different_names_runs_once_at_a_time(tmp_path, fake_transcribe):
+    def behaviour(path):
+        time.sleep(0.2)
+        return result()
+
+    fake_transcribe["behaviour"] = behaviour
+    queue = JobQueue(str(tmp_path / "work"), concurrency=2)
+    first = queue.create("primo", model="base")
+    second = queue.create("secondo", model="base")
+    queue.submit(first, video_path=write_file(tmp_path / "a.wav", b"stesso audio"))
+    queue.submit(second, video_path=write_file(tmp_path / "copia.wav", b"stesso audio"))
+    wait_finished(first, second)
+
+    assert fake_transcribe["max_running"] == 1
+    # Il digest calcolato per il lock arriva a transcribe_file: niente secondo hash
+    digests = {options["source_digest"] for _, options in fake_transcribe["calls"]}
+    assert len(digests) == 1
+
+def test_different_content_runs_in_parallel(tmp_path, fake_transcribe):
+    barrier = threading.Barrier(2, timeout=5)
+
+    def behaviour(path):
+        # Si sblocca solo se i due job girano insieme
+        barrier.wait()
+        return result()
+
+    fake_transcribe["behaviour"] = behaviour
+    queue = JobQueue(str(tmp_path / "work"), concurrency=2)
+    jobs = [queue.create(f"video{i}", model="base") for i in range(2)]
+    for i, job in enumerate(jobs):
+        queue.submit(job, video_path=write_file(tmp_path / f"{i}.wav", f"audio {i}".encode()))
+    wait_finished(*jobs)
+
+    assert [job.status for job in jobs] == ["done", "done"]
+    assert queue._key_locks == {}
+
+def test_missing_file_fails_without_transcribing(tmp_path, fake_transcribe):
+    queue = JobQueue(str(tmp_path / "work"), concurrency=1)
+    job = queue.create("video")
+    queue.submit(job, video_path=str(tmp_path / "manca.wav"))
+    wait_finished(job)
+
+    assert job.status == "failed"
+    assert fake_transcribe["calls"] == []
+    assert ("error", "❌ Nessun file valido trovato") in job.messages
+
+@pytest.mark.parametrize("outcome", ["cached", "exception"])
+def test_upload_is_released_even_if_ffmpeg_never_reads_it(tmp_path, fake_transcribe, monkeypatch, outcome):
+    # Durata senza ffprobe: basta consumare i blocchi come farebbe lui
+    monkeypatch.setattr(download, "get_stream_duration", lambda blocks: sum(len(b) for b in blocks) / 32000)
+
+    def behaviour(source):
+        if outcome == "exception":
+            raise RuntimeError("ffmpeg esploso")
+        # Trascrizione trovata in cache: feed() non parte mai
+        return result()
+
+    fake_transcribe["behaviour"] = behaviour
+    upload = io.BytesIO(b"audio caricato" * 1000)
+    queue = JobQueue(str(tmp_path / "work"), concurrency=1)
+    job = queue.create("caricato")
+    queue.submit(job, upload=upload)
+    wait_finished(job)
+
+    source = fake_transcribe["calls"][0][0]
+    assert isinstance(source, download.UploadSource)
+    assert upload.closed and source.fileobj is None
+    assert job.upload is None
@@ -0,0 +1,59 @@
+"""Dal WAV alla trascrizione con whisper-cli finto: chunk, ChunkRunner e manifest"""
+
+from whisper_ultra import pipeline
+from whisper_ultra.audio import read_wav_info, split_audio_chunks
+from whisper_ultra.jobs import MAX_CHUNK_ATTEMPTS, JobManifest, chunk_timeout, manifest_chunks
+from whisper_ultra.pipeline import transcribe_parallel
+
+def test_split_chunks_are_transcribed_and_recorded_with_their_map(speech_wav, tmp_path):
+    path = speech_wav(200)
+    chunks = split_audio_chunks(path, chunk_duration_minutes=1, vad=True, chunks_dir=str(tmp_path / "chunks"))
+    durations = [read_wav_info(chunk_path)["duration"] for chunk_path, _, _ in chunks]
+    manifest = JobManifest.open("test-job", model="base", language="it")
+
+    text = transcribe_parallel(chunks, "it", "base", max_workers=2, tail=False, manifest=manifest)
+
+    # stub_whisper.py scrive int(durata × 2.5) parole per chunk
+    recorded = manifest_chunks(manifest.data)
+    assert [len(chunk["text"].split()) for chunk in recorded] == [int(d * 2.5) for d in durations]
+    assert "\n\n".join(chunk["text"] for chunk in recorded) == text
+    assert [[tuple(segment) for segment in chunk["segment_map"]] for chunk in recorded] == \
+        [segment_map for _, _, segment_map in chunks]
+
+def test_failed_chunks_are_retried_with_longer_timeouts(speech_wav, tmp_path, monkeypatch):
+    path = speech_wav(200)
+    chunks = split_audio_chunks(path, chunk_duration_minutes=1, vad=True, chunks_dir=str(tmp_path / "chunks"))
+    seconds = read_wav_info(chunks[1][0])["duration"]
+    timeouts = {}
+
+    def transcribe_chunk_cached(args, cache=None, pool=None, threads=2, timeout=600, cascade=None, cancel=None):
+        chunk_number = args[3]
+        timeouts.setdefault(chunk_number, []).append(timeout)
+        # Il chunk 1 riesce al secondo tentativo, il 2 non riesce mai
+        success = chunk_number == 0 or (chunk_number == 1 and len(timeouts[1]) == 2)
+        return chunk_number, "testo" if success else f"[Errore {chunk_number}]", success
+
+    monkeypatch.setattr(pipeline, "transcribe_chunk_cached", transcribe_chunk_cached)
+    manifest = JobManifest.open("test-job", model="base", language="it")
+    transcribe_parallel(chunks[:3], "it", "base", max_workers=2, tail=False, manifest=manifest)
+
+    assert timeouts[1] == [chunk_timeout(seconds, 1), chunk_timeout(seconds, 2)]
+    assert len(timeouts[2]) == MAX_CHUNK_ATTEMPTS
+    recorded = manifest.data["chunks"]
+    assert [recorded[str(n)]["attempts"] for n in range(3)] == [1, 2, MAX_CHUNK_ATTEMPTS]
+    assert [recorded[str(n)]["state"] for n in range(3)] == ["done", "done", "failed"]
+
+def test_finished_manifest_is_not_resumed():
+    manifest = JobManifest.open("test-job", model="base")
+    manifest.record(0, "testo", True, 1, [(0.0, 0.0, 1.0)])
+    manifest.finish(1, 0)
+
+    assert JobManifest.open("test-job", model="base").done_chunks() == {}
+
+def test_failed_manifest_is_resumed():
+    manifest = JobManifest.open("test-job", model="base")
+    manifest.record(0, "testo", True, 1, [(0.0, 0.0, 1.0)])
+    manifest.record(1, "[Errore 1]", False, 3)
+    manifest.finish(2, 1)
+
+    assert JobManifest.open("test-job", model="base").done_chunks() == {0: "testo"}
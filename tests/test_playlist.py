@@ -0,0 +1,115 @@
+"""Download in blocco: espansione dei feed, archivio condiviso con yt-dlp e fallimenti isolati"""
+
+import os
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from whisper_ultra.playlist import DOWNLOAD_ARCHIVE, DownloadArchive, download_batch, expand_urls
+
+pytest.importorskip("yt_dlp")
+
+FILES = {f"/{name}.mp3": b"ID3" + os.urandom(size) for name, size in (("uno", 5000), ("due", 3000), ("tre", 2000))}
+
+@pytest.fixture
+def server():
+    """Server HTTP locale con tre mp3 e un feed RSS che ne elenca due; il resto è 404"""
+    state = {"running": 0, "max_running": 0, "delay": 0.0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            port = self.server.server_port
+            if self.path == "/feed.xml":
+                body = (
+                    f'<?xml version="1.0"?><rss version="2.0"><channel><title>Feed</title>'
+                    f'<item><title>Uno</title><enclosure url="http://127.0.0.1:{port}/uno.mp3" type="audio/mpeg"/></item>'
+                    f'<item><title>Due</title><enclosure url="http://127.0.0.1:{port}/due.mp3" type="audio/mpeg"/></item>'
+                    f'</channel></rss>'
+                ).encode()
+                content_type = "application/rss+xml"
+            elif self.path in FILES:
+                body = FILES[self.path]
+                content_type = "audio/mpeg"
+                with lock:
+                    state["running"] += 1
+                    state["max_running"] = max(state["max_running"], state["running"])
+                time.sleep(state["delay"])
+                with lock:
+                    state["running"] -= 1
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    state["url"] = f"http://127.0.0.1:{httpd.server_port}"
+    yield state
+    httpd.shutdown()
+    httpd.server_close()
+
+def test_archive_reads_yt_dlp_lines_and_appends_once(tmp_path):
+    path = str(tmp_path / DOWNLOAD_ARCHIVE)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("youtube dQw4w9WgXcQ\n\n")
+    archive = DownloadArchive(path)
+    assert "youtube dQw4w9WgXcQ" in archive
+
+    threads = [threading.Thread(target=archive.add, args=(f"generic {i % 4}",)) for i in range(16)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    with open(path, encoding="utf-8") as f:
+        lines = f.read().split()
+    assert len(DownloadArchive(path)) == len(archive) == 5
+    assert len(lines) == 2 * 5
+
+def test_feed_is_expanded_without_duplicates(server):
+    base = server["url"]
+    items = expand_urls([f"{base}/feed.xml", f"{base}/uno.mp3", f"{base}/manca.mp3"])
+
+    assert [item.title for item in items[:2]] == ["Uno", "Due"]
+    # Elementi del feed senza id: l'archivio li riconosce solo al download
+    assert [item.item_id for item in items[:2]] == [None, None]
+    assert items[2].item_id == "generic uno"
+    assert items[3].status == "failed" and "404" in items[3].error
+
+def test_batch_downloads_in_parallel_and_skips_the_archive(server, tmp_path):
+    base = server["url"]
+    server["delay"] = 0.3
+    save_path = str(tmp_path / "video")
+    urls = [f"{base}/uno.mp3", f"{base}/due.mp3", f"{base}/tre.mp3", f"{base}/manca.mp3"]
+
+    items = download_batch(urls, save_path, concurrency=2, poll=0.05)
+
+    assert [item.status for item in items] == ["done", "done", "done", "failed"]
+    assert server["max_running"] == 2
+    for item in items[:3]:
+        with open(item.path, "rb") as f:
+            assert f.read() == FILES["/" + os.path.basename(item.path)]
+    assert len(DownloadArchive(os.path.join(save_path, DOWNLOAD_ARCHIVE))) == 3
+
+    # Di nuovo, anche dal feed: niente scaricato una seconda volta
+    again = download_batch([f"{base}/feed.xml", f"{base}/tre.mp3"], save_path, poll=0.05)
+    assert [item.status for item in again] == ["skipped"] * 3
+    assert all(item.path is None for item in again)
+
+def test_archive_can_be_disabled(server, tmp_path):
+    save_path = str(tmp_path / "video")
+    download_batch([f"{server['url']}/uno.mp3"], save_path, archive_path=False, poll=0.05)
+    items = download_batch([f"{server['url']}/uno.mp3"], save_path, archive_path=False, poll=0.05)
+
+    assert items[0].status == "done"
+    assert not os.path.exists(os.path.join(save_path, DOWNLOAD_ARCHIVE))
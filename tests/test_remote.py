@@ -0,0 +1,118 @@
+"""Nodi remoti: chunk rimandati a un altro nodo se uno cade, token, attesa quando sono tutti giù e stato riletto"""
+
+import time
+import threading
+
+import pytest
+
+from whisper_ultra.audio import build_wav_header
+from whisper_ultra.remote import RemoteWorkerPool, WorkerNode
+
+def constant_wav(seconds):
+    return build_wav_header(seconds * 32000) + b"\1\0" * 16000 * seconds
+
+@pytest.fixture
+def start_node():
+    """Avvia un nodo con whisper-cli (lo stub), di default su una porta libera; restituisce (url, server)"""
+    servers = []
+
+    def start(token="", slots=1, port=0):
+        node = WorkerNode(slots=slots, use_server=False)
+        server = node.serve(port=port, token=token)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}", server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+def test_chunk_moves_to_another_node_when_one_dies(start_node):
+    dead_url, dead = start_node()
+    alive_url, _ = start_node()
+    pool = RemoteWorkerPool([dead_url, alive_url], retry_seconds=60)
+    assert pool.size == 2
+    stop(dead)
+
+    texts = [pool.transcribe(constant_wav(4), "it", "base", timeout=20) for _ in range(3)]
+
+    # Lo stub scrive circa 2.5 parole al secondo di audio
+    assert all(len(text.split()) == 10 for text in texts)
+    dead_worker, alive_worker = pool.workers
+    assert dead_worker.down_until > time.time()
+    assert alive_worker.down_until == 0 and alive_worker.failures == 0
+    assert pool.size == 1
+
+def test_node_rejects_a_wrong_token(start_node):
+    url, _ = start_node(token="segreto")
+
+    wrong = RemoteWorkerPool([url], token="altro")
+    assert not wrong.available()
+
+    right = RemoteWorkerPool([url], token="segreto")
+    assert right.available()
+    assert len(right.transcribe(constant_wav(2), "it", "base", timeout=20).split()) == 5
+
+def test_all_nodes_down_fails_at_the_deadline(start_node):
+    url, server = start_node()
+    pool = RemoteWorkerPool([url], retry_seconds=60)
+    stop(server)
+
+    start = time.time()
+    with pytest.raises(ConnectionError):
+        pool.transcribe(constant_wav(2), "it", "base", timeout=1)
+    assert 0.9 <= time.time() - start < 5
+
+def test_waits_for_a_node_that_comes_back(start_node):
+    url, server = start_node()
+    pool = RemoteWorkerPool([url], retry_seconds=0.5)
+    port = server.server_port
+    stop(server)
+
+    timer = threading.Timer(1, start_node, kwargs={"port": port})
+    timer.start()
+    assert len(pool.transcribe(constant_wav(2), "it", "base", timeout=20).split()) == 5
+    timer.join()
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline, "condizione mai vera"
+        time.sleep(0.05)
+
+def test_restarted_node_is_reread_periodically(start_node):
+    url, server = start_node(slots=1)
+    pool = RemoteWorkerPool([url], refresh_seconds=0.2)
+    assert pool.size == 1
+    port = server.server_port
+    stop(server)
+    start_node(slots=3, port=port)
+    time.sleep(0.3)
+
+    pool.transcribe(constant_wav(2), "it", "base", timeout=20)
+
+    wait_for(lambda: pool.size == 3)
+
+def test_redispatch_rereads_a_node_that_came_back(start_node):
+    late_url, late = start_node()
+    port = late.server_port
+    stop(late)
+    leaving_url, leaving = start_node()
+    pool = RemoteWorkerPool([late_url, leaving_url], retry_seconds=60)
+    assert pool.size == 1
+
+    # Il primo nodo torna con 2 slot, l'unico rimasto cade: senza rileggere lo stato
+    # il chunk aspetterebbe i 60 s di esclusione
+    start_node(slots=2, port=port)
+    stop(leaving)
+    start = time.time()
+    assert len(pool.transcribe(constant_wav(2), "it", "base", timeout=20).split()) == 5
+
+    assert time.time() - start < 10
+    assert pool.workers[0].slots == 2 and pool.workers[0].down_until == 0
+    assert pool.size == 2
@@ -0,0 +1,148 @@
+"""CpuScheduler: memoria contata per copia del modello e server del pool che seguono il conto"""
+
+import threading
+
+import pytest
+
+from whisper_ultra import whisper
+from whisper_ultra.scheduler import MODEL_MEMORY_MB, CpuScheduler, model_memory_mb
+from whisper_ultra.whisper import WhisperServerPool
+
+class FakeWorker:
+    """whisper-server finto: modello, thread e stato senza processi"""
+
+    def __init__(self, binary, host="127.0.0.1", threads=2):
+        self.host = host
+        self.port = None
+        self.threads = threads
+        self.model = None
+        self.running = False
+
+    def alive(self):
+        return self.running
+
+    def start(self, model, threads=None):
+        threads = threads or self.threads
+        if self.running and (self.model, self.threads) == (model, threads):
+            return
+        self.model, self.threads, self.running = model, threads, True
+
+    def stop(self):
+        self.running = False
+
+    def transcribe(self, chunk_path, language, timeout=600, response_format="text"):
+        return "testo"
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    monkeypatch.setattr(whisper, "WhisperServerWorker", FakeWorker)
+    pools = []
+
+    def make(size=4):
+        pool = WhisperServerPool(size=size)
+        pools.append(pool)
+        return pool
+    yield make
+    for pool in pools:
+        pool.shutdown()
+
+def servers(pool):
+    """Server in memoria del pool: (modello, thread) dei worker liberi ancora vivi"""
+    return sorted((worker.model, worker.threads) for worker in pool._idle if worker.alive())
+
+def run_chunk(scheduler, pool, owner="a", model="base", threads=2):
+    with scheduler.slot(owner, threads, (model,), (pool,)):
+        pool.transcribe("chunk.wav", "it", model, threads=threads)
+
+def test_resident_copy_is_charged_once_and_reused(make_pool):
+    scheduler = CpuScheduler(cpu_slots=8, memory_mb=10000)
+    pool = make_pool()
+    base = model_memory_mb("base")
+
+    with scheduler.slot("a", 2, ("base",), (pool,)):
+        with scheduler.slot("b", 2, ("base",), (pool,)):
+            assert scheduler.status()["used_memory_mb"] == 2 * base
+            first, second = pool.acquire("base", 2), pool.acquire("base", 2)
+        pool.release(first)
+        pool.release(second)
+    # I whisper-server restano caricati: i chunk successivi non pagano di nuovo
+    for _ in range(3):
+        run_chunk(scheduler, pool)
+        assert scheduler.status()["used_memory_mb"] == 2 * base
+    assert scheduler.status()["model_copies"] == {"base": 2}
+    assert servers(pool) == [("base", 2), ("base", 2)]
+    assert pool.scheduler is scheduler
+
+def test_whisper_cli_copy_is_released_with_the_chunk():
+    scheduler = CpuScheduler(cpu_slots=8, memory_mb=10000)
+
+    with scheduler.slot("a", 2, ("base", "small")):
+        assert scheduler.status()["used_memory_mb"] == model_memory_mb("base") + model_memory_mb("small")
+    assert scheduler.status()["used_memory_mb"] == 0
+
+def test_idle_copies_of_another_model_are_evicted(make_pool):
+    scheduler = CpuScheduler(cpu_slots=8, memory_mb=MODEL_MEMORY_MB["medium"] + 100)
+    pool = make_pool()
+    granted = threading.Event()
+
+    def other_model():
+        with scheduler.slot("c", 2, ("base",), (pool,)):
+            granted.set()
+
+    run_chunk(scheduler, pool)
+    with scheduler.slot("b", 2, ("medium",), (pool,)):
+        # Lo sfratto ferma davvero il whisper-server di base
+        assert scheduler.status()["model_copies"] == {"medium": 1}
+        assert servers(pool) == []
+        pool.release(pool.acquire("medium", 2))
+        # medium è al lavoro: base non ci sta e aspetta
+        waiter = threading.Thread(target=other_model)
+        waiter.start()
+        assert not granted.wait(0.3)
+    waiter.join(5)
+    assert granted.is_set()
+    assert scheduler.status()["model_copies"] == {"base": 1}
+
+def test_pool_starts_servers_only_where_the_scheduler_counted_them(make_pool):
+    # Una sola copia di base sta nel budget
+    scheduler = CpuScheduler(cpu_slots=8, memory_mb=MODEL_MEMORY_MB["base"] + 100)
+    pool = make_pool()
+
+    run_chunk(scheduler, pool, threads=2)
+    # Stesso modello con altri thread: per il pool è un altro server, e così per lo scheduler
+    run_chunk(scheduler, pool, threads=4)
+    assert scheduler.status()["model_copies"] == {"base": 1}
+    assert servers(pool) == [("base", 4)]
+    assert pool._count == 1
+
+def test_copies_are_counted_per_pool(make_pool):
+    scheduler = CpuScheduler(cpu_slots=8, memory_mb=10000)
+    pool = make_pool()
+    cascade_pool = make_pool()
+
+    with scheduler.slot("a", 2, ("base", "small"), (pool, cascade_pool)):
+        pool.transcribe("chunk.wav", "it", "base", threads=2)
+        cascade_pool.transcribe("chunk.wav", "it", "small", threads=2)
+    # Anche il pool della cascata conta nel budget
+    assert scheduler.status()["used_memory_mb"] == model_memory_mb("base") + model_memory_mb("small")
+    # Il server di base di un altro pool non si riusa: è un'altra copia
+    run_chunk(scheduler, cascade_pool)
+    assert scheduler.status()["model_copies"] == {"base": 2, "small": 1}
+    assert servers(cascade_pool) == [("base", 2), ("small", 2)]
+
+def test_servers_stopped_by_the_pool_leave_the_count(make_pool):
+    scheduler = CpuScheduler(cpu_slots=8, memory_mb=10000)
+    pool = make_pool(size=1)
+
+    run_chunk(scheduler, pool)
+    # Pool pieno: il server di base viene riavviato con small
+    run_chunk(scheduler, pool, model="small")
+    assert scheduler.status()["model_copies"] == {"small": 1}
+    pool.shutdown()
+    assert scheduler.status()["model_copies"] == {}
+    assert scheduler.status()["used_memory_mb"] == 0
+
+def test_model_memory_falls_back_to_the_table_without_the_file():
+    # Lo stub ha un file del modello vuoto: la stima viene dalla tabella
+    assert model_memory_mb("base") == MODEL_MEMORY_MB["base"]
+    assert model_memory_mb("sconosciuto") == MODEL_MEMORY_MB["base"]
@@ -0,0 +1,111 @@
+"""Indice FTS delle trascrizioni: istanti delle righe dalla mappa dei chunk e reindicizzazione"""
+
+import os
+import json
+
+import pytest
+
+from whisper_ultra.pipeline import save_transcript, transcript_sidecar
+from whisper_ultra.search import SearchIndex, format_position, fts_query, transcript_segments
+
+CHUNKS = [
+    # Chunk 0: 10 s di parlato che nel file iniziano a 100 s
+    {"text": "prima riga uno\nseconda riga due", "segment_map": [(0.0, 100.0, 10.0)]},
+    # Chunk 1: due tratti di parlato, a 300 s e a 400 s
+    {"text": "perché la parola chiave\narriva dopo la pausa", "segment_map": [(0.0, 300.0, 5.0), (5.0, 400.0, 5.0)]},
+]
+TEXT = "\n\n".join(chunk["text"] for chunk in CHUNKS)
+
+@pytest.fixture
+def index(tmp_path):
+    return SearchIndex(str(tmp_path / "search.sqlite3"))
+
+def test_lines_get_source_positions_from_the_segment_map():
+    segments = transcript_segments(TEXT, CHUNKS)
+
+    assert [chunk for chunk, *_ in segments] == [0, 0, 1, 1]
+    for _, offset, _, _, line in segments:
+        assert TEXT[offset:offset + len(line)] == line
+    # Ogni chunk va dall'inizio del suo primo tratto di parlato alla fine dell'ultimo
+    assert segments[0][2] == 100000 and segments[1][3] == 110000
+    assert segments[2][2] == 300000 and segments[3][3] == 405000
+    # Dentro il chunk l'istante è interpolato sui caratteri, senza contare la pausa
+    assert 100000 < segments[1][2] == segments[0][3] < 110000
+    assert 400000 <= segments[3][2] == segments[2][3] < 405000
+
+def test_text_that_does_not_match_the_chunks_has_no_positions():
+    segments = transcript_segments(TEXT + " modificato", CHUNKS)
+
+    assert segments and all(start_ms is None and end_ms is None for _, _, start_ms, end_ms, _ in segments)
+
+def test_search_returns_position_and_offset(index, tmp_path):
+    path = str(tmp_path / "lezione_20260101_101010_2.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(TEXT)
+    assert index.add(path, TEXT, CHUNKS, model="base", language="it") == 4
+
+    hits = index.search("parola chiave")
+    assert len(hits) == 1
+    hit = hits[0]
+    assert hit["video_name"] == "lezione"
+    assert hit["start_ms"] == 300000
+    assert hit["char_offset"] == TEXT.index("perché la parola chiave")
+    assert hit["duration"] == 405.0
+    assert "**chiave**" in hit["snippet"]
+    assert format_position(hit["start_ms"]) == "05:00"
+
+    # Prefissi, accenti e filtri
+    assert [h["start_ms"] for h in index.search("pau*")] == [400348]
+    assert index.search("perche")[0]["char_offset"] == hit["char_offset"]
+    assert index.search("chiave", model="small") == []
+    assert index.search("chiave", language="it")
+
+def test_reindexing_a_file_replaces_its_lines(index, tmp_path):
+    path = str(tmp_path / "video_20260101_101010.txt")
+    index.add(path, TEXT, CHUNKS)
+    index.add(path, "testo nuovo")
+
+    assert index.search("chiave") == []
+    assert index.search("nuovo")[0]["start_ms"] is None
+    assert index.stats() == {"documents": 1, "segments": 1}
+
+def test_index_archive_uses_the_manifest_and_skips_unchanged_files(index, tmp_path):
+    transcripts = tmp_path / "trascrizioni"
+    jobs = tmp_path / "jobs"
+    transcripts.mkdir()
+    (jobs / "job1").mkdir(parents=True)
+    (transcripts / "con_mappa_20260101_101010.txt").write_text(TEXT, encoding="utf-8")
+    (transcripts / "senza_20260101_101011.txt").write_text("nessun manifest qui", encoding="utf-8")
+    manifest = {
+        "model": "small",
+        "language": "it",
+        "chunks": {str(i): dict(chunk, state="done") for i, chunk in enumerate(CHUNKS)}
+    }
+    (jobs / "job1" / "manifest.json").write_text(json.dumps(manifest), encoding="utf-8")
+
+    assert index.index_archive(str(transcripts), str(jobs)) == {"indexed": 2, "unchanged": 0, "removed": 0}
+    hit = index.search("chiave")[0]
+    assert hit["start_ms"] == 300000 and hit["model"] == "small"
+    assert index.search("manifest")[0]["start_ms"] is None
+
+    os.remove(transcripts / "senza_20260101_101011.txt")
+    assert index.index_archive(str(transcripts), str(jobs)) == {"indexed": 0, "unchanged": 1, "removed": 1}
+
+def test_reindexing_after_the_job_is_removed_uses_the_sidecar(index, tmp_path):
+    transcripts = str(tmp_path / "trascrizioni")
+    # Chunk come li dà manifest_chunks: nel .json restano solo testo e mappa
+    chunks = [dict(chunk, state="done", attempts=1) for chunk in CHUNKS]
+    path = save_transcript(TEXT, "lezione", transcripts, chunks, "small", "it", 600.0)
+    with open(transcript_sidecar(path), encoding="utf-8") as f:
+        assert [set(chunk) for chunk in json.load(f)["chunks"]] == [{"text", "segment_map"}] * 2
+
+    # Nessun manifest in jobs/: i tempi arrivano dal .json
+    assert index.index_archive(transcripts, str(tmp_path / "jobs")) == {"indexed": 1, "unchanged": 0, "removed": 0}
+    hit = index.search("chiave")[0]
+    assert hit["start_ms"] == 300000
+    assert (hit["model"], hit["duration"]) == ("small", 600.0)
+    assert index.search("chiave", language="it")
+
+def test_fts_query_quotes_user_input():
+    assert fts_query('chiave "OR pau*') == '"chiave" """OR" "pau"*'
+    assert fts_query("  ") == ""
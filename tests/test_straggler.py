@@ -0,0 +1,130 @@
+"""ChunkRunner: divisione della coda finale, copie speculative dei chunk lenti e annullamento"""
+
+import time
+import queue
+import threading
+
+from whisper_ultra.audio import WAV_HEADER_BYTES, build_wav_header
+from whisper_ultra.straggler import ChunkRunner
+
+def silent_wav(seconds):
+    return build_wav_header(int(seconds) * 32000) + b"\0\0" * 16000 * int(seconds)
+
+def wait_cancel(cancel, timeout=10):
+    """Attende che il CancelToken venga annullato; False se non succede entro timeout"""
+    deadline = time.time() + timeout
+    while not cancel.is_set() and time.time() < deadline:
+        time.sleep(0.01)
+    return cancel.is_set()
+
+def wait_done(done, count, timeout=20):
+    results = {}
+    for _ in range(count):
+        number, text, success, meta, attempts = done.get(timeout=timeout)
+        results[number] = (text, success, meta, attempts)
+    return results
+
+def test_last_chunk_is_split_across_idle_workers(speech_bytes):
+    wav = speech_bytes(120)
+    pieces = {}
+    lock = threading.Lock()
+
+    def transcribe(audio, number, seconds, started, cancel):
+        started()
+        with lock:
+            key = f"pezzo{len(pieces)}"
+            pieces[key] = bytes(audio[WAV_HEADER_BYTES:])
+        return key, True, 1
+
+    done = queue.Queue()
+    runner = ChunkRunner(transcribe, lambda *args: done.put(args), workers=4, split_tail=True, speculate=False,
+                         min_part_seconds=10)
+    runner.add(0, wav, 120, meta="mappa")
+    runner.close()
+    text, success, meta, attempts = wait_done(done, 1)[0]
+
+    assert success and meta == "mappa" and attempts == 1
+    assert runner.stats()["splits"] == 1
+    # Un pezzo per worker, ricomposti nell'ordine dell'audio
+    keys = text.split()
+    assert len(keys) == 4
+    assert b"".join(pieces[key] for key in keys) == wav[WAV_HEADER_BYTES:]
+
+def test_no_split_before_the_tail():
+    calls = []
+
+    def transcribe(audio, number, seconds, started, cancel):
+        started()
+        calls.append(number)
+        return f"chunk{number}", True, 1
+
+    done = queue.Queue()
+    runner = ChunkRunner(transcribe, lambda *args: done.put(args), workers=1, split_tail=True, speculate=False,
+                         min_part_seconds=10)
+    for number in range(3):
+        runner.add(number, silent_wav(30), 30)
+    runner.close()
+    results = wait_done(done, 3)
+
+    assert sorted(calls) == [0, 1, 2]
+    assert {number: text for number, (text, *_) in results.items()} == {0: "chunk0", 1: "chunk1", 2: "chunk2"}
+    assert runner.stats()["splits"] == 0
+
+def test_slow_chunk_gets_a_copy_and_the_loser_is_cancelled():
+    stalled = threading.Event()
+    cancelled = threading.Event()
+    first = {1: True}
+
+    def transcribe(audio, number, seconds, started, cancel):
+        started()
+        if number == 1 and first.pop(1, False):
+            stalled.set()
+            # Tentativo bloccato: torna solo quando la copia lo annulla
+            if wait_cancel(cancel):
+                cancelled.set()
+            return "", False, 1
+        time.sleep(0.1)
+        return f"chunk{number}", True, 1
+
+    done = queue.Queue()
+    runner = ChunkRunner(transcribe, lambda *args: done.put(args), workers=2, split_tail=False, speculate=True,
+                         slow_factor=1.5, grace_seconds=0.2)
+    runner.add(0, silent_wav(10), 10)
+    runner.add(1, silent_wav(10), 10)
+    runner.close()
+    start = time.time()
+    results = wait_done(done, 2)
+
+    assert results[1][:2] == ("chunk1", True)
+    assert stalled.is_set() and cancelled.wait(5)
+    assert time.time() - start < 8
+    assert runner.stats()["speculated"] == 1
+    assert runner.stats()["speculation_wins"] == 1
+
+def test_cancel_drops_queued_chunks_and_stops_running_ones():
+    running = threading.Event()
+    released = []
+    calls = []
+
+    def transcribe(audio, number, seconds, started, cancel):
+        started()
+        calls.append(number)
+        running.set()
+        wait_cancel(cancel)
+        return "", False, 1
+
+    done = queue.Queue()
+    runner = ChunkRunner(transcribe, lambda *args: done.put(args), workers=1, split_tail=False, speculate=False,
+                         release=released.append)
+    for number in range(3):
+        runner.add(number, f"chunk{number}.wav", 30)
+    assert running.wait(5)
+    runner.cancel()
+    runner.add(3, "chunk3.wav", 30)
+
+    for thread in runner._threads:
+        thread.join(5)
+        assert not thread.is_alive()
+    assert calls == [0]
+    assert done.empty()
+    assert sorted(released) == ["chunk0.wav", "chunk1.wav", "chunk2.wav"]
@@ -0,0 +1,21 @@
+"""Metriche Prometheus: /metrics servito in locale di default"""
+
+import urllib.request
+
+from whisper_ultra.tracing import Tracer
+
+def test_metrics_are_served_on_loopback_only():
+    tracer = Tracer(path="")
+    with tracer.span("chunk", model="base"):
+        pass
+    server = tracer.serve_metrics(0)
+    try:
+        host, port = server.server_address
+        assert host == "127.0.0.1"
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            body = response.read().decode()
+        assert body == tracer.metrics_text()
+        assert "chunk" in body
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,56 @@
+"""whisper-cli da file e da stdin; worker whisper-server: stop() concorrente e idempotente"""
+
+import os
+import sys
+import threading
+import subprocess
+
+from whisper_ultra import whisper
+from whisper_ultra.whisper import WhisperServerWorker, transcribe_chunk
+
+def test_stop_from_many_threads_stops_once():
+    worker = WhisperServerWorker()
+    process = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(60)"])
+    worker.process = process
+    errors = []
+    barrier = threading.Barrier(8)
+
+    def stop():
+        barrier.wait()
+        try:
+            worker.stop()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=stop) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+
+    assert errors == []
+    assert process.poll() is not None
+    assert worker.process is None and not worker.alive()
+    # Di nuovo, a worker già fermo: nessun effetto
+    worker.stop()
+
+def test_chunk_in_memory_goes_through_stdin(speech_bytes, tmp_path, monkeypatch):
+    # Senza tmpfs (macOS) l'output va nella cartella temporanea: il WAV non tocca il disco
+    output_dir = tmp_path / "output"
+    output_dir.mkdir()
+    monkeypatch.setattr(whisper, "RAM_DIR", str(output_dir))
+    data = speech_bytes(10)
+
+    chunk_number, text, success = transcribe_chunk((data, "it", "base", 3, 4))
+
+    assert (chunk_number, success) == (3, True)
+    # stub_whisper.py: 2.5 parole al secondo
+    assert len(text.split()) == 25
+    assert os.listdir(output_dir) == []
+    assert sorted(os.listdir(tmp_path)) == ["memory.wav", "output"]
+
+def test_chunk_on_disk_leaves_only_the_wav(speech_wav, tmp_path):
+    path = speech_wav(4)
+    _, text, success = transcribe_chunk((path, "it", "base", 0, 1))
+    assert success and len(text.split()) == 10
+    assert os.listdir(tmp_path) == ["speech.wav"]
@@ -0,0 +1,52 @@
+"""Pipeline di trascrizione whisper.cpp utilizzabile senza Streamlit"""
+
+from .audio import convert_audio, split_audio_chunks, extract_audio_chunks, get_audio_duration
+from .batch import MEDIA_EXTENSIONS, find_media_files, transcribe_batch
+from .cache import TranscriptCache
+from .capabilities import get_capabilities
+from .download import AudioStream, download_video, open_audio_stream, save_uploaded_file
+from .follow import GrowingFileSource, LiveStreamSource, open_follow_source, transcribe_follow
+from .jobqueue import JobQueue
+from .jobs import JobManifest
+from .models import ModelDownloader, download_model
+from .playlist import DownloadArchive, download_batch
+from .pipeline import (
+    transcribe_parallel, transcribe_pipelined, transcribe_file, save_transcript, cleanup_chunks
+)
+from .reporting import Reporter, ConsoleReporter
+from .whisper import WhisperServerPool, transcribe_chunk
+
+__all__ = [
+    "convert_audio",
+    "split_audio_chunks",
+    "extract_audio_chunks",
+    "get_audio_duration",
+    "MEDIA_EXTENSIONS",
+    "find_media_files",
+    "transcribe_batch",
+    "TranscriptCache",
+    "get_capabilities",
+    "AudioStream",
+    "download_video",
+    "open_audio_stream",
+    "save_uploaded_file",
+    "GrowingFileSource",
+    "LiveStreamSource",
+    "open_follow_source",
+    "transcribe_follow",
+    "JobQueue",
+    "JobManifest",
+    "ModelDownloader",
+    "download_model",
+    "DownloadArchive",
+    "download_batch",
+    "transcribe_parallel",
+    "transcribe_pipelined",
+    "transcribe_file",
+    "save_transcript",
+    "cleanup_chunks",
+    "Reporter",
+    "ConsoleReporter",
+    "WhisperServerPool",
+    "transcribe_chunk",
+]
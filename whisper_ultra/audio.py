@@ -0,0 +1,519 @@
+"""Decodifica, analisi e suddivisione in chunk del PCM mono 16 kHz"""
+
+import os
+import json
+import mmap
+import struct
+import threading
+import subprocess
+
+import numpy as np
+
+from . import tracing
+from .reporting import Reporter
+
+PCM_BYTES_PER_SECOND = 16000 * 2
+
+# VAD a energia: frame da 30 ms sul PCM mono 16 kHz
+VAD_FRAME_SEC = 0.03
+VAD_FRAME_SAMPLES = 480
+VAD_FRAME_BYTES = VAD_FRAME_SAMPLES * 2
+VAD_MIN_THRESHOLD_DB = -60
+VAD_MAX_THRESHOLD_DB = -35
+
+CHUNKS_DIR = "chunks"
+WAV_HEADER_BYTES = 44
+# tmpfs per i file di output di whisper-cli (assente su macOS: cartella temporanea di sistema)
+RAM_DIR = "/dev/shm" if os.path.isdir("/dev/shm") else None
+
+# Risultati di probe_media per (percorso, mtime, dimensione): ogni file si sonda una volta
+_probe_cache = {}
+PROBE_CACHE_SIZE = 256
+
+def probe_media(audio_path):
+    """Durata e formato del file: dall'header se è un WAV, altrimenti con un solo ffprobe
+
+    Restituisce {"duration", "format", "codec", "sample_rate", "channels"} (durata 0
+    se non si ricava). Il risultato resta in memoria finché il file non cambia.
+    """
+    media = {"duration": 0, "format": None, "codec": None, "sample_rate": None, "channels": None}
+    try:
+        stat = os.stat(audio_path)
+    except OSError:
+        return media
+    key = (audio_path, stat.st_mtime_ns, stat.st_size)
+    cached = _probe_cache.get(key)
+    if cached is not None:
+        return cached
+    
+    info = read_wav_info(audio_path)
+    if info:
+        media.update(
+            duration=info["duration"],
+            format="wav",
+            codec=f"pcm_s{info['bits']}le" if info["audio_format"] == 1 else None,
+            sample_rate=info["sample_rate"],
+            channels=info["channels"]
+        )
+    else:
+        command = [
+            'ffprobe', '-i', audio_path,
+            '-show_entries', 'format=duration,format_name:stream=codec_name,sample_rate,channels',
+            '-select_streams', 'a:0',
+            '-v', 'quiet',
+            '-of', 'json'
+        ]
+        with tracing.span("ffprobe", source=audio_path):
+            result = subprocess.run(command, capture_output=True, text=True)
+            tracing.annotate(exit_code=result.returncode)
+        try:
+            data = json.loads(result.stdout)
+        except ValueError:
+            data = {}
+        fmt = data.get("format") or {}
+        stream = (data.get("streams") or [{}])[0]
+        try:
+            media["duration"] = float(fmt.get("duration") or 0)
+        except ValueError:
+            pass
+        media.update(
+            format=fmt.get("format_name"),
+            codec=stream.get("codec_name"),
+            sample_rate=int(stream["sample_rate"]) if stream.get("sample_rate") else None,
+            channels=stream.get("channels")
+        )
+    
+    if len(_probe_cache) >= PROBE_CACHE_SIZE:
+        _probe_cache.clear()
+    _probe_cache[key] = media
+    return media
+
+def get_audio_duration(audio_path):
+    """Ottieni durata audio in secondi"""
+    return probe_media(audio_path)["duration"]
+
+def get_stream_duration(blocks):
+    """Durata di un input passato a ffprobe su stdin (0 se non si ricava)"""
+    command = [
+        'ffprobe', '-i', 'pipe:0',
+        '-show_entries', 'format=duration',
+        '-v', 'quiet',
+        '-of', 'csv=p=0'
+    ]
+    with tracing.span("ffprobe", source="pipe:0"):
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL
+        )
+        
+        def feed():
+            try:
+                for data in blocks:
+                    process.stdin.write(data)
+            except OSError:
+                # ffprobe ha già letto abbastanza
+                pass
+            finally:
+                try:
+                    process.stdin.close()
+                except OSError:
+                    pass
+        
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+        output = process.stdout.read()
+        process.wait()
+        feeder.join()
+        tracing.annotate(exit_code=process.returncode)
+    try:
+        return float(output.strip())
+    except ValueError:
+        return 0
+
+def read_wav_info(audio_path):
+    """Legge l'header WAV e restituisce formato e posizione dei dati PCM"""
+    try:
+        with open(audio_path, "rb") as f:
+            riff = f.read(12)
+            if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+                return None
+            
+            info = {}
+            while True:
+                header = f.read(8)
+                if len(header) < 8:
+                    return None
+                chunk_id, chunk_size = struct.unpack("<4sI", header)
+                
+                if chunk_id == b"fmt ":
+                    fmt = f.read(chunk_size)
+                    audio_format, channels, sample_rate, byte_rate, block_align, bits = \
+                        struct.unpack("<HHIIHH", fmt[:16])
+                    if not (channels and sample_rate and bits and block_align and byte_rate):
+                        # Header rovinato: meglio passare da ffmpeg che dividere per zero
+                        return None
+                    info.update({
+                        "audio_format": audio_format,
+                        "channels": channels,
+                        "sample_rate": sample_rate,
+                        "byte_rate": byte_rate,
+                        "block_align": block_align,
+                        "bits": bits
+                    })
+                    if chunk_size % 2:
+                        f.seek(1, os.SEEK_CUR)
+                
+                elif chunk_id == b"data":
+                    if "sample_rate" not in info:
+                        return None
+                    # ffmpeg su pipe lascia la dimensione a 0xFFFFFFFF: limita alla dimensione reale
+                    data_offset = f.tell()
+                    file_size = os.fstat(f.fileno()).st_size
+                    data_size = min(chunk_size, file_size - data_offset)
+                    data_size -= data_size % info["block_align"]
+                    info["data_offset"] = data_offset
+                    info["data_size"] = data_size
+                    info["duration"] = data_size / info["byte_rate"]
+                    return info
+                
+                else:
+                    f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+    except (OSError, struct.error):
+        return None
+
+def build_wav_header(data_size, sample_rate=16000, channels=1, bits=16):
+    """Header WAV PCM di 44 byte per un blocco di dati grezzi"""
+    block_align = channels * bits // 8
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + data_size, b"WAVE",
+        b"fmt ", 16, 1, channels, sample_rate, sample_rate * block_align, block_align, bits,
+        b"data", data_size
+    )
+
+def frame_energies(pcm, frames_per_block=8192):
+    """Energia in dBFS per frame da 30 ms, calcolata a blocchi sui campioni int16"""
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    num_frames = len(samples) // VAD_FRAME_SAMPLES
+    energies = np.empty(num_frames, dtype=np.float32)
+    
+    for start in range(0, num_frames, frames_per_block):
+        end = min(start + frames_per_block, num_frames)
+        block = samples[start * VAD_FRAME_SAMPLES:end * VAD_FRAME_SAMPLES]
+        block = block.reshape(-1, VAD_FRAME_SAMPLES).astype(np.float32) / 32768
+        energies[start:end] = np.mean(block * block, axis=1)
+    
+    return 10 * np.log10(energies + 1e-10)
+
+def speech_regions(energies, pad_frames=10, min_silence_frames=34, margin_db=10):
+    """Regioni di parlato (frame inizio, frame fine) con soglia adattiva sul rumore di fondo"""
+    empty = np.empty(0, dtype=np.int64)
+    if len(energies) == 0:
+        return empty, empty
+    
+    threshold = np.clip(
+        np.percentile(energies, 10) + margin_db,
+        VAD_MIN_THRESHOLD_DB, VAD_MAX_THRESHOLD_DB
+    )
+    speech = energies > threshold
+    
+    # Margine attorno al parlato per non troncare attacchi e code delle parole
+    speech = np.convolve(speech, np.ones(2 * pad_frames + 1), mode="same") > 0
+    
+    edges = np.diff(np.concatenate(([0], speech.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    if len(starts) == 0:
+        return empty, empty
+    
+    # Le pause brevi restano dentro la regione, quelle lunghe vengono scartate
+    keep = (starts[1:] - ends[:-1]) >= min_silence_frames
+    return starts[np.concatenate(([True], keep))], ends[np.concatenate((keep, [True]))]
+
+def plan_chunk_cut(energies, target_frames, final, vad=True, search_frames=2000):
+    """Sceglie dove chiudere il chunk (in una pausa) e quali regioni trascrivere"""
+    if final and len(energies) <= target_frames:
+        cut = len(energies)
+        if not vad:
+            return cut, [(0, cut)]
+        starts, ends = speech_regions(energies[:cut])
+    elif not vad:
+        return target_frames, [(0, target_frames)]
+    else:
+        starts, ends = speech_regions(energies[:target_frames])
+        
+        # Candidati: l'ultimo silenzio scartato nella seconda metà del chunk
+        gaps = (ends[:-1] + starts[1:]) // 2
+        if len(ends) == 0 or ends[-1] < target_frames:
+            gaps = np.append(gaps, target_frames)
+        gaps = gaps[gaps >= target_frames // 2]
+        
+        if len(gaps):
+            cut = int(gaps[-1])
+        else:
+            # Nessuna pausa lunga: taglia nel punto più silenzioso della coda
+            search = min(search_frames, target_frames // 2)
+            window = energies[target_frames - search:target_frames]
+            smoothed = np.convolve(window, np.ones(10) / 10, mode="same")
+            cut = target_frames - search + int(np.argmin(smoothed))
+    
+    regions = [
+        (int(start), int(min(end, cut)))
+        for start, end in zip(starts, ends)
+        if start < cut
+    ]
+    return cut, regions
+
+def speech_segment_map(regions, source_offset=0.0):
+    """Mappa (inizio nel chunk, inizio nel file originale, durata) delle regioni concatenate"""
+    segment_map = []
+    chunk_time = 0.0
+    for start, end in regions:
+        length = (end - start) * VAD_FRAME_SEC
+        segment_map.append((chunk_time, source_offset + start * VAD_FRAME_SEC, length))
+        chunk_time += length
+    return segment_map
+
+def write_speech_chunk(pcm, regions, chunk_path, source_offset=0.0):
+    """Scrive il chunk WAV con le sole regioni di parlato e restituisce la mappa dei tempi"""
+    total_bytes = sum(end - start for start, end in regions) * VAD_FRAME_BYTES
+    
+    with open(chunk_path, "wb") as out:
+        out.write(build_wav_header(total_bytes))
+        for start, end in regions:
+            out.write(pcm[start * VAD_FRAME_BYTES:end * VAD_FRAME_BYTES])
+    
+    return speech_segment_map(regions, source_offset)
+
+def speech_chunk_bytes(pcm, regions):
+    """Chunk WAV in memoria con le sole regioni di parlato, senza passare dal disco"""
+    total_bytes = sum(end - start for start, end in regions) * VAD_FRAME_BYTES
+    parts = [build_wav_header(total_bytes)]
+    parts.extend(pcm[start * VAD_FRAME_BYTES:end * VAD_FRAME_BYTES] for start, end in regions)
+    return b"".join(parts)
+
+def chunk_seconds(chunk):
+    """Durata del chunk (percorso WAV o WAV in memoria)"""
+    if isinstance(chunk, str):
+        info = read_wav_info(chunk)
+        return info["duration"] if info else 0.0
+    return (len(chunk) - WAV_HEADER_BYTES) / PCM_BYTES_PER_SECOND
+
+def span_audio(chunk, start, end):
+    """WAV in memoria con l'audio del chunk tra start ed end (secondi)"""
+    first = int(start * PCM_BYTES_PER_SECOND) & ~1
+    last = int(end * PCM_BYTES_PER_SECOND) & ~1
+    if isinstance(chunk, str):
+        info = read_wav_info(chunk)
+        last = min(last, info["data_size"])
+        with open(chunk, "rb") as f:
+            f.seek(info["data_offset"] + first)
+            pcm = f.read(max(last - first, 0))
+    else:
+        pcm = bytes(memoryview(chunk)[WAV_HEADER_BYTES + first:WAV_HEADER_BYTES + last])
+    return build_wav_header(len(pcm)) + pcm
+
+def split_chunk(chunk, parts, search_seconds=5.0):
+    """Divide il chunk in parts WAV in memoria, tagliando nel punto più silenzioso vicino a ogni confine
+
+    Restituisce [(wav, inizio in secondi nel chunk)].
+    """
+    if isinstance(chunk, str):
+        chunk = span_audio(chunk, 0, chunk_seconds(chunk))
+    pcm = memoryview(chunk)[WAV_HEADER_BYTES:]
+    energies = frame_energies(pcm)
+    search = int(search_seconds / VAD_FRAME_SEC)
+
+    cuts = [0]
+    for i in range(1, parts):
+        target = len(energies) * i // parts
+        low = max(target - search, cuts[-1] + 1)
+        high = min(target + search, len(energies))
+        if high - low > 10:
+            smoothed = np.convolve(energies[low:high], np.ones(10) / 10, mode="same")
+            target = low + int(np.argmin(smoothed))
+        cuts.append(target)
+
+    pieces = []
+    for i, start in enumerate(cuts):
+        first = start * VAD_FRAME_BYTES
+        last = cuts[i + 1] * VAD_FRAME_BYTES if i + 1 < len(cuts) else len(pcm)
+        pieces.append((build_wav_header(last - first) + bytes(pcm[first:last]), start * VAD_FRAME_SEC))
+    return pieces
+
+def chunk_time_to_source(segment_map, chunk_time):
+    """Converte un istante del chunk nel tempo corrispondente del file originale"""
+    for chunk_start, source_start, length in segment_map:
+        if chunk_time < chunk_start + length:
+            return source_start + max(chunk_time - chunk_start, 0)
+    chunk_start, source_start, length = segment_map[-1]
+    return source_start + length
+
+def split_audio_chunks(audio_path, chunk_duration_minutes=30, vad=True, chunks_dir=CHUNKS_DIR,
+                       reporter=None):
+    """Divide il WAV PCM in chunk copiando byte range dal file mappato in memoria
+
+    Come extract_audio_chunks, restituisce (percorso, numero, segment_map) per
+    chunk: la mappa lega i tempi del chunk (solo parlato, con il VAD) a quelli del
+    file originale.
+    """
+    reporter = reporter or Reporter()
+    reporter.info(f"📂 Divisione in segmenti da {chunk_duration_minutes} minuti...")
+    
+    info = read_wav_info(audio_path)
+    if (not info or info["audio_format"] != 1 or info["data_size"] == 0
+            or (info["sample_rate"], info["channels"], info["bits"]) != (16000, 1, 16)):
+        reporter.warning("Formato WAV non riconosciuto, uso file intero")
+        return [(audio_path, 0, [])]
+    
+    duration_minutes = info["duration"] / 60
+    
+    if duration_minutes <= chunk_duration_minutes and not vad:
+        reporter.info("✅ Audio breve, nessuna divisione necessaria")
+        return [(audio_path, 0, [(0.0, 0.0, info["duration"])])]
+    
+    target_frames = int(chunk_duration_minutes * 60 / VAD_FRAME_SEC)
+    data_start = info["data_offset"]
+    data_end = data_start + info["data_size"]
+    
+    chunks = []
+    os.makedirs(chunks_dir, exist_ok=True)
+    
+    with open(audio_path, "rb") as f, \
+            mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, \
+            memoryview(mm) as view, \
+            view[data_start:data_end] as pcm:
+        energies = frame_energies(pcm)
+        offset = 0
+        
+        while offset < len(energies):
+            remaining = energies[offset:]
+            cut, regions = plan_chunk_cut(remaining, target_frames, len(remaining) <= target_frames, vad)
+            
+            if regions:
+                chunk_number = len(chunks)
+                chunk_path = os.path.join(chunks_dir, f"chunk_{chunk_number:03d}.wav")
+                # Nessuna decodifica: header + slice zero-copy del PCM originale
+                segment_map = write_speech_chunk(
+                    pcm[offset * VAD_FRAME_BYTES:], regions, chunk_path, offset * VAD_FRAME_SEC
+                )
+                chunks.append((chunk_path, chunk_number, segment_map))
+            
+            offset += cut
+    
+    reporter.success(f"✅ {len(chunks)} segmenti pronti")
+    
+    return chunks
+
+def convert_audio(video_path, output_path="audio.wav", reporter=None):
+    """Estrae audio ottimizzato per Whisper"""
+    reporter = reporter or Reporter()
+    reporter.info("🎵 Estrazione audio...")
+    
+    command = [
+        'ffmpeg', '-i', video_path,
+        '-ar', '16000',
+        '-ac', '1',
+        '-c:a', 'pcm_s16le',
+        output_path, '-y'
+    ]
+    
+    with tracing.span("convert", source=video_path):
+        result = subprocess.run(
+            command, 
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        tracing.annotate(exit_code=result.returncode)
+    
+    if result.returncode == 0:
+        return output_path
+    return None
+
+def extract_audio_chunks(video_path, chunk_duration_minutes=30, vad=True, pcm_hash=None,
+                         skip=(), chunks_dir=CHUNKS_DIR, block_size=1024 * 1024, in_memory=False):
+    """Decodifica con ffmpeg su stdout e restituisce ogni chunk appena è completo
+
+    I chunk in skip (già trascritti) non vengono scritti su disco: il percorso è None.
+    Con in_memory=True al posto del percorso c'è il WAV del chunk come bytes.
+    video_path può anche essere un AudioStream: ffmpeg lo decodifica da stdin
+    mentre il download è ancora in corso (con le sue input_options, se ne ha).
+    """
+    streaming = not isinstance(video_path, str)
+    input_options = list(video_path.input_options) if streaming else []
+    command = [
+        'ffmpeg', *input_options, '-i', 'pipe:0' if streaming else video_path,
+        '-ar', '16000',
+        '-ac', '1',
+        '-f', 's16le', '-'
+    ]
+    
+    target_frames = int(chunk_duration_minutes * 60 / VAD_FRAME_SEC)
+    if not in_memory:
+        os.makedirs(chunks_dir, exist_ok=True)
+    
+    process = subprocess.Popen(
+        command,
+        stdin=subprocess.PIPE if streaming else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    feeder = video_path.start_feeding(process.stdin) if streaming else None
+    
+    # In memoria resta solo il chunk in costruzione, con le energie già calcolate
+    decoded = 0
+    buffer = bytearray()
+    energies = np.empty(0, dtype=np.float32)
+    buffer_offset = 0.0
+    chunk_number = 0
+    
+    try:
+        while True:
+            data = process.stdout.read(block_size)
+            eof = not data
+            
+            if data:
+                decoded += len(data)
+                if pcm_hash is not None:
+                    pcm_hash.update(data)
+                analyzed = len(energies) * VAD_FRAME_BYTES
+                buffer += data
+                complete = (len(buffer) - analyzed) // VAD_FRAME_BYTES * VAD_FRAME_BYTES
+                if complete:
+                    new_energies = frame_energies(bytes(buffer[analyzed:analyzed + complete]))
+                    energies = np.concatenate((energies, new_energies))
+            
+            while len(energies) >= target_frames or (eof and len(energies)):
+                cut, regions = plan_chunk_cut(energies, target_frames, eof, vad)
+                
+                if regions and chunk_number in skip:
+                    yield None, chunk_number, speech_segment_map(regions, buffer_offset)
+                    chunk_number += 1
+                elif regions and in_memory:
+                    with memoryview(buffer) as view:
+                        chunk = speech_chunk_bytes(view, regions)
+                    yield chunk, chunk_number, speech_segment_map(regions, buffer_offset)
+                    chunk_number += 1
+                elif regions:
+                    chunk_path = os.path.join(chunks_dir, f"chunk_{chunk_number:03d}.wav")
+                    with memoryview(buffer) as view:
+                        segment_map = write_speech_chunk(view, regions, chunk_path, buffer_offset)
+                    yield chunk_path, chunk_number, segment_map
+                    chunk_number += 1
+                
+                del buffer[:cut * VAD_FRAME_BYTES]
+                energies = energies[cut:]
+                buffer_offset += cut * VAD_FRAME_SEC
+            
+            if eof:
+                break
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        if feeder is not None:
+            feeder.join(timeout=5)
+        tracing.annotate(exit_code=process.returncode, audio_seconds=decoded / PCM_BYTES_PER_SECOND)
@@ -0,0 +1,271 @@
+"""Autotuning di worker × thread e durata dei chunk per host e modello"""
+
+import os
+import json
+import math
+import time
+import platform
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+
+from .audio import CHUNKS_DIR, read_wav_info, span_audio
+from .reporting import Reporter
+from .scheduler import default_memory_mb, model_memory_mb
+from .whisper import transcribe_chunk
+
+AUTOTUNE_PROFILE = "autotune.json"
+MIN_AUTOTUNE_CHUNK_MINUTES = 5
+MAX_AUTOTUNE_CHUNK_MINUTES = 45
+# Chunk abbastanza lunghi che il costo fisso (avvio, caricamento del modello) pesi al massimo così
+CHUNK_OVERHEAD_FRACTION = 0.05
+# Dopo una calibrazione fallita si riprova solo dopo un giorno, non a ogni job
+AUTOTUNE_RETRY_SECONDS = 24 * 3600
+
+# Più job possono calibrare insieme: lettura e riscrittura di autotune.json una alla volta
+_save_lock = threading.Lock()
+
+# Profili letti dal disco, riletti solo se autotune.json cambia (la UI li chiede a ogni rerun)
+_profiles_cache = {"entry": (None, {})}
+
+def _read_profiles():
+    try:
+        stat = os.stat(AUTOTUNE_PROFILE)
+    except OSError:
+        return {}
+    key = (stat.st_mtime_ns, stat.st_size)
+    cached_key, profiles = _profiles_cache["entry"]
+    if cached_key != key:
+        try:
+            with open(AUTOTUNE_PROFILE) as f:
+                profiles = json.load(f)
+        except (OSError, ValueError):
+            profiles = {}
+        _profiles_cache["entry"] = (key, profiles)
+    return profiles
+
+def _host_profile(model):
+    profile = _read_profiles().get(f"{platform.node()}|{model}")
+    if profile and profile.get("cores") == multiprocessing.cpu_count():
+        return profile
+    return None
+
+def load_tuning_profile(model):
+    """Profilo di autotuning salvato per questo host e modello (None se da calibrare)"""
+    profile = _host_profile(model)
+    if profile and "failed_at" not in profile:
+        return profile
+    return None
+
+def calibration_failed(model):
+    """True se la calibrazione di questo modello su questo host è fallita da meno di AUTOTUNE_RETRY_SECONDS"""
+    profile = _host_profile(model)
+    return bool(profile and time.time() - profile.get("failed_at", 0) < AUTOTUNE_RETRY_SECONDS)
+
+def save_tuning_profile(model, profile):
+    with _save_lock:
+        try:
+            with open(AUTOTUNE_PROFILE) as f:
+                profiles = json.load(f)
+        except (OSError, ValueError):
+            profiles = {}
+        
+        profiles[f"{platform.node()}|{model}"] = profile
+        # File temporaneo unico nella stessa cartella: os.replace resta atomico
+        fd, tmp_path = tempfile.mkstemp(
+            prefix=f"{os.path.basename(AUTOTUNE_PROFILE)}.", suffix=".tmp",
+            dir=os.path.dirname(AUTOTUNE_PROFILE) or "."
+        )
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(profiles, f, indent=2)
+            os.replace(tmp_path, AUTOTUNE_PROFILE)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+def max_workers_for_memory(model):
+    """Limite di worker dettato dalla RAM: ogni processo tiene la sua copia del modello"""
+    memory_mb = default_memory_mb()
+    if not memory_mb:
+        return multiprocessing.cpu_count()
+    return max(1, memory_mb // model_memory_mb(model))
+
+def _transcribe_sample(args, pool, threads, scheduler, owner):
+    # Anche la calibrazione chiede gli slot: i suoi server e thread contano nel budget
+    slot = nullcontext()
+    if scheduler is not None:
+        slot = scheduler.slot(owner, threads, (args[2],), (pool,))
+    with slot:
+        return transcribe_chunk(args, pool, threads)
+
+def measure_min_chunk_minutes(sample_path, info, model, language, pool=None, threads=2, chunks_dir=CHUNKS_DIR,
+                              scheduler=None, owner=None):
+    """Durata minima dei chunk per questo host e modello, misurata
+
+    Trascrive il campione intero e un suo terzo con un solo worker: la
+    differenza dà i secondi di calcolo per secondo di audio, il resto è il costo
+    fisso di ogni chunk. None se una delle due prove fallisce.
+    """
+    long_seconds = info["duration"]
+    short_seconds = long_seconds / 3
+    short_path = os.path.join(chunks_dir, "autotune_short.wav")
+    with open(short_path, "wb") as f:
+        f.write(span_audio(sample_path, 0, short_seconds))
+    
+    times = []
+    try:
+        for path in (short_path, sample_path):
+            with nullcontext() if scheduler is None else scheduler.slot(owner, threads, (model,), (pool,)):
+                start = time.time()
+                _, _, success = transcribe_chunk((path, language, model, 0, 1), pool, threads)
+            if not success:
+                return None
+            times.append(time.time() - start)
+    finally:
+        os.remove(short_path)
+    
+    per_second = max((times[1] - times[0]) / (long_seconds - short_seconds), 1e-6)
+    overhead = max(times[0] - per_second * short_seconds, 0.0)
+    minutes = overhead / (CHUNK_OVERHEAD_FRACTION * per_second) / 60
+    return min(max(math.ceil(minutes), 1), MAX_AUTOTUNE_CHUNK_MINUTES)
+
+def calibrate_workers(video_path, model, language, duration=0, sample_seconds=30, pool=None,
+                      chunks_dir=CHUNKS_DIR, reporter=None, scheduler=None, owner=None):
+    """Misura il throughput di ogni suddivisione workers × thread su un campione dell'audio
+
+    Con scheduler (CpuScheduler) ogni trascrizione di prova chiede i suoi slot a
+    nome di owner e le suddivisioni provate restano entro i suoi slot CPU.
+    """
+    reporter = reporter or Reporter()
+    cores = multiprocessing.cpu_count()
+    cpu_slots = scheduler.cpu_slots if scheduler is not None else cores
+    memory_limit = max_workers_for_memory(model)
+    
+    os.makedirs(chunks_dir, exist_ok=True)
+    sample_path = os.path.join(chunks_dir, "autotune_sample.wav")
+    offset = min(60, duration / 3) if duration else 0
+    
+    # -ss prima di -i: seek veloce, decodifica solo il campione
+    subprocess.run(
+        [
+            'ffmpeg', '-ss', str(offset), '-t', str(sample_seconds),
+            '-i', video_path,
+            '-ar', '16000', '-ac', '1',
+            '-c:a', 'pcm_s16le',
+            sample_path, '-y'
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+    )
+    info = read_wav_info(sample_path)
+    if not info or info["duration"] == 0:
+        return None
+    
+    candidates = []
+    threads = 1
+    while threads <= cpu_slots:
+        candidates.append((min(max(1, cpu_slots // threads), memory_limit), threads))
+        threads *= 2
+    
+    best = None
+    # Pool proprio per la calibrazione: quello passato può servire altri job e non va ridimensionato
+    calibration_pool = pool.companion() if pool is not None else None
+    
+    try:
+        for i, (workers, threads) in enumerate(candidates):
+            if calibration_pool is not None:
+                calibration_pool.resize(workers, threads)
+            
+            # Con il pool il primo giro carica i modelli e non viene cronometrato
+            rounds = 2 if calibration_pool is not None else 1
+            for _ in range(rounds):
+                start = time.time()
+                with ThreadPoolExecutor(max_workers=workers) as executor:
+                    results = list(executor.map(
+                        lambda n: _transcribe_sample(
+                            (sample_path, language, model, n, workers), calibration_pool, threads, scheduler, owner
+                        ),
+                        range(workers)
+                    ))
+                elapsed = time.time() - start
+            
+            reporter.progress((i + 1) / len(candidates), f"Calibrazione {workers} worker × {threads} thread")
+            if not all(success for _, _, success in results):
+                continue
+            
+            throughput = workers * info["duration"] / elapsed
+            if best is None or throughput > best["throughput"]:
+                best = {"workers": workers, "threads": threads, "throughput": throughput}
+        
+        if best:
+            reporter.progress(1.0, "Calibrazione durata dei chunk")
+            min_chunk_minutes = measure_min_chunk_minutes(
+                sample_path, info, model, language, calibration_pool, best["threads"], chunks_dir,
+                scheduler, owner
+            )
+            if min_chunk_minutes:
+                best["min_chunk_minutes"] = min_chunk_minutes
+    finally:
+        if calibration_pool is not None:
+            calibration_pool.shutdown()
+    
+    reporter.progress_done()
+    try:
+        os.remove(sample_path)
+    except OSError:
+        pass
+    
+    if best:
+        best["cores"] = cores
+        best["calibrated_at"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        save_tuning_profile(model, best)
+    else:
+        # Il campione c'era ma whisper non l'ha trascritto: i prossimi job non riprovano subito
+        save_tuning_profile(model, {"cores": cores, "failed_at": time.time()})
+    return best
+
+def recommended_chunk_minutes(duration, workers, min_minutes=MIN_AUTOTUNE_CHUNK_MINUTES):
+    """Chunk abbastanza piccoli da dare almeno due giri di lavoro a ogni worker
+
+    min_minutes è la durata sotto la quale il costo fisso di ogni chunk pesa
+    troppo: quella misurata dalla calibrazione (min_chunk_minutes del profilo).
+    """
+    if duration <= 0:
+        return 30
+    minutes = math.ceil(duration / 60 / (workers * 2))
+    return min(max(minutes, min_minutes), MAX_AUTOTUNE_CHUNK_MINUTES)
+
+def profile_chunk_minutes(duration, profile):
+    """Minuti per chunk con i worker e la durata minima misurata del profilo"""
+    return recommended_chunk_minutes(
+        duration, profile["workers"], profile.get("min_chunk_minutes", MIN_AUTOTUNE_CHUNK_MINUTES)
+    )
+
+def tune_for_file(video_path, model, language, duration, pool=None, chunks_dir=CHUNKS_DIR, reporter=None,
+                  scheduler=None, owner=None):
+    """(worker, thread, minuti per chunk) dal profilo salvato, calibrando se manca"""
+    reporter = reporter or Reporter()
+    
+    profile = load_tuning_profile(model)
+    if not profile and calibration_failed(model):
+        reporter.warning("🎛️ Calibrazione fallita di recente con questo modello: parametri di default")
+        return None
+    if not profile:
+        reporter.info("🎛️ Calibrazione worker × thread su un campione dell'audio...")
+        profile = calibrate_workers(
+            video_path, model, language, duration, pool=pool, chunks_dir=chunks_dir, reporter=reporter,
+            scheduler=scheduler, owner=owner
+        )
+    if not profile:
+        return None
+    
+    chunk_minutes = profile_chunk_minutes(duration, profile)
+    reporter.info(
+        f"🎛️ {profile['workers']} worker × {profile['threads']} thread, "
+        f"chunk da {chunk_minutes} min"
+    )
+    return profile["workers"], profile["threads"], chunk_minutes
@@ -0,0 +1,354 @@
+"""Trascrizione di molti file: decodifica in più processi, un solo scheduler dei chunk"""
+
+import os
+import queue
+import hashlib
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from . import tracing
+from .audio import CHUNKS_DIR, get_audio_duration, extract_audio_chunks
+from .autotune import MIN_AUTOTUNE_CHUNK_MINUTES, recommended_chunk_minutes
+from .cache import file_digest
+from .jobs import JobManifest, job_key, manifest_chunks
+from .pipeline import TRANSCRIPTS_DIR, LanguagePin, cleanup_chunks, save_transcript, transcribe_with_retries
+from .reporting import Reporter
+from .whisper import WHISPER_PARAMS
+
+MEDIA_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".m4a", ".mp3", ".wav")
+
+logger = logging.getLogger("whisper_ultra")
+
+def find_media_files(paths, recursive=True):
+    """Espande file e cartelle nell'elenco ordinato dei file audio/video da trascrivere"""
+    files = []
+    for path in paths:
+        if os.path.isfile(path):
+            files.append(path)
+            continue
+
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            for name in sorted(names):
+                if name.lower().endswith(MEDIA_EXTENSIONS):
+                    files.append(os.path.join(root, name))
+            if not recursive:
+                break
+    return files
+
+def _extract_file(file_index, video_path, chunk_minutes, vad, skip, chunks_dir, chunk_queue):
+    """Processo di decodifica di un file: passa i chunk alla coda condivisa dello scheduler"""
+    pcm_hash = hashlib.sha256()
+    count = 0
+    complete = False
+    try:
+        chunks = extract_audio_chunks(video_path, chunk_minutes, vad, pcm_hash, skip, chunks_dir)
+        for chunk_path, chunk_number, segment_map in chunks:
+            chunk_queue.put(("chunk", file_index, chunk_path, chunk_number, segment_map))
+            count += 1
+        complete = True
+    finally:
+        chunk_queue.put(("end", file_index, count, pcm_hash.hexdigest() if complete else None))
+
+def _prepare_file(path, chunk_duration_minutes, max_workers, min_chunk_minutes=MIN_AUTOTUNE_CHUNK_MINUTES):
+    """Hash del file e durata dei chunk: gira in un thread, mentre gli altri file si trascrivono già"""
+    with tracing.span("hash", source=path):
+        source_digest = file_digest(path)
+    chunk_minutes = chunk_duration_minutes or recommended_chunk_minutes(
+        get_audio_duration(path), max_workers, min_chunk_minutes
+    )
+    return source_digest, chunk_minutes
+
+def transcribe_batch(video_paths, model="base", language="auto", chunk_duration_minutes=None,
+                     max_workers=4, threads=2, vad=True, file_processes=2, pool=None, cache=None,
+                     output_dir=TRANSCRIPTS_DIR, reporter=None, cascade=None, index=None,
+                     min_chunk_minutes=MIN_AUTOTUNE_CHUNK_MINUTES):
+    """Trascrive molti file condividendo tra tutti gli stessi worker whisper
+
+    Ogni file viene decodificato in un processo separato (al massimo file_processes
+    alla volta); i chunk di tutti i file finiscono in un'unica coda limitata servita da
+    max_workers worker. Hash e durata dei file si calcolano in parallelo e ogni file
+    parte appena pronto, senza aspettare gli altri. Con chunk_duration_minutes=None
+    la durata dei chunk è scelta per file, mai sotto min_chunk_minutes (quella
+    misurata dalla calibrazione, se c'è). Restituisce, nell'ordine di video_paths,
+    un dict per file con path, transcript (percorso salvato o None), num_chunks,
+    failed e cached. Con una Cascade il modello fa da passaggio veloce per tutti i
+    file. Con index (SearchIndex) ogni trascrizione salvata viene anche indicizzata.
+    """
+    reporter = reporter or Reporter()
+    if pool is not None:
+        pool.resize(max_workers, threads)
+    if cascade is not None and cascade.pool is not None:
+        cascade.pool.resize(max_workers, threads)
+
+    file_params = f"{WHISPER_PARAMS};vad={vad}"
+    # Cache e manifest distinguono la cascata dal modello veloce da solo
+    model_key = cascade.label(model) if cascade is not None else model
+    entries = [
+        {"path": path, "transcript": None, "num_chunks": 0, "failed": 0, "cached": False}
+        for path in video_paths
+    ]
+    if not entries:
+        return entries
+    jobs = []
+    jobs_by_key = {}
+    extractions = []
+
+    def index_transcript(path, text, chunks, video_name, language):
+        if index is None:
+            return
+        try:
+            index.add(path, text, chunks, video_name, model_key, language)
+        except Exception:
+            # La trascrizione è salvata: l'indice si può sempre ricostruire dall'archivio
+            logger.exception("Indicizzazione fallita: %s", path)
+
+    def consume(chunk_queue, done_queue):
+        while True:
+            item = chunk_queue.get()
+            if item is None:
+                return
+            if item[0] == "end":
+                done_queue.put(item)
+                continue
+
+            _, file_index, chunk_path, chunk_number, segment_map = item
+            job = jobs[file_index]
+            try:
+                result = consume_chunk(job, chunk_path, chunk_number, segment_map)
+            except Exception as e:
+                # Il file conta i chunk in arrivo: senza un risultato il batch resterebbe in attesa
+                logger.exception("Chunk %s di %s fallito", chunk_number, job["video_name"])
+                result = (chunk_number, f"[Errore {chunk_number}: {str(e)}]", False)
+            done_queue.put(("chunk", file_index, result))
+
+    def consume_chunk(job, chunk_path, chunk_number, segment_map):
+        if chunk_number in job["done"]:
+            # Ripresa: il chunk è già nel manifest
+            return (chunk_number, job["done"][chunk_number], True)
+
+        seconds = sum(length for _, _, length in segment_map)
+        try:
+            with tracing.span("chunk", job["span"], chunk=chunk_number, audio_seconds=seconds):
+                pin = job["pin"]
+                args = (chunk_path, pin.resolve(chunk_path) if pin is not None else language, model, chunk_number, 0)
+                result, attempt = transcribe_with_retries(args, seconds, cache, pool, threads, cascade)
+                tracing.annotate(attempts=attempt, success=result[2])
+        finally:
+            try:
+                os.remove(chunk_path)
+            except OSError:
+                pass
+        job["manifest"].record(result[0], result[1], result[2], attempt, segment_map)
+        return result
+
+    def save(job, entry):
+        """Salva (e indicizza) la trascrizione del job per entry, che può essere un suo duplicato"""
+        entry.update(num_chunks=job["count"], failed=job["failed"])
+        if job["text"] is None:
+            return
+        video_name = os.path.splitext(os.path.basename(entry["path"]))[0]
+        detected_language = job["manifest"].data.get("detected_language") or language
+        entry["transcript"] = save_transcript(
+            job["text"], video_name, output_dir, job["chunks"], model_key, detected_language
+        )
+        index_transcript(entry["transcript"], job["text"], job["chunks"], video_name, detected_language)
+        reporter.success(f"✅ {entry['path']}: {entry['transcript']}")
+
+    def finish(job):
+        job["finished"] = True
+        results = job["results"]
+        count = job["count"]
+        successes = sum(success for _, success in results.values())
+        failed = count - successes
+        job["failed"] = failed
+
+        job["manifest"].finish(count, failed)
+        cleanup_chunks(job["chunks_dir"])
+        job["span"].attrs.update(num_chunks=count, failed=failed)
+        job["span"].finish("nessun segmento trascritto" if not successes else None)
+
+        if not count:
+            reporter.error(f"❌ {job['video_name']}: errore nell'estrazione audio")
+        elif not successes:
+            reporter.error(f"❌ {job['video_name']}: errore durante la trascrizione")
+        else:
+            job["text"] = "\n\n".join(results[i][0] for i in sorted(results))
+            job["chunks"] = manifest_chunks(job["manifest"].data)
+        if job["text"] is not None and cache is not None and not failed and job["pcm_digest"]:
+            cache.add_alias(job["source_digest"], job["pcm_digest"])
+            cache.put(cache.key(job["pcm_digest"], model_key, language, file_params), job["text"])
+
+        if job["text"] is not None and job["pin"] is not None and job["pin"].language not in (None, "auto"):
+            reporter.info(f"🌐 {job['video_name']}: lingua {job['pin'].language}")
+        if job["text"] is not None and failed:
+            reporter.warning(f"⚠️ {job['video_name']}: {failed} segmenti con errori")
+        for entry in [job["entry"]] + job["duplicates"]:
+            save(job, entry)
+        if job["text"] is not None and not failed:
+            # Trascrizioni salvate: il manifest non serve più per riprendere
+            job["manifest"].remove()
+
+    def prepared(entry, source_digest, chunk_minutes, processes, chunk_queue):
+        """File pronto: dalla cache, duplicato di un altro job o nuovo job da decodificare
+
+        Restituisce "done" se il file è già risolto, "duplicate" se aspetta un job
+        già in corso, "job" se ne è partito uno nuovo.
+        """
+        path = entry["path"]
+        video_name = os.path.splitext(os.path.basename(path))[0]
+        if cache is not None:
+            pcm_digest = cache.pcm_digest_for(source_digest)
+            text = cache.get(cache.key(pcm_digest, model_key, language, file_params)) if pcm_digest else None
+            if text is not None:
+                entry.update(
+                    transcript=save_transcript(text, video_name, output_dir, model=model_key, language=language),
+                    num_chunks=1, cached=True
+                )
+                index_transcript(entry["transcript"], text, None, video_name, language)
+                reporter.success(f"♻️ {video_name}: trascrizione trovata in cache")
+                return "done"
+
+        key = job_key(source_digest, model_key, language, vad)
+        if key in jobs_by_key:
+            # Stesso contenuto già in questo batch: un solo job, una trascrizione per nome
+            job = jobs_by_key[key]
+            if job["finished"]:
+                save(job, entry)
+                return "done"
+            job["duplicates"].append(entry)
+            return "duplicate"
+
+        manifest = JobManifest.open(
+            key,
+            source=path,
+            video_name=video_name,
+            model=model_key,
+            language=language,
+            vad=vad,
+            chunk_minutes=chunk_minutes
+        )
+        chunks_dir = os.path.join(CHUNKS_DIR, manifest.data["job_id"])
+        job = {
+            "entry": entry,
+            "video_name": video_name,
+            "source_digest": source_digest,
+            "manifest": manifest,
+            "done": manifest.done_chunks(),
+            "chunks_dir": chunks_dir,
+            # Con "auto" la lingua si rileva una volta per file, sul primo chunk
+            "pin": LanguagePin(model, pool, threads, manifest) if language == "auto" else None,
+            "results": {},
+            "count": None,
+            "failed": 0,
+            "text": None,
+            "chunks": None,
+            "pcm_digest": None,
+            "finished": False,
+            "duplicates": [],
+            "span": tracing.span("batch_file", source=path, model=model, language=language)
+        }
+        jobs.append(job)
+        jobs_by_key[key] = job
+        extractions.append(processes.submit(
+            _extract_file, len(jobs) - 1, path, manifest.data["chunk_minutes"],
+            vad, set(job["done"]), chunks_dir, chunk_queue
+        ))
+        return "job"
+
+    reporter.info(
+        f"🚀 {len(entries)} file: {file_processes} processi di decodifica, "
+        f"{max_workers} worker whisper condivisi"
+    )
+
+    # spawn: niente fork di un processo che ha già thread attivi
+    context = multiprocessing.get_context("spawn")
+    done_queue = queue.Queue()
+
+    with context.Manager() as manager:
+        # Coda limitata: la decodifica non può andare troppo avanti rispetto a whisper
+        chunk_queue = manager.Queue(maxsize=max_workers * 2)
+
+        with ProcessPoolExecutor(max_workers=file_processes, mp_context=context) as processes, \
+                ThreadPoolExecutor(max_workers=max_workers) as scheduler, \
+                ThreadPoolExecutor(max_workers=file_processes, thread_name_prefix="batch-hash") as hashers:
+            for _ in range(max_workers):
+                scheduler.submit(consume, chunk_queue, done_queue)
+
+            # Hash e durata in parallelo: ogni file entra nella coda appena pronto
+            preparations = []
+            for i, entry in enumerate(entries):
+                future = hashers.submit(
+                    _prepare_file, entry["path"], chunk_duration_minutes, max_workers, min_chunk_minutes
+                )
+                future.add_done_callback(lambda future, i=i: done_queue.put(("prepared", i)))
+                preparations.append(future)
+
+            try:
+                unprepared = len(entries)
+                remaining = 0
+                resolved = 0
+                while unprepared or remaining:
+                    try:
+                        item = done_queue.get(timeout=1)
+                    except queue.Empty:
+                        # Un processo di decodifica morto non manda mai il marcatore di fine
+                        for i, extraction in enumerate(extractions):
+                            if (extraction.done() and jobs[i]["count"] is None
+                                    and isinstance(extraction.exception(), BrokenProcessPool)):
+                                done_queue.put(("end", i, len(jobs[i]["results"]), None))
+                        continue
+
+                    if item[0] == "prepared":
+                        entry = entries[item[1]]
+                        unprepared -= 1
+                        try:
+                            source_digest, chunk_minutes = preparations[item[1]].result()
+                        except Exception as e:
+                            reporter.error(f"❌ {entry['path']}: {e}")
+                            state = "done"
+                        else:
+                            state = prepared(entry, source_digest, chunk_minutes, processes, chunk_queue)
+                        if state == "job":
+                            remaining += 1
+                        elif state == "done":
+                            resolved += 1
+                            reporter.progress(resolved / len(entries), f"✅ {resolved}/{len(entries)} file")
+                        continue
+
+                    job = jobs[item[1]]
+                    if job["finished"]:
+                        continue
+
+                    if item[0] == "end":
+                        _, file_index, count, pcm_digest = item
+                        job["count"] = count
+                        job["pcm_digest"] = pcm_digest
+                    else:
+                        _, file_index, (chunk_number, text, success) = item
+                        job["results"][chunk_number] = (text, success)
+                        if not success:
+                            reporter.warning(f"⚠️ {job['video_name']}: problema con segmento {chunk_number}")
+
+                    if job["count"] is not None and len(job["results"]) >= job["count"]:
+                        finish(job)
+                        remaining -= 1
+                        resolved += 1 + len(job["duplicates"])
+                        reporter.progress(resolved / len(entries), f"✅ {resolved}/{len(entries)} file")
+            finally:
+                # Ferma lo scheduler anche se il ciclo si interrompe
+                for future in preparations:
+                    future.cancel()
+                for _ in range(max_workers):
+                    chunk_queue.put(None)
+
+    reporter.progress_done()
+    if cascade is not None and cascade.segments:
+        stats = cascade.stats()
+        reporter.info(
+            f"🪜 Cascata: {stats['weak_segments']}/{stats['segments']} segmenti incerti ridecodificati "
+            f"con {cascade.model} ({stats['redecoded_seconds']/60:.1f} min su {stats['audio_seconds']/60:.1f})"
+        )
+    return entries
@@ -0,0 +1,116 @@
+"""Cache su disco delle trascrizioni, indirizzata per contenuto"""
+
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+
+from .whisper import WHISPER_PARAMS
+
+TRANSCRIPT_CACHE_DB = "cache/transcripts.sqlite3"
+TRANSCRIPT_CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+def file_digest(path, offset=0, block_size=1024 * 1024):
+    """SHA-256 del contenuto di un file a partire da offset"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class TranscriptCache:
+    """Cache su disco delle trascrizioni, indirizzata per hash del PCM, con eviction LRU"""
+    
+    def __init__(self, path=TRANSCRIPT_CACHE_DB, max_bytes=TRANSCRIPT_CACHE_MAX_BYTES):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    key TEXT PRIMARY KEY,
+                    text TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS entries_lru ON entries(last_access);
+                CREATE TABLE IF NOT EXISTS aliases (
+                    source_digest TEXT PRIMARY KEY,
+                    pcm_digest TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS stats (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER NOT NULL
+                );
+            """)
+    
+    @staticmethod
+    def key(pcm_digest, model, language, params=WHISPER_PARAMS):
+        return hashlib.sha256(f"{pcm_digest}|{model}|{language}|{params}".encode()).hexdigest()
+    
+    def _count(self, name):
+        self._db.execute(
+            "INSERT INTO stats (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,)
+        )
+    
+    def get(self, key):
+        with self._lock, self._db:
+            row = self._db.execute("SELECT text FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self._count("misses")
+                return None
+            self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._count("hits")
+            return row[0]
+    
+    def put(self, key, text):
+        size = len(text.encode("utf-8"))
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO entries (key, text, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, text, size, time.time())
+            )
+            
+            total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            for old_key, old_size in self._db.execute(
+                "SELECT key, size FROM entries ORDER BY last_access"
+            ).fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM entries WHERE key = ?", (old_key,))
+                self._count("evictions")
+                total -= old_size
+    
+    def pcm_digest_for(self, source_digest):
+        """PCM già decodificato per questo file sorgente (re-upload, stesso URL)"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT pcm_digest FROM aliases WHERE source_digest = ?", (source_digest,)
+            ).fetchone()
+        return row[0] if row else None
+    
+    def add_alias(self, source_digest, pcm_digest):
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR REPLACE INTO aliases (source_digest, pcm_digest) VALUES (?, ?)",
+                (source_digest, pcm_digest)
+            )
+    
+    def stats(self):
+        with self._lock:
+            counters = dict(self._db.execute("SELECT name, value FROM stats").fetchall())
+            entries, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()
+        return {
+            "hits": counters.get("hits", 0),
+            "misses": counters.get("misses", 0),
+            "evictions": counters.get("evictions", 0),
+            "entries": entries,
+            "bytes": size
+        }
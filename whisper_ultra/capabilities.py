@@ -0,0 +1,95 @@
+"""Cosa offre questa macchina: binari whisper.cpp, modelli, encoder CoreML, core, RAM e chip
+
+Il sondaggio si fa una volta per processo e si ripete solo quando cambiano le
+cartelle di whisper.cpp (binario ricompilato, modello scaricato o convertito):
+a ogni rerun di Streamlit costa qualche stat invece di subprocess e exists sparsi.
+"""
+
+import os
+import platform
+import threading
+import multiprocessing
+
+from .whisper import WHISPER_CPP_DIR
+
+_lock = threading.Lock()
+_cache = {}
+
+def _paths(whisper_dir):
+    bin_dir = os.path.join(whisper_dir, "build", "bin")
+    return {
+        "bin_dir": bin_dir,
+        "models_dir": os.path.join(whisper_dir, "models"),
+        "cli": os.path.join(bin_dir, "whisper-cli"),
+        "server": os.path.join(bin_dir, "whisper-server"),
+    }
+
+def _fingerprint(whisper_dir):
+    """mtime e dimensione di cartelle e binari: cambia se si aggiunge, rimuove o ricompila qualcosa"""
+    fingerprint = []
+    for path in _paths(whisper_dir).values():
+        try:
+            stat = os.stat(path)
+            fingerprint.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            fingerprint.append(None)
+    return tuple(fingerprint)
+
+def _memory_mb():
+    """RAM fisica in MB, None dove sysconf non la espone (Windows)"""
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // (1024 * 1024)
+    except (AttributeError, ValueError, OSError):
+        return None
+
+def probe_capabilities(whisper_dir=WHISPER_CPP_DIR):
+    """Sondaggio completo, senza cache"""
+    paths = _paths(whisper_dir)
+    try:
+        names = set(os.listdir(paths["models_dir"]))
+    except OSError:
+        names = set()
+
+    models = {}
+    for name in names:
+        if not (name.startswith("ggml-") and name.endswith(".bin")):
+            continue
+        model = name[len("ggml-"):-len(".bin")]
+        path = os.path.join(paths["models_dir"], name)
+        models[model] = {
+            "path": path,
+            "size": os.path.getsize(path),
+            "coreml": f"ggml-{model}-encoder.mlmodelc" in names
+        }
+
+    chip = platform.processor()
+    return {
+        "cli": os.path.exists(paths["cli"]),
+        "server": os.path.exists(paths["server"]),
+        "models": models,
+        "cores": multiprocessing.cpu_count(),
+        "memory_mb": _memory_mb(),
+        "chip": chip,
+        "arm": "arm" in chip.lower()
+    }
+
+def get_capabilities(whisper_dir=WHISPER_CPP_DIR):
+    """Capacità in cache per processo, risondate solo se i file di whisper.cpp sono cambiati
+
+    Il dizionario restituito è condiviso: va letto, non modificato.
+    """
+    fingerprint = _fingerprint(whisper_dir)
+    with _lock:
+        cached = _cache.get(whisper_dir)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    capabilities = probe_capabilities(whisper_dir)
+    with _lock:
+        _cache[whisper_dir] = (fingerprint, capabilities)
+    return capabilities
+
+def invalidate_capabilities():
+    """Forza un nuovo sondaggio alla prossima richiesta"""
+    with _lock:
+        _cache.clear()
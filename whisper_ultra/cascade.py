@@ -0,0 +1,132 @@
+"""Cascata di modelli: passaggio veloce su tutto l'audio, modello grande solo sui segmenti incerti"""
+
+import threading
+import subprocess
+
+from . import tracing
+from .audio import chunk_seconds, span_audio
+from .whisper import transcribe_chunk, transcribe_segments
+
+# Confidenza media dei token sotto cui un segmento viene ridecodificato
+CASCADE_THRESHOLD = 0.6
+# Contesto attorno ai segmenti incerti; whisper-cli scarta gli input sotto il secondo
+CASCADE_PADDING_SECONDS = 0.3
+MIN_SPAN_SECONDS = 1.0
+
+def weak_spans(segments, threshold=CASCADE_THRESHOLD, padding=CASCADE_PADDING_SECONDS, duration=None):
+    """Intervalli da ridecodificare: segmenti incerti contigui uniti, con un margine
+
+    Restituisce [(inizio, fine, indici dei segmenti)] in secondi del chunk. I
+    segmenti senza confidenza o senza testo non vengono mai ridecodificati.
+    """
+    groups = []
+    for i, segment in enumerate(segments):
+        confidence = segment["confidence"]
+        if confidence is None or confidence >= threshold or not segment["text"].strip():
+            continue
+        if groups and groups[-1][2][-1] == i - 1:
+            groups[-1][1] = segment["end"]
+            groups[-1][2].append(i)
+        else:
+            groups.append([segment["start"], segment["end"], [i]])
+
+    spans = []
+    for start, end, indexes in groups:
+        start = max(start - padding, 0.0)
+        end = end + padding
+        if end - start < MIN_SPAN_SECONDS:
+            start = max(start - (MIN_SPAN_SECONDS - (end - start)) / 2, 0.0)
+            end = start + MIN_SPAN_SECONDS
+        if duration:
+            # A fine chunk il margine che manca si prende prima
+            end = min(end, duration)
+            start = max(min(start, end - MIN_SPAN_SECONDS), 0.0)
+        spans.append((start, end, indexes))
+    return spans
+
+class Cascade:
+    """Ridecodifica con un modello più grande i soli segmenti sotto soglia
+
+    Il testo dei segmenti sicuri resta quello del modello veloce; i segmenti
+    incerti (uniti se contigui, con un po' di contesto) vengono sostituiti dalla
+    trascrizione del modello grande. pool è il pool di whisper-server riservato al
+    modello grande: condividere quello del modello veloce farebbe ricaricare i
+    modelli a ogni chunk. Tiene anche il conto di quanto audio è stato ridecodificato.
+    """
+
+    def __init__(self, model="small", threshold=CASCADE_THRESHOLD, pool=None):
+        self.model = model
+        self.threshold = threshold
+        self.pool = pool
+        self._lock = threading.Lock()
+        self.segments = 0
+        self.weak_segments = 0
+        self.audio_seconds = 0.0
+        self.redecoded_seconds = 0.0
+        self.failed_spans = 0
+
+    def label(self, fast_model):
+        """Identifica la cascata nelle chiavi di cache e manifest al posto del solo modello"""
+        return f"{fast_model}>{self.model}@{self.threshold:g}"
+
+    def stats(self):
+        with self._lock:
+            return {
+                "model": self.model,
+                "threshold": self.threshold,
+                "segments": self.segments,
+                "weak_segments": self.weak_segments,
+                "audio_seconds": self.audio_seconds,
+                "redecoded_seconds": self.redecoded_seconds,
+                "failed_spans": self.failed_spans
+            }
+
+    def transcribe(self, args, pool=None, threads=2, timeout=600):
+        """Come transcribe_chunk, con il modello degli args come passaggio veloce"""
+        chunk_path, language, model, chunk_number, total_chunks = args
+
+        try:
+            with tracing.span("cascade_fast", model=model):
+                segments = transcribe_segments(chunk_path, language, model, pool, threads, timeout)
+        except (TimeoutError, subprocess.TimeoutExpired):
+            return (chunk_number, f"[Timeout chunk {chunk_number}]", False)
+        except Exception as e:
+            return (chunk_number, f"[Errore {chunk_number}: {str(e)}]", False)
+
+        duration = chunk_seconds(chunk_path)
+        spans = weak_spans(segments, self.threshold, duration=duration)
+        texts = [segment["text"] for segment in segments]
+        redecoded = 0.0
+        failed = 0
+
+        for start, end, indexes in spans:
+            # In memoria: al server via HTTP o a whisper-cli da stdin
+            span_wav = span_audio(chunk_path, start, end)
+            with tracing.span("cascade_strong", model=self.model, audio_seconds=round(end - start, 3),
+                              segments=len(indexes)):
+                _, text, success = transcribe_chunk(
+                    (span_wav, language, self.model, chunk_number, total_chunks), self.pool, threads, timeout
+                )
+                tracing.annotate(success=success)
+
+            if not success:
+                # Resta il testo del modello veloce
+                failed += 1
+                continue
+            text = " ".join(text.split())
+            texts[indexes[0]] = f" {text}" if text else None
+            for i in indexes[1:]:
+                texts[i] = None
+            redecoded += end - start
+
+        weak = sum(len(indexes) for _, _, indexes in spans)
+        with self._lock:
+            self.segments += len(segments)
+            self.weak_segments += weak
+            self.audio_seconds += duration
+            self.redecoded_seconds += redecoded
+            self.failed_spans += failed
+        tracing.annotate(segments=len(segments), weak_segments=weak, redecoded_seconds=round(redecoded, 3))
+
+        lines = [text for text in texts if text is not None]
+        return (chunk_number, "\n".join(lines) + "\n" if lines else "", True)
@@ -0,0 +1,173 @@
+"""Riga di comando: python -m whisper_ultra file_o_cartelle... (o --follow file_o_diretta)"""
+
+import os
+import sys
+import time
+import logging
+import argparse
+import multiprocessing
+
+from . import tracing
+from .autotune import MIN_AUTOTUNE_CHUNK_MINUTES, load_tuning_profile, tune_for_file
+from .audio import get_audio_duration
+from .batch import find_media_files, transcribe_batch
+from .cache import TranscriptCache
+from .cascade import CASCADE_THRESHOLD, Cascade
+from .follow import FOLLOW_MAX_LAG_SECONDS, FOLLOW_WINDOW_SECONDS, open_follow_source, transcribe_follow
+from .models import ModelDownloader
+from .pipeline import TRANSCRIPTS_DIR
+from .remote import RemoteWorkerPool
+from .reporting import ConsoleReporter
+from .search import SearchIndex
+from .whisper import WHISPER_CLI_BINARY, WHISPER_SERVER_BINARY, WhisperServerPool, model_path
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog="python -m whisper_ultra",
+        description="Trascrive file audio/video (o cartelle intere) con whisper.cpp"
+    )
+    parser.add_argument("paths", nargs="+", help="file o cartelle da trascrivere (con --follow un file o un URL)")
+    parser.add_argument("-m", "--model", default="base", choices=["tiny", "base", "small"])
+    parser.add_argument("--cascade", choices=["base", "small"],
+                        help="ridecodifica con questo modello i soli segmenti incerti del modello -m")
+    parser.add_argument("--cascade-threshold", type=float, default=CASCADE_THRESHOLD,
+                        help=f"confidenza media dei token sotto cui ridecodificare (default: {CASCADE_THRESHOLD})")
+    parser.add_argument("-l", "--language", default="auto", help="codice lingua (default: auto)")
+    parser.add_argument("-o", "--output-dir", default=TRANSCRIPTS_DIR, help="cartella delle trascrizioni")
+    parser.add_argument("-w", "--workers", type=int, help="worker whisper condivisi tra tutti i file")
+    parser.add_argument("-t", "--threads", type=int, help="thread per worker")
+    parser.add_argument("--chunk-minutes", type=int, help="durata dei chunk (default: scelta per file)")
+    parser.add_argument("--file-processes", type=int, default=2, help="file decodificati in parallelo")
+    parser.add_argument("--no-vad", action="store_true", help="non saltare i silenzi")
+    parser.add_argument("--no-cache", action="store_true", help="non usare la cache delle trascrizioni")
+    parser.add_argument("--no-index", action="store_true", help="non aggiungere le trascrizioni all'indice di ricerca")
+    parser.add_argument("--no-server", action="store_true", help="un whisper-cli per chunk invece dei worker residenti")
+    parser.add_argument("--remote", nargs="+", metavar="URL",
+                        help="trascrive sui nodi `python -m whisper_ultra.remote` indicati (es. http://host:8790)")
+    parser.add_argument("--autotune", action="store_true", help="calibra worker × thread se manca il profilo")
+    parser.add_argument("--no-download", action="store_true", help="non scaricare il modello se manca")
+    parser.add_argument("--no-recursive", action="store_true", help="non entrare nelle sottocartelle")
+    parser.add_argument("--metrics-file", default=tracing.METRICS_FILE,
+                        help="metriche Prometheus a fine batch (span in WHISPER_ULTRA_TRACE)")
+    parser.add_argument("--follow", action="store_true",
+                        help="segue un file ancora in registrazione o una diretta, trascrivendo mentre cresce")
+    parser.add_argument("--window", type=float, default=FOLLOW_WINDOW_SECONDS,
+                        help=f"con --follow, secondi di audio per finestra (default: {FOLLOW_WINDOW_SECONDS})")
+    parser.add_argument("--max-lag", type=float, default=FOLLOW_MAX_LAG_SECONDS,
+                        help=f"con --follow, ritardo massimo in secondi (default: {FOLLOW_MAX_LAG_SECONDS})")
+    parser.add_argument("--catch-up", choices=["tiny", "base"],
+                        help="con --follow, modello per le finestre in ritardo oltre --max-lag")
+    parser.add_argument("-v", "--verbose", action="store_true")
+    return parser
+
+def follow(args, pool, index, reporter):
+    """--follow: trascrive il file o la diretta finché cresce (Ctrl+C per fermarsi)"""
+    source = open_follow_source(args.paths[0], reporter)
+    if source is None:
+        reporter.error(f"❌ Né un file esistente né una diretta in corso: {args.paths[0]}")
+        return 2
+    workers, threads = args.workers or 2, args.threads or 2
+    if pool is not None:
+        pool.resize(workers, threads)
+    result = transcribe_follow(
+        source, args.model, args.language, args.window, workers, threads,
+        not args.no_vad, pool, args.max_lag, args.catch_up, output_dir=args.output_dir, reporter=reporter
+    )
+    if not result["text"]:
+        reporter.error("❌ Nessuna finestra trascritta")
+        return 1
+    if index is not None:
+        index.add(result["path"], result["text"], result["chunks"], source.title, result["model"],
+                  result["language"], result["duration"])
+    reporter.success(f"✅ {result['path']}")
+    return 1 if result["failed"] else 0
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(message)s"
+    )
+    reporter = ConsoleReporter()
+
+    if args.follow:
+        if len(args.paths) != 1:
+            reporter.error("❌ --follow segue un solo file o URL")
+            return 2
+        files = args.paths
+    else:
+        files = find_media_files(args.paths, recursive=not args.no_recursive)
+    if not files:
+        reporter.error("❌ Nessun file audio/video trovato")
+        return 2
+
+    if args.remote:
+        # Modelli e whisper.cpp stanno sui nodi: qui servono solo ffmpeg e la rete
+        pool = RemoteWorkerPool(args.remote)
+        if not pool.available():
+            reporter.error("❌ Nessun worker remoto raggiungibile")
+            return 2
+        reporter.info(f"🌐 {len(args.remote)} worker remoti, {pool.size} slot")
+        cascade_pool = pool
+    else:
+        for model in filter(None, (args.model, args.cascade, args.catch_up)):
+            if not os.path.exists(model_path(model)):
+                if args.no_download or not ModelDownloader().ensure(model, reporter):
+                    reporter.error(f"❌ Modello mancante: {model_path(model)}")
+                    return 2
+
+        use_server = os.path.exists(WHISPER_SERVER_BINARY) and not args.no_server
+        if not use_server and not os.path.exists(WHISPER_CLI_BINARY):
+            reporter.error(f"❌ whisper.cpp non trovato: {WHISPER_CLI_BINARY}")
+            return 2
+
+        pool = WhisperServerPool() if use_server else None
+        # Pool separato: i worker del modello grande restano caricati accanto a quelli veloci
+        cascade_pool = pool.companion() if use_server else None
+
+    cascade = None
+    if args.cascade and args.cascade != args.model:
+        cascade = Cascade(args.cascade, args.cascade_threshold, cascade_pool)
+    cache = None if args.no_cache else TranscriptCache()
+    index = None if args.no_index else SearchIndex()
+    start_time = time.time()
+
+    try:
+        if args.follow:
+            return follow(args, pool, index, reporter)
+        workers = args.workers
+        threads = args.threads
+        profile = load_tuning_profile(args.model) if not args.remote else {"workers": pool.size, "threads": 2}
+        if args.autotune and not profile:
+            # Calibrazione sul primo file: il profilo vale poi per tutti
+            tuning = tune_for_file(
+                files[0], args.model, args.language, get_audio_duration(files[0]), pool, reporter=reporter
+            )
+            if tuning:
+                profile = load_tuning_profile(args.model) or {"workers": tuning[0], "threads": tuning[1]}
+        if profile:
+            workers = workers or profile["workers"]
+            threads = threads or profile["threads"]
+        workers = workers or max(1, multiprocessing.cpu_count() - 1)
+        threads = threads or 2
+
+        entries = transcribe_batch(
+            files, args.model, args.language, args.chunk_minutes, workers, threads,
+            not args.no_vad, args.file_processes, pool, cache, args.output_dir, reporter, cascade, index,
+            (profile or {}).get("min_chunk_minutes", MIN_AUTOTUNE_CHUNK_MINUTES)
+        )
+    finally:
+        if pool is not None:
+            pool.shutdown()
+        if cascade is not None and cascade.pool is not None and cascade.pool is not pool:
+            cascade.pool.shutdown()
+        tracing.tracer.write_metrics(args.metrics_file)
+
+    failed = [entry for entry in entries if entry["transcript"] is None or entry["failed"]]
+    reporter.info(
+        f"🏁 {len(entries) - len(failed)}/{len(entries)} file trascritti in "
+        f"{time.time() - start_time:.1f}s"
+    )
+    for entry in failed:
+        print(f"❌ {entry['path']}", file=sys.stderr)
+    return 1 if failed else 0
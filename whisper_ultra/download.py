@@ -0,0 +1,332 @@
+"""Download da YouTube e salvataggio dei file caricati"""
+
+import os
+import re
+import shutil
+import hashlib
+import logging
+import threading
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from . import tracing
+from .audio import get_stream_duration
+from .reporting import Reporter
+
+# Connessioni parallele e dimensione dei byte range per lo streaming audio
+DOWNLOAD_CONNECTIONS = 4
+RANGE_BLOCK_BYTES = 4 * 1024 * 1024
+# Sotto questo bitrate la qualità non basta più a whisper
+MIN_AUDIO_ABR = 48
+STREAMABLE_PROTOCOLS = ("https", "http", "http_dash_segments")
+CONTENT_RANGE_RE = re.compile(r"^bytes (\d+)-(\d+)/")
+
+logger = logging.getLogger("whisper_ultra")
+
+class RangeError(OSError):
+    """Il server ha ignorato o troncato il byte range richiesto"""
+
+def download_video(video_url, save_path, reporter=None):
+    """Scarica il video in save_path e restituisce il percorso del file"""
+    # Import qui: yt_dlp serve solo a chi scarica
+    import yt_dlp
+    
+    reporter = reporter or Reporter()
+    reporter.info("📥 Scaricamento...")
+    os.makedirs(save_path, exist_ok=True)
+    
+    ydl_opts = {
+        'outtmpl': os.path.join(save_path, '%(title)s.%(ext)s'),
+        'format': 'bestvideo+bestaudio/best',
+        'merge_output_format': 'mp4'
+    }
+    
+    with tracing.span("download", source=video_url):
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            info = ydl.extract_info(video_url, download=True)
+            downloaded_file = ydl.prepare_filename(info)
+        tracing.annotate(bytes=os.path.getsize(downloaded_file) if os.path.exists(downloaded_file) else 0)
+    
+    reporter.success(f"✅ Salvato in: {save_path}")
+    return downloaded_file
+
+def save_uploaded_file(uploaded_file, save_path="uploads"):
+    """Copia un file caricato (qualsiasi oggetto file con .name) in save_path"""
+    os.makedirs(save_path, exist_ok=True)
+    file_path = os.path.join(save_path, os.path.basename(uploaded_file.name))
+    
+    with open(file_path, "wb") as f:
+        shutil.copyfileobj(uploaded_file, f)
+    
+    return file_path
+
+def choose_audio_format(formats, min_abr=MIN_AUDIO_ABR):
+    """Il formato solo audio più piccolo con bitrate sufficiente, scaricabile via HTTP"""
+    candidates = [
+        f for f in formats
+        if f.get("vcodec") == "none" and f.get("acodec") not in (None, "none")
+        and f.get("protocol", "https") in STREAMABLE_PROTOCOLS
+    ]
+    if not candidates:
+        return None
+    
+    good = [f for f in candidates if (f.get("abr") or 0) >= min_abr] or candidates
+    return min(good, key=lambda f: (f.get("filesize") or f.get("filesize_approx") or float("inf"),
+                                    f.get("abr") or 0))
+
+def _check_range(response, data, start, end):
+    """Solleva RangeError se la risposta non è esattamente i byte start-end"""
+    content_range = response.headers.get("Content-Range") or ""
+    match = CONTENT_RANGE_RE.match(content_range)
+    if match:
+        if (int(match.group(1)), int(match.group(2))) != (start, end):
+            raise RangeError(f"Content-Range {content_range} per bytes={start}-{end}")
+    elif response.status != 206:
+        # 200 con il file intero: il server non supporta i range
+        raise RangeError(f"risposta {response.status} invece di 206 per bytes={start}-{end}")
+    if len(data) != end - start + 1:
+        raise RangeError(f"{len(data)} byte invece di {end - start + 1} per bytes={start}-{end}")
+
+def _fetch(url, headers, start=None, end=None, timeout=60, attempts=3):
+    """GET di un frammento o di un byte range, con qualche tentativo
+
+    Un range non rispettato solleva RangeError senza altri tentativi: chi chiama
+    ripiega su un GET sequenziale.
+    """
+    for attempt in range(1, attempts + 1):
+        request = urllib.request.Request(url, headers=headers)
+        if start is not None:
+            request.add_header("Range", f"bytes={start}-{end}")
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                data = response.read()
+                if start is not None:
+                    _check_range(response, data, start, end)
+                return data
+        except RangeError:
+            raise
+        except OSError:
+            if attempt == attempts:
+                raise
+
+def _fetch_sequential(url, headers, skip=0, block_size=1024 * 1024, timeout=60):
+    """GET unico dell'intero file a blocchi, saltando i primi skip byte già consegnati"""
+    request = urllib.request.Request(url, headers=headers)
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        while True:
+            data = response.read(block_size)
+            if not data:
+                return
+            if skip:
+                if len(data) <= skip:
+                    skip -= len(data)
+                    continue
+                data = data[skip:]
+                skip = 0
+            yield data
+
+class StreamSource:
+    """Sorgente che ffmpeg decodifica da stdin: le sottoclassi forniscono blocks()
+
+    Come un percorso, va bene per transcribe_file ed extract_audio_chunks; in più
+    ha title, duration, source_id, digest (identità per cache e manifest) ed error.
+    """
+    
+    span_name = "feed"
+    # Opzioni di ffmpeg prima di -i, per formati che vanno dichiarati
+    input_options = ()
+    
+    def __init__(self, title, duration, source_id):
+        self.title = title
+        self.duration = duration or 0
+        self.source_id = source_id
+        self.bytes_read = 0
+        self.error = None
+    
+    def blocks(self):
+        raise NotImplementedError
+    
+    def release(self):
+        """Chiamato quando ffmpeg ha ricevuto tutto l'input, e da chi ha creato la sorgente a fine job
+
+        Può essere chiamato più volte.
+        """
+    
+    def feed(self, pipe, parent=None):
+        """Scrive l'audio nella pipe di ffmpeg (da un thread); gli errori restano in self.error"""
+        span = tracing.span(self.span_name, parent, source=self.source_id)
+        try:
+            for data in self.blocks():
+                pipe.write(data)
+        except BrokenPipeError:
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+            self.release()
+            span.attrs["bytes"] = self.bytes_read
+            span.finish(self.error)
+    
+    def start_feeding(self, pipe):
+        # Lo span del feed è figlio di quello della decodifica che lo avvia
+        thread = threading.Thread(target=self.feed, args=(pipe, tracing.current_span()), daemon=True)
+        thread.start()
+        return thread
+
+class AudioStream(StreamSource):
+    """Audio di un URL scaricato a pezzi in parallelo e consegnato in ordine a ffmpeg"""
+    
+    span_name = "download"
+    
+    def __init__(self, title, duration, source_id, fmt, connections=DOWNLOAD_CONNECTIONS):
+        super().__init__(title, duration, source_id)
+        self.format = fmt
+        self.connections = connections
+    
+    @property
+    def digest(self):
+        """Identifica la sorgente per cache e manifest al posto dell'hash del file"""
+        return hashlib.sha256(f"{self.source_id}|{self.format.get('format_id')}".encode()).hexdigest()
+    
+    def _pieces(self):
+        fmt = self.format
+        if fmt.get("fragments"):
+            base = fmt.get("fragment_base_url") or ""
+            for fragment in fmt["fragments"]:
+                yield fragment.get("url") or urllib.parse.urljoin(base, fragment["path"]), None, None
+            return
+        
+        size = fmt.get("filesize")
+        if not size:
+            request = urllib.request.Request(fmt["url"], headers=fmt.get("http_headers") or {}, method="HEAD")
+            try:
+                with urllib.request.urlopen(request, timeout=30) as response:
+                    size = int(response.headers.get("Content-Length") or 0)
+            except (OSError, ValueError):
+                size = 0
+        if not size:
+            yield fmt["url"], None, None
+            return
+        
+        for start in range(0, size, RANGE_BLOCK_BYTES):
+            yield fmt["url"], start, min(start + RANGE_BLOCK_BYTES, size) - 1
+    
+    def blocks(self):
+        """Blocchi di byte in ordine; al massimo 2 × connections pezzi in volo
+
+        Se il server non rispetta i byte range (200 col file intero, range
+        troncato) il resto arriva con un solo GET sequenziale, dal primo byte
+        non ancora consegnato.
+        """
+        headers = self.format.get("http_headers") or {}
+        pending = deque()
+        fallback = None
+        with ThreadPoolExecutor(max_workers=self.connections) as executor:
+            try:
+                for url, start, end in self._pieces():
+                    pending.append(executor.submit(_fetch, url, headers, start, end))
+                    if len(pending) >= self.connections * 2:
+                        data = pending.popleft().result()
+                        self.bytes_read += len(data)
+                        yield data
+                while pending:
+                    data = pending.popleft().result()
+                    self.bytes_read += len(data)
+                    yield data
+            except RangeError as e:
+                logger.warning("Byte range non supportati (%s): download sequenziale", e)
+                fallback = self.format["url"]
+            finally:
+                for future in pending:
+                    future.cancel()
+        if fallback is not None:
+            for data in _fetch_sequential(fallback, headers, skip=self.bytes_read):
+                self.bytes_read += len(data)
+                yield data
+
+def open_audio_stream(video_url, reporter=None):
+    """AudioStream del formato solo audio più piccolo adatto, None se l'URL non lo permette"""
+    import yt_dlp
+    from yt_dlp.utils import sanitize_filename
+    
+    reporter = reporter or Reporter()
+    with tracing.span("resolve", source=video_url):
+        with yt_dlp.YoutubeDL({"quiet": True, "noplaylist": True}) as ydl:
+            info = ydl.extract_info(video_url, download=False)
+    
+    fmt = choose_audio_format(info.get("formats") or [info])
+    if fmt is None:
+        return None
+    
+    size = fmt.get("filesize") or fmt.get("filesize_approx")
+    size_text = f", {size/(1024*1024):.1f} MB" if size else ""
+    reporter.info(f"🎧 Solo audio: {fmt.get('format_id')} ({fmt.get('acodec')}, {fmt.get('abr') or '?'} kbps{size_text})")
+    return AudioStream(
+        sanitize_filename(info.get("title") or "video"),
+        info.get("duration"),
+        f"{info.get('extractor_key')}:{info.get('id')}",
+        fmt
+    )
+
+class UploadSource(StreamSource):
+    """File caricato decodificato direttamente dalla memoria, senza copia in uploads/
+
+    L'hash del contenuto (lo stesso di file_digest sul file) rende identici a
+    cache e manifest due upload uguali; i byte vengono rilasciati appena ffmpeg
+    li ha ricevuti tutti. Hash e durata vengono da un'unica lettura: gli stessi
+    blocchi passano a sha256 e a ffprobe.
+    """
+    
+    span_name = "upload"
+    
+    def __init__(self, fileobj, name=None, block_size=1024 * 1024):
+        self.fileobj = fileobj
+        self.block_size = block_size
+        name = name or getattr(fileobj, "name", "upload")
+        
+        digest = hashlib.sha256()
+        
+        def hashed():
+            for data in self._read():
+                digest.update(data)
+                yield data
+        
+        blocks = hashed()
+        duration = get_stream_duration(blocks)
+        # ffprobe può fermarsi prima della fine: il resto serve solo all'hash
+        for _ in blocks:
+            pass
+        self._digest = digest.hexdigest()
+        
+        super().__init__(
+            os.path.splitext(os.path.basename(name))[0],
+            duration,
+            f"upload:{self._digest[:16]}"
+        )
+    
+    @property
+    def digest(self):
+        return self._digest
+    
+    def _read(self):
+        self.fileobj.seek(0)
+        for data in iter(lambda: self.fileobj.read(self.block_size), b""):
+            yield data
+    
+    def blocks(self):
+        if self.fileobj is None:
+            raise RuntimeError("upload già rilasciato")
+        for data in self._read():
+            self.bytes_read += len(data)
+            yield data
+    
+    def release(self):
+        if self.fileobj is not None:
+            self.fileobj.close()
+            self.fileobj = None
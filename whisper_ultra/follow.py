@@ -0,0 +1,402 @@
+"""Trascrizione al seguito: file ancora in registrazione e dirette, trascritti mentre crescono
+
+La sorgente (GrowingFileSource o LiveStreamSource) passa a ffmpeg i byte man
+mano che arrivano; il PCM decodificato viene chiuso in finestre brevi, tagliate
+nelle pause, e ogni finestra va a whisper appena è completa. Il testo viene
+aggiunto al file della trascrizione in ordine, finestra dopo finestra.
+
+Il ritardo di una finestra è il tempo tra l'arrivo del suo primo audio e il
+momento in cui il suo testo è nel file: vale circa la durata della finestra
+più il tempo di whisper. Più worker tengono il passo se whisper da solo è più
+lento del tempo reale; oltre max_lag le finestre passano al modello veloce
+(catch_up_model), se indicato, finché il ritardo non rientra.
+"""
+
+import os
+import re
+import time
+import queue
+import hashlib
+import threading
+import urllib.parse
+from contextlib import nullcontext
+
+from . import tracing
+from .audio import PCM_BYTES_PER_SECOND, extract_audio_chunks
+from .download import StreamSource, _fetch
+from .pipeline import TRANSCRIPTS_DIR, LanguagePin, save_transcript_sidecar, transcribe_with_retries, transcript_path
+from .reporting import Reporter
+from .straggler import ChunkRunner
+
+# Finestre corte: il ritardo non scende sotto la loro durata
+FOLLOW_WINDOW_SECONDS = 30
+# Un file che non cresce da tanto è una registrazione finita
+FOLLOW_IDLE_SECONDS = 30
+FOLLOW_POLL_SECONDS = 0.5
+FOLLOW_MAX_LAG_SECONDS = 120
+# Segmenti HLS dal bordo della diretta con cui partire
+LIVE_EDGE_SEGMENTS = 3
+
+class GrowingFileSource(StreamSource):
+    """File che qualcuno sta ancora scrivendo: letto fino in fondo, poi atteso finché cresce
+
+    Finisce quando il file resta fermo per idle_seconds o quando si chiama stop().
+    Un WAV in registrazione ha spesso nell'header una lunghezza provvisoria:
+    ffmpeg la ignora e legge fino alla fine dei dati.
+    """
+
+    span_name = "follow"
+
+    def __init__(self, path, idle_seconds=FOLLOW_IDLE_SECONDS, poll=FOLLOW_POLL_SECONDS, block_size=64 * 1024):
+        super().__init__(
+            os.path.splitext(os.path.basename(path))[0],
+            0,
+            f"follow:{os.path.abspath(path)}"
+        )
+        self.path = path
+        self.idle_seconds = idle_seconds
+        self.poll = poll
+        self.block_size = block_size
+        if path.lower().endswith(".wav"):
+            self.input_options = ("-ignore_length", "1")
+        self._stop = threading.Event()
+
+    @property
+    def digest(self):
+        return hashlib.sha256(self.source_id.encode()).hexdigest()
+
+    def stop(self):
+        self._stop.set()
+
+    def blocks(self):
+        idle_since = time.time()
+        with open(self.path, "rb") as f:
+            while not self._stop.is_set():
+                data = f.read(self.block_size)
+                if data:
+                    self.bytes_read += len(data)
+                    idle_since = time.time()
+                    yield data
+                elif time.time() - idle_since >= self.idle_seconds:
+                    break
+                else:
+                    self._stop.wait(self.poll)
+
+def parse_media_playlist(text, base_url):
+    """Playlist HLS: (segmenti [(sequenza, url)], init o None, target duration, finita)
+
+    Di una master playlist restituisce come unico "segmento" la variante con
+    meno banda, con sequenza None: va scaricata e letta a sua volta.
+    """
+    sequence = 0
+    target = 6.0
+    init = None
+    ended = False
+    segments = []
+    variants = []
+    bandwidth = None
+    for line in text.splitlines():
+        line = line.strip()
+        if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+            sequence = int(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-TARGETDURATION:"):
+            target = float(line.split(":", 1)[1])
+        elif line.startswith("#EXT-X-MAP:"):
+            match = re.search(r'URI="([^"]+)"', line)
+            init = urllib.parse.urljoin(base_url, match.group(1)) if match else None
+        elif line.startswith("#EXT-X-STREAM-INF:"):
+            match = re.search(r"BANDWIDTH=(\d+)", line)
+            bandwidth = int(match.group(1)) if match else 0
+        elif line == "#EXT-X-ENDLIST":
+            ended = True
+        elif line and not line.startswith("#"):
+            url = urllib.parse.urljoin(base_url, line)
+            if bandwidth is not None:
+                variants.append((bandwidth, url))
+                bandwidth = None
+            else:
+                segments.append((sequence + len(segments), url))
+    if variants:
+        return [(None, min(variants)[1])], None, target, False
+    return segments, init, target, ended
+
+class LiveStreamSource(StreamSource):
+    """Diretta HLS: i segmenti nuovi della playlist vanno a ffmpeg in ordine appena pubblicati
+
+    Parte dagli ultimi edge_segments segmenti, non dall'inizio della diretta:
+    il ritardo resta quello della finestra. Finisce con la diretta
+    (#EXT-X-ENDLIST) o con stop().
+    """
+
+    span_name = "live"
+
+    def __init__(self, title, source_id, playlist_url, headers=None, edge_segments=LIVE_EDGE_SEGMENTS):
+        super().__init__(title, 0, source_id)
+        self.playlist_url = playlist_url
+        self.headers = headers or {}
+        self.edge_segments = edge_segments
+        self._stop = threading.Event()
+
+    @property
+    def digest(self):
+        return hashlib.sha256(f"{self.source_id}|live".encode()).hexdigest()
+
+    def stop(self):
+        self._stop.set()
+
+    def _playlist(self):
+        url = self.playlist_url
+        while True:
+            text = _fetch(url, self.headers, timeout=30).decode("utf-8", "replace")
+            segments, init, target, ended = parse_media_playlist(text, url)
+            if segments and segments[0][0] is None:
+                # Master playlist: da qui in poi si legge direttamente la variante
+                url = self.playlist_url = segments[0][1]
+                continue
+            return segments, init, target, ended
+
+    def blocks(self):
+        last = None
+        sent_init = None
+        while not self._stop.is_set():
+            segments, init, target, ended = self._playlist()
+            if last is None and not ended:
+                segments = segments[-self.edge_segments:]
+            if init and init != sent_init:
+                data = _fetch(init, self.headers)
+                self.bytes_read += len(data)
+                sent_init = init
+                yield data
+            for sequence, url in segments:
+                if self._stop.is_set():
+                    return
+                if last is not None and sequence <= last:
+                    continue
+                data = _fetch(url, self.headers)
+                self.bytes_read += len(data)
+                last = sequence
+                yield data
+            if ended:
+                return
+            self._stop.wait(max(target / 2, FOLLOW_POLL_SECONDS))
+
+def choose_live_format(formats):
+    """Il formato HLS di una diretta con l'audio più leggero (solo audio se c'è)"""
+    candidates = [
+        f for f in formats
+        if f.get("acodec") != "none" and str(f.get("protocol", "")).startswith("m3u8")
+    ]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda f: (f.get("vcodec") not in (None, "none"), f.get("tbr") or float("inf")))
+
+def open_follow_source(target, reporter=None, idle_seconds=FOLLOW_IDLE_SECONDS):
+    """Sorgente da seguire: un file locale che cresce o l'URL di una diretta (None se non lo è)"""
+    if os.path.exists(target):
+        return GrowingFileSource(target, idle_seconds)
+
+    import yt_dlp
+    from yt_dlp.utils import sanitize_filename
+
+    reporter = reporter or Reporter()
+    with tracing.span("resolve", source=target):
+        with yt_dlp.YoutubeDL({"quiet": True, "noplaylist": True}) as ydl:
+            info = ydl.extract_info(target, download=False)
+    if not info.get("is_live"):
+        return None
+
+    fmt = choose_live_format(info.get("formats") or [info])
+    if fmt is None:
+        return None
+    reporter.info(f"🔴 Diretta: formato {fmt.get('format_id')} ({fmt.get('acodec') or '?'}, {fmt.get('tbr') or '?'} kbps)")
+    return LiveStreamSource(
+        sanitize_filename(info.get("title") or "diretta"),
+        f"{info.get('extractor_key')}:{info.get('id')}",
+        fmt["url"],
+        fmt.get("http_headers")
+    )
+
+def transcribe_follow(source, model="base", language="auto", window_seconds=FOLLOW_WINDOW_SECONDS,
+                      max_workers=2, threads=2, vad=True, pool=None, max_lag=FOLLOW_MAX_LAG_SECONDS,
+                      catch_up_model=None, video_name=None, output_path=None, output_dir=TRANSCRIPTS_DIR,
+                      reporter=None, scheduler=None, owner=None):
+    """Trascrive source (GrowingFileSource o LiveStreamSource) finestra per finestra mentre arriva
+
+    Il testo viene aggiunto a output_path (di default una nuova trascrizione in
+    output_dir) appena ogni finestra è trascritta, nello stesso formato di
+    save_transcript; alla fine accanto c'è anche il suo .json. Ctrl+C (o source.stop()) chiude la sorgente: le finestre già
+    ricevute vengono comunque trascritte.
+
+    Restituisce un dict come transcribe_file (text, num_chunks, failed,
+    duration, elapsed, cached, bytes_written, cascade, chunks, model,
+    language) con in più path, lag_max e lag_mean (secondi di ritardo delle
+    finestre) e catch_up (finestre trascritte con catch_up_model).
+    """
+    reporter = reporter or Reporter()
+    start_time = time.time()
+    video_name = video_name or source.title
+    max_workers = max(1, max_workers)
+    if pool is not None:
+        # Il pool lo dimensiona chi lo crea: può essere condiviso con altri job
+        if pool.remote:
+            # I nodi remoti hanno la loro CPU: il budget locale non li riguarda
+            scheduler = None
+    output_path = output_path or transcript_path(video_name, output_dir)
+    reporter.info(
+        f"🔴 Trascrizione al seguito di {video_name}: finestre da {window_seconds:.0f}s, "
+        f"{max_workers} worker → {output_path}"
+    )
+
+    done_queue = queue.Queue()
+    produced = []
+    # Per finestra: (mappa del parlato, istante stimato di arrivo del suo primo audio)
+    windows = {}
+    models = {}
+    state = {"model": model}
+    pin = LanguagePin(model, pool, threads) if language == "auto" else None
+
+    def work(chunk, chunk_number, seconds, started, cancel):
+        window_model = state["model"]
+        models[chunk_number] = window_model
+        # Finestre in memoria: al server via HTTP o a whisper-cli da stdin
+        args = (chunk, language, window_model, chunk_number, chunk_number + 1)
+        slot = nullcontext()
+        if scheduler is not None:
+            slot = scheduler.slot(owner, threads, (window_model,), (pool,))
+        with slot:
+            if cancel.is_set():
+                # Un'altra copia ha già finito mentre questa aspettava lo slot
+                return "", False, 0
+            started()
+            if pin is not None:
+                args = (args[0], pin.resolve(args[0])) + args[2:]
+            result, attempt = transcribe_with_retries(args, seconds, None, pool, threads, cancel=cancel)
+        return result[1], result[2], attempt
+
+    def finish(chunk_number, text, success, segment_map, attempt):
+        done_queue.put((chunk_number, text, success))
+
+    parent = tracing.current_span()
+    # Niente coda limitata: fermare la decodifica farebbe perdere segmenti della diretta
+    runner = ChunkRunner(work, finish, max_workers, split_tail=False, speculate=True)
+
+    def produce():
+        try:
+            with tracing.span("decode", parent, in_memory=True, follow=True):
+                # Letture da mezzo secondo: con blocchi grandi la finestra aspetterebbe audio già arrivato
+                chunks = extract_audio_chunks(
+                    source, window_seconds / 60, vad, in_memory=True, block_size=PCM_BYTES_PER_SECOND // 2
+                )
+                for chunk, chunk_number, segment_map in chunks:
+                    now = time.time()
+                    span = segment_map[-1][1] + segment_map[-1][2] - segment_map[0][1]
+                    windows[chunk_number] = (segment_map, max(now - span, start_time))
+                    produced.append(chunk_number)
+                    runner.add(chunk_number, chunk, sum(length for _, _, length in segment_map), segment_map)
+        finally:
+            runner.close()
+            done_queue.put(None)
+
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+
+    texts = []
+    chunks = []
+    lags = []
+    heard = 0.0
+    failed = 0
+    catch_up = 0
+    pending = {}
+    producing = True
+    warned = False
+
+    # Il reporter viene chiamato solo da questo thread (la UI Streamlit lo richiede)
+    try:
+        with open(output_path, "w", encoding="utf-8") as out:
+            while producing or len(texts) < len(produced):
+                try:
+                    item = done_queue.get(timeout=FOLLOW_POLL_SECONDS * 2)
+                except queue.Empty:
+                    item = ()
+                except KeyboardInterrupt:
+                    reporter.info("⏹️ Interrotto: trascrivo l'audio già ricevuto...")
+                    source.stop()
+                    continue
+                if item is None:
+                    producing = False
+                elif item:
+                    pending[item[0]] = item
+
+                while len(texts) in pending:
+                    chunk_number, text, success = pending.pop(len(texts))
+                    out.write(("\n\n" if texts else "") + text)
+                    out.flush()
+                    texts.append(text)
+                    segment_map = windows[chunk_number][0]
+                    chunks.append({"text": text, "segment_map": segment_map})
+                    heard = segment_map[-1][1] + segment_map[-1][2]
+                    lags.append(time.time() - windows[chunk_number][1])
+                    failed += not success
+                    catch_up += models.get(chunk_number) != model
+                    if not success:
+                        reporter.warning(f"⚠️ Problema con la finestra {chunk_number}")
+
+                # Ritardo attuale: la finestra più vecchia non ancora nel file
+                oldest = windows.get(len(texts))
+                lag = time.time() - oldest[1] if oldest else (lags[-1] if lags else 0.0)
+                if catch_up_model and catch_up_model != model:
+                    if lag > max_lag and state["model"] == model:
+                        state["model"] = catch_up_model
+                        reporter.warning(f"🐇 Ritardo {lag:.0f}s oltre {max_lag:.0f}s: finestre con {catch_up_model} finché non rientra")
+                    elif lag < max_lag / 2 and state["model"] != model:
+                        state["model"] = model
+                        reporter.info(f"✅ Ritardo rientrato ({lag:.0f}s): di nuovo {model}")
+                elif lag > max_lag and not warned:
+                    warned = True
+                    reporter.warning(f"🐢 Ritardo {lag:.0f}s oltre {max_lag:.0f}s: servono più worker o un modello più veloce")
+
+                waiting = len(produced) - len(texts)
+                reporter.progress(
+                    len(texts) / max(len(produced), 1),
+                    f"🔴 {int(heard // 60):02d}:{int(heard % 60):02d} trascritti • ritardo {lag:.0f}s • "
+                    f"{waiting} finestre in attesa"
+                )
+    finally:
+        # Anche se il ciclo si interrompe (eccezione, UI fermata): niente letture né whisper orfani
+        source.stop()
+        runner.cancel()
+
+    producer.join()
+    reporter.progress_done()
+    if source.error:
+        reporter.error(f"❌ Sorgente interrotta: {source.error}")
+
+    text = "\n\n".join(texts) if len(texts) > failed else None
+    detected_language = pin.language if pin is not None and pin.language else language
+    if text is None:
+        os.remove(output_path)
+    else:
+        save_transcript_sidecar(output_path, chunks, model, detected_language, heard)
+    lag_text = f", ritardo medio {sum(lags)/len(lags):.0f}s (max {max(lags):.0f}s)" if lags else ""
+    reporter.info(f"🔴 {len(texts)} finestre trascritte, {failed} con errori{lag_text}")
+    if catch_up:
+        reporter.info(f"🐇 {catch_up} finestre trascritte con {catch_up_model} per recuperare il ritardo")
+
+    return {
+        "text": text,
+        "path": output_path if text is not None else None,
+        "num_chunks": len(texts),
+        "failed": failed,
+        "duration": heard,
+        "elapsed": time.time() - start_time,
+        "cached": False,
+        # Le finestre restano in memoria fino a whisper
+        "bytes_written": 0,
+        "cascade": None,
+        "chunks": chunks,
+        "model": model,
+        "language": detected_language,
+        "lag_max": max(lags) if lags else None,
+        "lag_mean": sum(lags) / len(lags) if lags else None,
+        "catch_up": catch_up
+    }
@@ -0,0 +1,348 @@
+"""Coda di job in background: la UI invia e interroga, i worker trascrivono"""
+
+import os
+import time
+import heapq
+import uuid
+import queue
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+
+from . import tracing
+from .cache import file_digest
+from .download import StreamSource, UploadSource, download_video, open_audio_stream
+from .follow import open_follow_source, transcribe_follow
+from .jobs import remove_job
+from .pipeline import save_transcript, transcribe_file, transcript_path
+from .reporting import Reporter
+from .scheduler import CpuScheduler
+
+WORK_DIR = "work"
+# Job in esecuzione insieme: il CpuScheduler li tiene dentro il budget di core e RAM
+JOB_CONCURRENCY = int(os.environ.get("WHISPER_ULTRA_JOBS", "3"))
+# I job finiti restano consultabili per un'ora
+JOB_RETENTION_SECONDS = 3600
+# Opzioni dei job che valgono anche per la trascrizione al seguito
+FOLLOW_OPTIONS = (
+    "model", "language", "max_workers", "threads", "vad", "pool", "window_seconds", "max_lag", "catch_up_model"
+)
+
+logger = logging.getLogger("whisper_ultra")
+
+class BackgroundJob:
+    """Stato di un job in coda: scritto dal worker, letto dalla UI"""
+
+    def __init__(self, job_id, work_dir, video_name, options):
+        self.job_id = job_id
+        self.work_dir = work_dir
+        self.video_name = video_name
+        self.options = options
+        self.video_path = None
+        self.url = None
+        self.upload = None
+        self.follow = False
+        self.source = None
+        self.status = "new"
+        self.messages = []
+        self.progress = 0.0
+        self.progress_text = ""
+        self.result = None
+        self.transcript_path = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.trace_id = None
+
+    @property
+    def active(self):
+        return self.status in ("queued", "running")
+
+class JobReporter(Reporter):
+    """Reporter che registra messaggi e avanzamento nel job invece di disegnarli"""
+
+    def __init__(self, job):
+        self.job = job
+
+    def _add(self, level, message):
+        self.job.messages.append((level, message))
+
+    def info(self, message):
+        super().info(message)
+        self._add("info", message)
+
+    def success(self, message):
+        super().success(message)
+        self._add("success", message)
+
+    def warning(self, message):
+        super().warning(message)
+        self._add("warning", message)
+
+    def error(self, message):
+        super().error(message)
+        self._add("error", message)
+
+    def progress(self, fraction, text=""):
+        self.job.progress = min(fraction, 1.0)
+        self.job.progress_text = text
+
+class JobQueue:
+    """Job di trascrizione eseguiti da thread in background, ognuno nella sua cartella di lavoro
+
+    Nessun percorso è condiviso tra job: upload, download e chunk stanno in
+    work/<job_id>/, che viene sempre rimossa a fine job (la ripresa usa il
+    manifest, non i chunk). Pool whisper e cache arrivano con le opzioni di ogni job; i
+    chunk di tutti i job si dividono gli slot dello stesso CpuScheduler. Con
+    index (SearchIndex) le trascrizioni salvate entrano subito nell'indice di ricerca.
+    """
+
+    def __init__(self, work_root=WORK_DIR, concurrency=JOB_CONCURRENCY, scheduler=None, index=None):
+        self.work_root = work_root
+        self.concurrency = max(1, concurrency)
+        self.scheduler = scheduler or CpuScheduler()
+        self.index = index
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue()
+        self._key_locks = {}
+        self._threads = []
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"whisper-job-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def create(self, video_name="video", **options):
+        """Nuovo job con la sua cartella di lavoro, non ancora in coda"""
+        job_id = uuid.uuid4().hex[:12]
+        work_dir = os.path.join(self.work_root, job_id)
+        os.makedirs(work_dir, exist_ok=True)
+
+        job = BackgroundJob(job_id, work_dir, video_name, options)
+        with self._lock:
+            self._prune()
+            self._jobs[job_id] = job
+        return job
+
+    def submit(self, job, video_path=None, url=None, upload=None, follow=False):
+        """Mette in coda il job: da un file locale, da un URL o da un file caricato
+
+        upload è un oggetto file (es. l'UploadedFile di Streamlit): viene
+        decodificato dalla memoria e chiuso appena ffmpeg l'ha letto tutto.
+        Con follow=True video_path è un file ancora in registrazione o url una
+        diretta: la trascrizione cresce con loro finché non finiscono o stop().
+        """
+        job.video_path = video_path
+        job.url = url
+        job.upload = upload
+        job.follow = follow
+        job.status = "queued"
+        self._queue.put(job)
+        return job.job_id
+
+    def stop(self, job):
+        """Ferma un job al seguito: l'audio già ricevuto viene comunque trascritto"""
+        if job.source is not None:
+            job.source.stop()
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job):
+        """Posizione in coda (0 se già in esecuzione o finito)"""
+        if job.status != "queued":
+            return 0
+        with self._lock:
+            waiting = [j for j in self._jobs.values() if j.status == "queued"]
+        waiting.sort(key=lambda j: j.created_at)
+        return waiting.index(job) + 1 if job in waiting else 0
+
+    def estimated_start(self, job):
+        """Secondi stimati all'avvio di un job in coda (0 se già partito, None senza stime)
+
+        I job in esecuzione finiscono dopo il tempo trascorso riscalato sul loro
+        avanzamento; quelli in coda prima di job durano quanto la media dei job finiti.
+        """
+        if job.status != "queued":
+            return 0.0
+        now = time.time()
+        with self._lock:
+            jobs = list(self._jobs.values())
+        finished = [j.finished_at - j.started_at for j in jobs if j.finished_at and j.started_at]
+        average = sum(finished) / len(finished) if finished else None
+
+        free_at = []
+        for j in jobs:
+            if j.status != "running":
+                continue
+            if j.progress <= 0:
+                if average is None:
+                    return None
+                free_at.append(max(average - (now - j.started_at), 0.0))
+            else:
+                elapsed = now - j.started_at
+                free_at.append(elapsed * (1 - j.progress) / j.progress)
+        free_at += [0.0] * max(self.concurrency - len(free_at), 0)
+        heapq.heapify(free_at)
+
+        for ahead in sorted((j for j in jobs if j.status == "queued"), key=lambda j: j.created_at):
+            if ahead is job:
+                return heapq.heappop(free_at)
+            if average is None:
+                return None
+            heapq.heappush(free_at, heapq.heappop(free_at) + average)
+        return None
+
+    @contextmanager
+    def _key_lock(self, source_digest, options):
+        """Un lock per contenuto e parametri: due job identici girano uno dopo l'altro,
+        così il secondo trova la trascrizione in cache invece di rifarla
+
+        source_digest è l'hash del file (file_digest) o il digest della sorgente in
+        streaming: lo stesso contenuto caricato o salvato con nomi diversi prende
+        lo stesso lock. Il lock esce dal dizionario quando lo rilascia l'ultimo
+        job che lo usava.
+        """
+        key = (source_digest, options.get("model"), options.get("language"), options.get("vad"))
+        with self._lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._key_locks[key]
+
+    def _prune(self):
+        now = time.time()
+        for job_id, job in list(self._jobs.items()):
+            if job.finished_at and now - job.finished_at > JOB_RETENTION_SECONDS:
+                del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            span = tracing.span("job", job_id=job.job_id, queue_wait=round(time.time() - job.created_at, 6))
+            job.trace_id = span.trace_id
+            try:
+                with span:
+                    self._execute(job)
+                    tracing.annotate(result=job.status)
+            except Exception as e:
+                logger.exception("Job %s fallito", job.job_id)
+                job.error = str(e)
+                job.messages.append(("error", f"❌ Errore: {e}"))
+                job.status = "failed"
+            finally:
+                # Upload, download e chunk del job: la ripresa riparte dal manifest, non da qui
+                shutil.rmtree(job.work_dir, ignore_errors=True)
+                job.finished_at = time.time()
+                tracing.tracer.write_metrics()
+
+    def _execute(self, job):
+        job.status = "running"
+        job.started_at = time.time()
+        reporter = JobReporter(job)
+
+        result = self._follow(job, reporter) if job.follow else self._transcribe(job, reporter)
+        job.video_path = None
+        job.source = None
+        if result is None:
+            job.status = "failed"
+            return
+        result["elapsed"] = time.time() - job.started_at
+        job.result = result
+
+        if result["text"]:
+            if not job.follow:
+                job.transcript_path = save_transcript(
+                    result["text"], job.video_name, chunks=result["chunks"], model=result["model"],
+                    language=result["language"], duration=result["duration"]
+                )
+                if result["job_id"] and not result["failed"]:
+                    # Trascrizione salvata: il manifest non serve più per riprendere
+                    remove_job(result["job_id"])
+            if self.index is not None:
+                try:
+                    self.index.add(
+                        job.transcript_path, result["text"], result["chunks"], job.video_name,
+                        result["model"], result["language"], result["duration"]
+                    )
+                except Exception:
+                    # La trascrizione è salvata: l'indice si può sempre ricostruire dall'archivio
+                    logger.exception("Indicizzazione fallita: %s", job.transcript_path)
+            job.status = "done"
+        else:
+            job.transcript_path = None
+            job.status = "failed"
+
+    def _transcribe(self, job, reporter):
+        video_path = job.video_path
+        if job.upload is not None:
+            # Hash e durata dalla memoria: nessuna copia su disco dell'upload
+            upload, job.upload = job.upload, None
+            try:
+                video_path = UploadSource(upload, job.video_name)
+            except Exception:
+                upload.close()
+                raise
+        elif job.url:
+            # Solo audio, decodificato mentre scarica; altrimenti il video intero
+            video_path = open_audio_stream(job.url, reporter)
+            if video_path is not None:
+                job.video_name = video_path.title
+            else:
+                video_path = download_video(job.url, job.work_dir, reporter)
+                job.video_name = os.path.splitext(os.path.basename(video_path))[0]
+
+        if not video_path or (isinstance(video_path, str) and not os.path.exists(video_path)):
+            reporter.error("❌ Nessun file valido trovato")
+            return None
+
+        if isinstance(video_path, str):
+            with tracing.span("hash", source=video_path):
+                source_digest = file_digest(video_path)
+        else:
+            source_digest = video_path.digest
+        try:
+            with self._key_lock(source_digest, job.options):
+                return transcribe_file(
+                    video_path,
+                    video_name=job.video_name,
+                    chunks_dir=os.path.join(job.work_dir, "chunks"),
+                    reporter=reporter,
+                    scheduler=self.scheduler,
+                    owner=job.job_id,
+                    source_digest=source_digest,
+                    **job.options
+                )
+        finally:
+            if isinstance(video_path, StreamSource):
+                # Dalla cache, o fallito prima della decodifica, ffmpeg non ha letto nulla: rilascio qui
+                video_path.release()
+
+    def _follow(self, job, reporter):
+        source = open_follow_source(job.video_path or job.url, reporter)
+        if source is None:
+            reporter.error("❌ Né un file esistente né una diretta in corso")
+            return None
+        job.source = source
+        if job.url:
+            job.video_name = source.title
+        # Il percorso c'è da subito: la UI mostra il testo mentre cresce
+        job.transcript_path = transcript_path(job.video_name)
+        return transcribe_follow(
+            source,
+            video_name=job.video_name,
+            output_path=job.transcript_path,
+            reporter=reporter,
+            scheduler=self.scheduler,
+            owner=job.job_id,
+            **{key: value for key, value in job.options.items() if key in FOLLOW_OPTIONS}
+        )
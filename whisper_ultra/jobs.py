@@ -0,0 +1,123 @@
+"""Manifest su disco dei job di trascrizione, per checkpoint e ripresa"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from .whisper import WHISPER_PARAMS
+
+JOBS_DIR = "jobs"
+MAX_CHUNK_ATTEMPTS = 3
+CHUNK_TIMEOUT_MIN = 120
+CHUNK_TIMEOUT_FACTOR = 1.0
+
+def chunk_timeout(seconds, attempt=1):
+    """Timeout whisper per un chunk: almeno il tempo reale dell'audio, scalato per tentativo"""
+    return max(CHUNK_TIMEOUT_MIN, seconds * CHUNK_TIMEOUT_FACTOR) * attempt
+
+def job_key(source_digest, model, language, vad):
+    """Identificativo stabile del job: rilanciare lo stesso file riprende dallo stesso manifest"""
+    key = f"{source_digest}|{model}|{language}|vad={vad}|{WHISPER_PARAMS}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+def remove_job(job_id):
+    """Cancella il manifest di un job concluso (la trascrizione è già salvata)"""
+    shutil.rmtree(os.path.join(JOBS_DIR, job_id), ignore_errors=True)
+
+def manifest_chunks(manifest_data):
+    """Chunk completati del manifest in ordine: [{"text", "segment_map"}]"""
+    chunks = manifest_data.get("chunks") or {}
+    return [
+        chunks[number]
+        for number in sorted(chunks, key=int)
+        if chunks[number].get("state") == "done"
+    ]
+
+class JobManifest:
+    """Stato su disco di un job: ogni chunk completato viene salvato subito"""
+    
+    def __init__(self, path, data):
+        self.path = path
+        self.data = data
+        self._lock = threading.Lock()
+    
+    @classmethod
+    def open(cls, job_id, **params):
+        """Riprende il manifest del job se è rimasto a metà (running o failed), altrimenti ne crea uno nuovo
+
+        Un job concluso non si riprende: rilanciarlo (ad esempio senza cache)
+        trascrive di nuovo.
+        """
+        path = os.path.join(JOBS_DIR, job_id, "manifest.json")
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            if data.get("status") in ("running", "failed"):
+                return cls(path, data)
+        except (OSError, ValueError):
+            pass
+        
+        data = dict(params)
+        data.update({
+            "job_id": job_id,
+            "status": "running",
+            "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "chunks": {}
+        })
+        manifest = cls(path, data)
+        manifest.save()
+        return manifest
+    
+    def save(self):
+        directory = os.path.dirname(self.path)
+        os.makedirs(directory, exist_ok=True)
+        # Temporaneo unico: due processi sullo stesso job non si sovrascrivono il file a metà
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix="manifest.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.data, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    
+    def set(self, **values):
+        """Aggiorna e salva valori del job che valgono per tutti i chunk (es. la lingua rilevata)"""
+        with self._lock:
+            self.data.update(values)
+            self.save()
+    
+    def done_chunks(self):
+        return {
+            int(number): chunk["text"]
+            for number, chunk in self.data["chunks"].items()
+            if chunk["state"] == "done"
+        }
+    
+    def record(self, chunk_number, text, success, attempts, segment_map=None):
+        with self._lock:
+            chunk = self.data["chunks"].setdefault(str(chunk_number), {"attempts": 0})
+            chunk.update({
+                "state": "done" if success else "failed",
+                "text": text,
+                "segment_map": segment_map or [],
+                "attempts": chunk["attempts"] + attempts,
+                "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")
+            })
+            self.save()
+    
+    def finish(self, num_chunks, failed):
+        with self._lock:
+            self.data["num_chunks"] = num_chunks
+            self.data["status"] = "failed" if failed or not num_chunks else "done"
+            self.save()
+
+    def remove(self):
+        remove_job(self.data["job_id"])
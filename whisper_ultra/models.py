@@ -0,0 +1,265 @@
+"""Download dei modelli ggml: byte range in parallelo, ripresa, verifica e rename atomico
+
+Il file cresce in ggml-<modello>.bin.part; accanto, ggml-<modello>.bin.part.json
+(il manifest) tiene URL, dimensione, ETag, hash atteso e i blocchi già scritti.
+Un download interrotto riparte dai blocchi mancanti, e il .bin compare solo
+quando dimensione e hash tornano: un file troncato non viene mai scambiato per
+un modello presente. Per tutto il download un flock esclusivo su
+ggml-<modello>.bin.part.lock tiene fuori gli altri processi (app, CLI, nodi).
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+import urllib.request
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: niente lock tra processi, resta quello dentro il processo
+    fcntl = None
+
+from . import tracing
+from .download import DOWNLOAD_CONNECTIONS, _fetch
+from .reporting import Reporter
+from .whisper import model_path
+
+MODEL_URL = "https://huggingface.co/ggerganov/whisper.cpp/resolve/main/ggml-{model}.bin"
+MODEL_BLOCK_BYTES = 8 * 1024 * 1024
+# SHA-1 pubblicati da whisper.cpp (models/README.md)
+MODEL_SHA1 = {
+    "tiny": "bd577a113a864445d4c299885e0cb97d4ba92b5f",
+    "base": "465707469ff3a37a2b9b8d8f89f2f99de7299dac",
+    "small": "55356645c2b361a969dfd0ef2c5a50d530afd8d5",
+}
+
+logger = logging.getLogger("whisper_ultra")
+
+def _head(url, timeout=30):
+    """Dimensione, ETag e supporto dei byte range dell'URL (dopo i redirect)"""
+    request = urllib.request.Request(url, method="HEAD")
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        headers = response.headers
+        return {
+            "size": int(headers.get("Content-Length") or 0),
+            "etag": headers.get("X-Linked-Etag") or headers.get("ETag") or "",
+            "ranges": "bytes" in (headers.get("Accept-Ranges") or "")
+        }
+
+def _save_manifest(path, manifest):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_path, path)
+
+def _load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+@contextmanager
+def _exclusive(lock_path):
+    """Lock esclusivo tra processi sul file lock_path, rilasciato all'uscita (anche se il processo muore)"""
+    with open(lock_path, "a") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+def _file_sha1(path, block_size=1024 * 1024):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+def download_model(model, path=None, url=None, sha1=None, connections=DOWNLOAD_CONNECTIONS,
+                   block_bytes=MODEL_BLOCK_BYTES, progress=None):
+    """Scarica il modello in path e restituisce il percorso; solleva OSError/ValueError se fallisce
+
+    progress(scaricati, totale) viene chiamato dopo ogni blocco. Se un altro
+    processo sta scaricando lo stesso modello si aspetta che finisca; se nel
+    frattempo il modello è comparso, non lo si scarica di nuovo.
+    """
+    path = path or model_path(model)
+    url = url or MODEL_URL.format(model=model)
+    if sha1 is None:
+        sha1 = MODEL_SHA1.get(model)
+    part_path = f"{path}.part"
+    manifest_path = f"{part_path}.json"
+    progress = progress or (lambda done, total: None)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    existed = os.path.exists(path)
+
+    with tracing.span("model_download", model=model, source=url), _exclusive(f"{part_path}.lock"):
+        if not existed and os.path.exists(path):
+            # Scaricato da un altro processo mentre si aspettava il lock
+            tracing.annotate(bytes=0, waited_for_other=True)
+            return path
+        remote = _head(url)
+        size = remote["size"]
+
+        # Si riprende solo lo stesso file: URL, dimensione ed ETag devono coincidere
+        manifest = _load_manifest(manifest_path)
+        if (manifest is None or not os.path.exists(part_path)
+                or (manifest["url"], manifest["size"], manifest["etag"]) != (url, size, remote["etag"])
+                or manifest["block_bytes"] != block_bytes):
+            manifest = {
+                "url": url, "size": size, "etag": remote["etag"], "sha1": sha1,
+                "block_bytes": block_bytes, "done": []
+            }
+            with open(part_path, "wb") as f:
+                f.truncate(size)
+            _save_manifest(manifest_path, manifest)
+
+        if size and remote["ranges"]:
+            num_blocks = (size + block_bytes - 1) // block_bytes
+            done = set(manifest["done"])
+            missing = [i for i in range(num_blocks) if i not in done]
+            resumed = sum(min(block_bytes, size - i * block_bytes) for i in done)
+            tracing.annotate(bytes=size, resumed_bytes=resumed, connections=connections)
+            progress(resumed, size)
+
+            write_lock = threading.Lock()
+            with open(part_path, "r+b") as f, ThreadPoolExecutor(max_workers=connections) as executor:
+                futures = {}
+                for i in missing:
+                    start = i * block_bytes
+                    end = min(start + block_bytes, size) - 1
+                    futures[executor.submit(_fetch, url, {}, start, end)] = (i, start, end)
+                try:
+                    for future in as_completed(futures):
+                        i, start, end = futures[future]
+                        data = future.result()
+                        if len(data) != end - start + 1:
+                            raise OSError(f"Blocco {i}: {len(data)} byte invece di {end - start + 1}")
+                        with write_lock:
+                            f.seek(start)
+                            f.write(data)
+                            f.flush()
+                            # Il blocco entra nel manifest solo dopo essere stato scritto
+                            manifest["done"].append(i)
+                            _save_manifest(manifest_path, manifest)
+                        resumed += len(data)
+                        progress(resumed, size)
+                finally:
+                    for future in futures:
+                        future.cancel()
+                f.flush()
+                os.fsync(f.fileno())
+        else:
+            # Server senza byte range: un solo stream, senza ripresa
+            tracing.annotate(bytes=size, resumed_bytes=0, connections=1)
+            written = 0
+            with urllib.request.urlopen(url, timeout=60) as response, open(part_path, "wb") as f:
+                for data in iter(lambda: response.read(1024 * 1024), b""):
+                    f.write(data)
+                    written += len(data)
+                    progress(written, size)
+                f.flush()
+                os.fsync(f.fileno())
+
+        actual_size = os.path.getsize(part_path)
+        if size and actual_size != size:
+            raise OSError(f"Dimensione errata per {model}: {actual_size} byte invece di {size}")
+        if sha1 and _file_sha1(part_path) != sha1:
+            # Contenuto corrotto: si ricomincia da zero al prossimo tentativo
+            os.remove(part_path)
+            os.remove(manifest_path)
+            raise ValueError(f"Checksum SHA-1 errato per il modello {model}")
+
+        os.replace(part_path, path)
+        os.remove(manifest_path)
+    return path
+
+class ModelDownload:
+    """Download di un modello in corso in un thread, condiviso da chi lo chiede"""
+
+    def __init__(self, model, path):
+        self.model = model
+        self.path = path
+        self.downloaded = 0
+        self.total = 0
+        self.error = None
+        self.started_at = time.time()
+        self.finished = threading.Event()
+
+    @property
+    def fraction(self):
+        return self.downloaded / self.total if self.total else 0.0
+
+    def _progress(self, downloaded, total):
+        self.downloaded = downloaded
+        self.total = total
+
+class ModelDownloader:
+    """Un solo download per modello nel processo: le sessioni che lo chiedono insieme lo condividono"""
+
+    def __init__(self, connections=DOWNLOAD_CONNECTIONS, url_template=MODEL_URL, checksums=MODEL_SHA1):
+        self.connections = connections
+        self.url_template = url_template
+        self.checksums = checksums
+        self._lock = threading.Lock()
+        self._downloads = {}
+
+    def start(self, model):
+        """Avvia il download, o restituisce quello già in corso per lo stesso modello"""
+        with self._lock:
+            download = self._downloads.get(model)
+            if download is not None and not download.finished.is_set():
+                return download
+            download = ModelDownload(model, model_path(model))
+            self._downloads[model] = download
+
+        thread = threading.Thread(
+            target=self._run, args=(download,), name=f"model-download-{model}", daemon=True
+        )
+        thread.start()
+        return download
+
+    def _run(self, download):
+        try:
+            download_model(
+                download.model, download.path,
+                url=self.url_template.format(model=download.model),
+                sha1=self.checksums.get(download.model),
+                connections=self.connections,
+                progress=download._progress
+            )
+        except Exception as e:
+            logger.exception("Download del modello %s fallito", download.model)
+            download.error = e
+        finally:
+            download.finished.set()
+
+    def ensure(self, model, reporter=None, poll=0.5):
+        """Scarica il modello se manca e aspetta la fine; True se il modello è pronto"""
+        reporter = reporter or Reporter()
+        if os.path.exists(model_path(model)):
+            return True
+
+        download = self.start(model)
+        reporter.info(f"📥 Download modello {model}...")
+        while not download.finished.wait(poll):
+            reporter.progress(
+                download.fraction,
+                f"Scaricamento: {download.fraction*100:.0f}% "
+                f"({download.downloaded/(1024*1024):.1f} MB / {download.total/(1024*1024):.1f} MB)"
+            )
+        reporter.progress_done()
+
+        if download.error is not None:
+            reporter.error(f"❌ Errore download: {download.error}")
+            return False
+        reporter.success(f"✅ Modello {model} scaricato!")
+        return True
@@ -0,0 +1,542 @@
+"""Pipeline di trascrizione: chunk in parallelo, cache, manifest e salvataggio"""
+
+import os
+import json
+import math
+import time
+import queue
+import shutil
+import hashlib
+import threading
+from contextlib import nullcontext
+
+from .audio import (
+    CHUNKS_DIR, WAV_HEADER_BYTES, chunk_seconds, read_wav_info, get_audio_duration, extract_audio_chunks
+)
+from .autotune import load_tuning_profile, profile_chunk_minutes, recommended_chunk_minutes, tune_for_file
+from .cache import file_digest
+from .cascade import CASCADE_THRESHOLD, Cascade
+from .jobs import MAX_CHUNK_ATTEMPTS, JobManifest, chunk_timeout, job_key, manifest_chunks
+from . import tracing
+from .reporting import Reporter
+from .straggler import ChunkRunner
+from .whisper import WHISPER_PARAMS, detect_language, transcribe_chunk
+
+TRANSCRIPTS_DIR = "trascrizioni"
+
+class LanguagePin:
+    """Lingua di un file con language="auto": rilevata una volta, poi fissata per ogni chunk
+
+    Il primo chunk che arriva a whisper fa da campione; gli altri aspettano il
+    risultato invece di rifare ciascuno il riconoscimento, e la lingua resta la
+    stessa per tutta la registrazione. Col manifest, un job ripreso riusa la
+    lingua già rilevata. Se il riconoscimento fallisce resta "auto".
+    """
+    
+    def __init__(self, model, pool=None, threads=2, manifest=None):
+        self.model = model
+        self.pool = pool
+        self.threads = threads
+        self.manifest = manifest
+        self.language = manifest.data.get("detected_language") if manifest is not None else None
+        self._lock = threading.Lock()
+    
+    def resolve(self, chunk):
+        if self.language is not None:
+            return self.language
+        with self._lock:
+            if self.language is None:
+                with tracing.span("language_detect", model=self.model):
+                    try:
+                        language = detect_language(chunk, self.model, self.pool, self.threads)
+                    except Exception:
+                        language = None
+                    tracing.annotate(language=language)
+                if language and self.manifest is not None:
+                    self.manifest.set(detected_language=language)
+                self.language = language or "auto"
+        return self.language
+
+def transcribe_chunk_cached(args, cache=None, pool=None, threads=2, timeout=600, cascade=None, cancel=None):
+    """Come transcribe_chunk, ma salta whisper per i chunk con PCM già trascritto
+
+    Con una Cascade il modello degli args fa il passaggio veloce e quello della
+    cascata ridecodifica i segmenti incerti. cancel (CancelToken) ferma whisper
+    se un'altra copia del chunk finisce prima; la cascata lo ignora.
+    """
+    if cascade is not None:
+        transcribe = cascade.transcribe
+    else:
+        def transcribe(args, pool, threads, timeout):
+            return transcribe_chunk(args, pool, threads, timeout, cancel)
+    if cache is None:
+        return transcribe(args, pool, threads, timeout)
+    
+    chunk_path, language, model, chunk_number, total_chunks = args
+    if cascade is not None:
+        model = cascade.label(model)
+    if isinstance(chunk_path, str):
+        info = read_wav_info(chunk_path)
+        pcm_digest = file_digest(chunk_path, info["data_offset"] if info else 0)
+    else:
+        # Chunk in memoria: stesso digest del file, header WAV escluso
+        pcm_digest = hashlib.sha256(memoryview(chunk_path)[WAV_HEADER_BYTES:]).hexdigest()
+    key = cache.key(pcm_digest, model, language)
+    
+    text = cache.get(key)
+    tracing.annotate(cache="hit" if text is not None else "miss")
+    if text is not None:
+        return (chunk_number, text, True)
+    
+    result = transcribe(args, pool, threads, timeout)
+    if result[2]:
+        cache.put(key, result[1])
+    return result
+
+def transcribe_with_retries(args, seconds, cache=None, pool=None, threads=2, cascade=None, cancel=None):
+    """Trascrive un chunk con più tentativi; restituisce (risultato, tentativi fatti)
+
+    Con cancel annullato non parte nessun altro tentativo.
+    """
+    # Timeout proporzionale alla durata del chunk, più largo a ogni tentativo
+    for attempt in range(1, MAX_CHUNK_ATTEMPTS + 1):
+        timeout = chunk_timeout(seconds, attempt)
+        with tracing.span("whisper", chunk=args[3], attempt=attempt, timeout=timeout, audio_seconds=seconds):
+            result = transcribe_chunk_cached(args, cache, pool, threads, timeout, cascade, cancel)
+            tracing.annotate(success=result[2])
+        if result[2] or (cancel is not None and cancel.is_set()):
+            break
+    return result, attempt
+
+def transcribe_parallel(chunks, language, model, max_workers=4, pool=None, threads=2, cache=None,
+                        reporter=None, cascade=None, tail=True, manifest=None):
+    """Trascrizione parallela con progress bar dei chunk di split_audio_chunks
+
+    Con tail=True la coda finale viene divisa tra i worker liberi e i chunk molto
+    più lenti degli altri vengono duplicati (vedi ChunkRunner). Ogni chunk ha fino
+    a MAX_CHUNK_ATTEMPTS tentativi (transcribe_with_retries); con manifest ogni
+    chunk finito viene registrato con la sua segment_map e i tentativi fatti, come
+    in transcribe_pipelined.
+    """
+    reporter = reporter or Reporter()
+    
+    if len(chunks) == 1:
+        reporter.info("🎙️ Trascrizione in corso...")
+    else:
+        reporter.info(f"🚀 Trascrizione parallela con {max_workers} worker...")
+    
+    done_queue = queue.Queue()
+    
+    def work(chunk, chunk_number, seconds, started, cancel):
+        # Sottochunk e copie sono in memoria: vanno al server via HTTP o a whisper-cli da stdin
+        started()
+        result, attempts = transcribe_with_retries(
+            (chunk, language, model, chunk_number, len(chunks)), seconds, cache, pool, threads, cascade, cancel
+        )
+        return result[1], result[2], attempts
+    
+    def finish(chunk_number, text, success, segment_map, attempts):
+        if manifest is not None:
+            manifest.record(chunk_number, text, success, attempts, segment_map)
+        done_queue.put((chunk_number, text, success))
+    
+    runner = ChunkRunner(work, finish, max_workers, split_tail=tail, speculate=tail)
+    for chunk, chunk_number, segment_map in chunks:
+        runner.add(chunk_number, chunk, chunk_seconds(chunk), segment_map)
+    runner.close()
+    
+    results = {}
+    successes = 0
+    
+    for completed in range(1, len(chunks) + 1):
+        chunk_number, text, success = done_queue.get()
+        results[chunk_number] = text
+        successes += success
+        
+        progress = completed / len(chunks)
+        reporter.progress(progress, f"✅ Completati: {completed}/{len(chunks)} segmenti ({progress*100:.0f}%)")
+        
+        if not success:
+            reporter.warning(f"⚠️ Problema con segmento {chunk_number}")
+    
+    reporter.progress_done()
+    
+    if len(chunks) == 1:
+        return next(iter(results.values())) if successes else None
+    
+    sorted_results = [results[i] for i in sorted(results.keys())]
+    full_text = "\n\n".join(sorted_results)
+    
+    return full_text
+
+def transcribe_pipelined(video_path, language, model, chunk_duration_minutes=30,
+                         max_workers=4, expected_duration=0, vad=True, pool=None, threads=2,
+                         cache=None, pcm_hash=None, manifest=None, chunks_dir=CHUNKS_DIR,
+                         reporter=None, stream=False, io_stats=None, cascade=None, scheduler=None,
+                         owner=None, tail=True):
+    """Estrazione e trascrizione in pipeline: ogni chunk va a whisper appena è pronto
+
+    Con stream=True il PCM passa da ffmpeg a whisper senza WAV su disco: i chunk
+    restano in memoria e vanno ai whisper-server via HTTP o a whisper-cli da
+    stdin. In io_stats["bytes_written"] finiscono i byte dei chunk scritti su disco.
+
+    Con uno scheduler (CpuScheduler) ogni chunk aspetta i suoi slot CPU a nome di
+    owner prima di andare a whisper: max_workers resta il massimo per questo job.
+
+    Con tail=True, finita la decodifica, gli ultimi chunk vengono divisi tra i
+    worker rimasti senza lavoro e quelli molto più lenti degli altri duplicati
+    (vedi ChunkRunner).
+    """
+    reporter = reporter or Reporter()
+    reporter.info(f"🚀 Estrazione e trascrizione in pipeline con {max_workers} worker...")
+    
+    chunk_duration_sec = chunk_duration_minutes * 60
+    expected_chunks = max(1, math.ceil(expected_duration / chunk_duration_sec))
+    
+    done_queue = queue.Queue()
+    produced = []
+    speech_seconds = []
+    written = []
+    
+    done = manifest.done_chunks() if manifest is not None else {}
+    pin = LanguagePin(model, pool, threads, manifest) if language == "auto" else None
+    
+    def work(chunk_path, chunk_number, seconds, started, cancel):
+        args = (chunk_path, language, model, chunk_number, expected_chunks)
+        slot = nullcontext()
+        if scheduler is not None:
+            slot = scheduler.slot(owner, threads, (model, cascade.model if cascade is not None else None),
+                                  (pool, cascade.pool if cascade is not None else None))
+        with slot:
+            if scheduler is not None:
+                tracing.annotate(cpu_wait=round(slot.waited, 6))
+            if cancel.is_set():
+                # Un'altra copia ha già finito mentre questa aspettava lo slot
+                return "", False, 0
+            started()
+            if pin is not None:
+                args = (args[0], pin.resolve(args[0])) + args[2:]
+            result, attempt = transcribe_with_retries(args, seconds, cache, pool, threads, cascade, cancel)
+        tracing.annotate(attempts=attempt)
+        return result[1], result[2], attempt
+    
+    def finish(chunk_number, text, success, segment_map, attempt):
+        if manifest is not None:
+            manifest.record(chunk_number, text, success, attempt, segment_map)
+        done_queue.put((chunk_number, text, success))
+    
+    def release(chunk_path):
+        if isinstance(chunk_path, str):
+            try:
+                os.remove(chunk_path)
+            except OSError:
+                pass
+    
+    # Gli span dei thread di decodifica e dei worker sono figli di quello del chiamante
+    parent = tracing.current_span()
+    # Coda limitata: al massimo max_workers chunk in attesa, su disco o in memoria
+    runner = ChunkRunner(work, finish, max_workers, split_tail=tail, speculate=tail, release=release,
+                         maxsize=max_workers)
+    
+    def produce():
+        try:
+            with tracing.span("decode", parent, in_memory=stream):
+                chunks = extract_audio_chunks(
+                    video_path, chunk_duration_minutes, vad, pcm_hash, done, chunks_dir,
+                    in_memory=stream
+                )
+                for chunk_path, chunk_number, segment_map in chunks:
+                    seconds = sum(length for _, _, length in segment_map)
+                    speech_seconds.append(seconds)
+                    produced.append(chunk_number)
+                    if chunk_number in done:
+                        # Ripresa: il chunk è già nel manifest
+                        done_queue.put((chunk_number, done[chunk_number], True))
+                    else:
+                        if isinstance(chunk_path, str):
+                            written.append(os.path.getsize(chunk_path))
+                        runner.add(chunk_number, chunk_path, seconds, segment_map,
+                                   last=chunk_number >= expected_chunks - 1)
+        finally:
+            runner.close()
+            done_queue.put(None)
+    
+    results = {}
+    successes = 0
+    producing = True
+    
+    producer = threading.Thread(target=produce, daemon=True)
+    producer.start()
+    
+    # Il reporter viene chiamato solo da questo thread (la UI Streamlit lo richiede)
+    while producing or len(results) < len(produced):
+        item = done_queue.get()
+        if item is None:
+            producing = False
+        else:
+            chunk_number, text, success = item
+            results[chunk_number] = text
+            successes += success
+            
+            if not success:
+                reporter.warning(f"⚠️ Problema con segmento {chunk_number}")
+        
+        total = max(len(produced), expected_chunks) if producing else max(len(produced), 1)
+        progress = min(len(results) / total, 1.0)
+        reporter.progress(progress, f"✅ Completati: {len(results)}/{total} segmenti ({progress*100:.0f}%)")
+    
+    producer.join()
+    reporter.progress_done()
+    stats = runner.stats()
+    if stats["splits"] or stats["speculated"]:
+        reporter.info(
+            f"✂️ Coda finale: {stats['splits']} segmenti divisi tra i worker liberi, "
+            f"{stats['speculated']} copie di segmenti lenti ({stats['speculation_wins']} arrivate prima)"
+        )
+    if pin is not None and pin.language not in (None, "auto"):
+        reporter.info(f"🌐 Lingua: {pin.language} (rilevata una volta, fissata per tutti i segmenti)")
+    if io_stats is not None:
+        io_stats["bytes_written"] = io_stats.get("bytes_written", 0) + sum(written)
+    
+    if vad and expected_duration > 0:
+        skipped = max(expected_duration - sum(speech_seconds), 0)
+        reporter.info(f"🔇 Silenzio saltato: {skipped/60:.1f} minuti su {expected_duration/60:.1f}")
+    
+    failed = len(produced) - successes
+    if not successes:
+        return None, len(produced), failed
+    
+    sorted_results = [results[i] for i in sorted(results.keys())]
+    return "\n\n".join(sorted_results), len(produced), failed
+
+def cleanup_chunks(chunks_dir=CHUNKS_DIR):
+    """Pulisci directory chunks"""
+    try:
+        if os.path.exists(chunks_dir):
+            for file in os.listdir(chunks_dir):
+                try:
+                    os.remove(os.path.join(chunks_dir, file))
+                except:
+                    pass
+            shutil.rmtree(chunks_dir)
+    except:
+        pass
+
+def transcript_path(video_name, output_dir=TRANSCRIPTS_DIR):
+    """Percorso {video_name}_{timestamp}.txt di una nuova trascrizione
+
+    Il file viene creato vuoto per riservare il nome: due trascrizioni dello
+    stesso video nello stesso secondo diventano {video_name}_{timestamp}_2.txt, ...
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    suffix = ""
+    counter = 1
+    while True:
+        path = os.path.join(output_dir, f"{video_name}_{timestamp}{suffix}.txt")
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            counter += 1
+            suffix = f"_{counter}"
+
+def transcript_sidecar(path):
+    """Percorso del .json con chunk e metadati accanto alla trascrizione path"""
+    return os.path.splitext(path)[0] + ".json"
+
+def save_transcript_sidecar(path, chunks=None, model=None, language=None, duration=None):
+    """Salva accanto alla trascrizione i suoi chunk (testo e mappa del parlato) e i metadati
+
+    Il manifest del job viene rimosso dopo il salvataggio: è da qui che
+    l'indice di ricerca ricostruisce i tempi delle righe reindicizzando l'archivio.
+    """
+    data = {
+        "model": model,
+        "language": language,
+        "duration": duration,
+        "chunks": [{"text": chunk["text"], "segment_map": chunk.get("segment_map") or []} for chunk in chunks or []]
+    }
+    with open(transcript_sidecar(path), "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+def save_transcript(text, video_name, output_dir=TRANSCRIPTS_DIR, chunks=None, model=None, language=None,
+                    duration=None):
+    """Salva la trascrizione come {video_name}_{timestamp}.txt e restituisce il percorso
+
+    Accanto scrive {video_name}_{timestamp}.json (save_transcript_sidecar) con
+    chunks (manifest_chunks), model, language e duration.
+    """
+    final_path = transcript_path(video_name, output_dir)
+    
+    with open(final_path, "w") as f:
+        f.write(text)
+    save_transcript_sidecar(final_path, chunks, model, language, duration)
+    
+    return final_path
+
+def transcribe_file(video_path, model="base", language="auto", chunk_duration_minutes=30,
+                    max_workers=4, threads=2, vad=True, auto_tune=False, pool=None, cache=None,
+                    video_name=None, chunks_dir=CHUNKS_DIR, reporter=None, stream=False,
+                    cascade_model=None, cascade_threshold=CASCADE_THRESHOLD, cascade_pool=None,
+                    scheduler=None, owner=None, tail=True, source_digest=None):
+    """Trascrive un file: cache, ripresa dal manifest del job e pipeline estrazione/whisper
+
+    video_path può essere un AudioStream (download solo audio in streaming): durata
+    e identità della sorgente vengono dai metadati, niente autotuning sul file.
+
+    Con cascade_model il modello fa un passaggio veloce e cascade_model ridecodifica
+    i segmenti con confidenza sotto cascade_threshold; cascade_pool è il pool di
+    whisper-server del modello grande (se manca e c'è pool, ne viene creato uno
+    per questo file). pool può essere anche un RemoteWorkerPool: i chunk vanno ai
+    nodi remoti e worker e chunk si dimensionano sui loro slot.
+
+    Con scheduler (CpuScheduler condiviso) i chunk locali rispettano il budget di
+    CPU e memoria del processo, a nome di owner (di default il job del manifest).
+    tail=False disattiva divisione della coda finale e copie dei chunk lenti.
+    source_digest è file_digest(video_path) se chi chiama l'ha già calcolato.
+    
+    Restituisce un dict con text (None se nessun segmento è riuscito), num_chunks
+    (0 se l'estrazione audio è fallita), failed, duration, elapsed, cached,
+    bytes_written (byte dei chunk scritti su disco), cascade (statistiche della
+    cascata o None), chunks (chunk del manifest con testo e mappa del parlato, per
+    l'indice di ricerca; None se dalla cache), model, language (quella rilevata
+    se era auto) e job_id (None se dalla cache): salvata la trascrizione, un job
+    senza errori si chiude con remove_job(job_id).
+    """
+    reporter = reporter or Reporter()
+    start_time = time.time()
+    streaming = not isinstance(video_path, str)
+    source_name = video_path if not streaming else video_path.source_id
+    
+    with tracing.span("transcribe_file", source=source_name, model=model, language=language, vad=vad,
+                      stream=stream):
+        if streaming:
+            video_name = video_name or video_path.title
+            duration = video_path.duration
+            source_digest = video_path.digest
+        else:
+            video_name = video_name or os.path.splitext(os.path.basename(video_path))[0]
+            duration = get_audio_duration(video_path)
+        if duration > 0:
+            reporter.info(f"⏱️ Durata audio: {duration/60:.1f} minuti")
+        
+        if pool is not None and pool.remote:
+            # I nodi remoti hanno la loro CPU: il budget locale non li riguarda
+            scheduler = None
+            if auto_tune:
+                # La capacità la decidono gli slot dei nodi remoti: niente calibrazione locale
+                max_workers = pool.size
+                chunk_duration_minutes = recommended_chunk_minutes(duration, max_workers)
+        elif auto_tune and streaming:
+            profile = load_tuning_profile(model)
+            if profile:
+                max_workers, threads = profile["workers"], profile["threads"]
+                chunk_duration_minutes = profile_chunk_minutes(duration, profile)
+        elif auto_tune:
+            with tracing.span("autotune"):
+                tuning = tune_for_file(
+                    video_path, model, language, duration, pool, chunks_dir, reporter, scheduler, owner
+                )
+            if tuning:
+                max_workers, threads, chunk_duration_minutes = tuning
+        
+        # Il pool può essere condiviso tra job: lo dimensiona chi lo crea, qui si passano solo i thread
+        cascade = None
+        own_cascade_pool = None
+        if cascade_model and cascade_model != model:
+            if pool is not None and cascade_pool is None:
+                cascade_pool = pool.companion(threads)
+                if cascade_pool is not pool:
+                    own_cascade_pool = cascade_pool
+                    own_cascade_pool.resize(max_workers, threads)
+            cascade = Cascade(cascade_model, cascade_threshold, cascade_pool)
+        # Cache e manifest distinguono la cascata dal modello veloce da solo
+        model_key = cascade.label(model) if cascade is not None else model
+        
+        text = None
+        chunks = None
+        detected_language = None
+        job_id = None
+        failed = 0
+        num_chunks = 0
+        io_stats = {"bytes_written": 0}
+        file_params = f"{WHISPER_PARAMS};vad={vad}"
+        if not source_digest:
+            with tracing.span("hash"):
+                source_digest = file_digest(video_path)
+        
+        if cache is not None:
+            with tracing.span("cache_lookup"):
+                pcm_digest = cache.pcm_digest_for(source_digest)
+                if pcm_digest:
+                    text = cache.get(cache.key(pcm_digest, model_key, language, file_params))
+        
+        cached = text is not None
+        if cached:
+            reporter.success("♻️ Trascrizione trovata in cache")
+            num_chunks = 1
+        else:
+            manifest = JobManifest.open(
+                job_key(source_digest, model_key, language, vad),
+                source=source_name,
+                video_name=video_name,
+                model=model_key,
+                language=language,
+                vad=vad,
+                chunk_minutes=chunk_duration_minutes
+            )
+            
+            # Ripresa: stessa suddivisione in chunk del primo avvio
+            job_id = manifest.data["job_id"]
+            chunk_duration_minutes = manifest.data["chunk_minutes"]
+            already_done = len(manifest.done_chunks())
+            if already_done:
+                reporter.info(f"♻️ Ripresa job {manifest.data['job_id']}: {already_done} segmenti già trascritti")
+            
+            pcm_hash = hashlib.sha256()
+            try:
+                text, num_chunks, failed = transcribe_pipelined(
+                    video_path, language, model, chunk_duration_minutes, max_workers, duration,
+                    vad, pool, threads, cache, pcm_hash, manifest, chunks_dir, reporter, stream, io_stats,
+                    cascade, scheduler, owner or manifest.data["job_id"], tail
+                )
+            finally:
+                if own_cascade_pool is not None:
+                    own_cascade_pool.shutdown()
+            if cascade is not None and cascade.segments:
+                stats = cascade.stats()
+                reporter.info(
+                    f"🪜 Cascata: {stats['weak_segments']}/{stats['segments']} segmenti incerti ridecodificati "
+                    f"con {cascade_model} ({stats['redecoded_seconds']/60:.1f} min su {stats['audio_seconds']/60:.1f})"
+                )
+            if streaming and video_path.error:
+                # Download interrotto: l'audio è incompleto, niente cache e job da riprendere
+                reporter.error(f"❌ Download interrotto: {video_path.error}")
+                failed += 1
+            manifest.finish(num_chunks, failed)
+            chunks = manifest_chunks(manifest.data)
+            detected_language = manifest.data.get("detected_language")
+            
+            if cache is not None and text and not failed:
+                pcm_digest = pcm_hash.hexdigest()
+                cache.add_alias(source_digest, pcm_digest)
+                cache.put(cache.key(pcm_digest, model_key, language, file_params), text)
+        
+        cleanup_chunks(chunks_dir)
+        tracing.annotate(audio_seconds=duration, num_chunks=num_chunks, failed=failed, cached=cached)
+    
+    return {
+        "text": text,
+        "num_chunks": num_chunks,
+        "failed": failed,
+        "duration": duration,
+        "elapsed": time.time() - start_time,
+        "cached": cached,
+        "bytes_written": io_stats["bytes_written"],
+        "cascade": cascade.stats() if cascade is not None else None,
+        "chunks": chunks,
+        "model": model_key,
+        "language": detected_language or language,
+        "job_id": job_id
+    }
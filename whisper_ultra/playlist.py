@@ -0,0 +1,224 @@
+"""Download di playlist, canali e liste di URL: più elementi insieme, saltando quelli già scaricati
+
+L'archivio (download_archive.txt nella cartella di destinazione) ha il formato
+di --download-archive di yt-dlp, una riga "estrattore id" per elemento: un
+archivio già creato da yt-dlp vale anche qui, e viceversa.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from . import tracing
+from .reporting import Reporter
+
+DOWNLOAD_ARCHIVE = "download_archive.txt"
+DOWNLOAD_CONCURRENCY = 3
+
+logger = logging.getLogger("whisper_ultra")
+
+def archive_id(info):
+    """Chiave dell'elemento nell'archivio ("youtube dQw4w9WgXcQ"), None se manca l'id"""
+    extractor = info.get("extractor_key") or info.get("ie_key") or info.get("extractor")
+    if not info.get("id") or not extractor:
+        return None
+    return f"{extractor.lower()} {info['id']}"
+
+class DownloadArchive:
+    """Elementi già scaricati, condiviso dai thread di download"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ids = set()
+        try:
+            with open(path, encoding="utf-8") as f:
+                self._ids = {line.strip() for line in f if line.strip()}
+        except OSError:
+            pass
+
+    def __contains__(self, item_id):
+        with self._lock:
+            return item_id in self._ids
+
+    def __len__(self):
+        with self._lock:
+            return len(self._ids)
+
+    def add(self, item_id):
+        with self._lock:
+            if item_id in self._ids:
+                return
+            self._ids.add(item_id)
+            # Una riga per download finito: un'interruzione non perde quelli già registrati
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(item_id + "\n")
+
+class DownloadItem:
+    """Un video da scaricare: stato scritto dal thread di download, letto da chi riporta"""
+
+    def __init__(self, url, title=None, item_id=None):
+        self.url = url
+        self.title = title or url
+        self.item_id = item_id
+        self.status = "queued"
+        self.downloaded = 0
+        self.total = 0
+        self.path = None
+        self.error = None
+
+    @property
+    def fraction(self):
+        return self.downloaded / self.total if self.total else 0.0
+
+def expand_urls(urls):
+    """Elementi da scaricare: playlist e canali vengono espansi nei loro video
+
+    Un URL che non si riesce a leggere diventa un elemento già fallito, senza
+    fermare gli altri; i duplicati (stesso id o stesso URL) compaiono una volta.
+    """
+    # Import qui: yt_dlp serve solo a chi scarica
+    import yt_dlp
+
+    items = []
+    seen = set()
+    with yt_dlp.YoutubeDL({"quiet": True, "no_warnings": True, "extract_flat": "in_playlist"}) as ydl:
+        for url in urls:
+            try:
+                info = ydl.extract_info(url, download=False)
+            except Exception as e:
+                item = DownloadItem(url)
+                item.status = "failed"
+                item.error = str(e)
+                items.append(item)
+                continue
+
+            entries = info.get("entries") if info.get("_type") in ("playlist", "multi_video") else [info]
+            for entry in entries or []:
+                if not entry:
+                    continue
+                item = DownloadItem(
+                    entry.get("webpage_url") or entry.get("url") or url,
+                    entry.get("title"),
+                    archive_id(entry)
+                )
+                key = item.item_id or item.url
+                if key not in seen:
+                    seen.add(key)
+                    items.append(item)
+    return items
+
+def download_item(item, save_path, archive=None):
+    """Scarica un elemento aggiornandone lo stato; gli errori restano in item.error
+
+    Gli elementi di playlist espanse senza id (feed, pagine generiche) vengono
+    riconosciuti nell'archivio qui, dopo aver letto i metadati e prima di scaricare.
+    """
+    import yt_dlp
+
+    def hook(status):
+        item.downloaded = status.get("downloaded_bytes") or item.downloaded
+        item.total = status.get("total_bytes") or status.get("total_bytes_estimate") or item.total
+
+    ydl_opts = {
+        'outtmpl': os.path.join(save_path, '%(title)s.%(ext)s'),
+        'format': 'bestvideo+bestaudio/best',
+        'merge_output_format': 'mp4',
+        'noplaylist': True,
+        'quiet': True,
+        'no_warnings': True,
+        'noprogress': True,
+        'progress_hooks': [hook]
+    }
+
+    item.status = "downloading"
+    with tracing.span("download", source=item.url):
+        try:
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                info = ydl.extract_info(item.url, download=False)
+                item.title = info.get("title") or item.title
+                item.item_id = archive_id(info) or item.item_id
+                if archive is not None and item.item_id in archive:
+                    item.status = "skipped"
+                    tracing.annotate(skipped=True)
+                    return item
+                info = ydl.process_ie_result(info, download=True)
+                item.path = ydl.prepare_filename(info)
+            if archive is not None and item.item_id:
+                archive.add(item.item_id)
+            item.status = "done"
+            tracing.annotate(bytes=os.path.getsize(item.path) if os.path.exists(item.path) else 0)
+        except Exception as e:
+            logger.warning("Download fallito: %s (%s)", item.url, e)
+            item.error = str(e)
+            item.status = "failed"
+            tracing.annotate(error=item.error)
+    return item
+
+def download_batch(urls, save_path, concurrency=DOWNLOAD_CONCURRENCY, archive_path=None, reporter=None,
+                   poll=0.5):
+    """Scarica video, playlist e canali in save_path, concurrency elementi alla volta
+
+    Gli elementi già nell'archivio (di default save_path/download_archive.txt;
+    archive_path=False lo disattiva) vengono saltati. Un elemento che fallisce
+    viene segnalato senza fermare gli altri. Restituisce la lista dei
+    DownloadItem con status done, skipped o failed.
+    """
+    reporter = reporter or Reporter()
+    os.makedirs(save_path, exist_ok=True)
+    start_time = time.time()
+
+    reporter.info(f"🔎 Lettura di {len(urls)} URL...")
+    items = expand_urls(urls)
+    archive = None
+    if archive_path is not False:
+        archive = DownloadArchive(archive_path or os.path.join(save_path, DOWNLOAD_ARCHIVE))
+
+    todo = []
+    for item in items:
+        if item.status == "failed":
+            reporter.warning(f"⚠️ {item.url}: {item.error}")
+        elif archive is not None and item.item_id and item.item_id in archive:
+            item.status = "skipped"
+        else:
+            todo.append(item)
+    reporter.info(
+        f"📥 {len(todo)} da scaricare, {len(items) - len(todo)} già scaricati o non validi, "
+        f"{concurrency} alla volta"
+    )
+
+    # Il reporter viene chiamato solo da questo thread (la UI Streamlit lo richiede)
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(download_item, item, save_path, archive): item for item in todo}
+        pending = set(futures)
+        while pending:
+            finished, pending = wait(pending, timeout=poll)
+            for future in finished:
+                item = futures[future]
+                completed += 1
+                if item.status == "done":
+                    reporter.success(f"✅ {item.title}")
+                elif item.status == "failed":
+                    reporter.warning(f"⚠️ {item.title}: {item.error}")
+
+            running = [item for item in todo if item.status == "downloading"]
+            progress = (completed + sum(item.fraction for item in running)) / len(todo)
+            details = " • ".join(f"{item.title[:30]} {item.fraction*100:.0f}%" for item in running)
+            reporter.progress(progress, f"📥 {completed}/{len(todo)} completati" + (f" • {details}" if details else ""))
+    reporter.progress_done()
+
+    done = sum(item.status == "done" for item in items)
+    skipped = sum(item.status == "skipped" for item in items)
+    failed = sum(item.status == "failed" for item in items)
+    message = (
+        f"{done} scaricati, {skipped} saltati, {failed} falliti in {time.time() - start_time:.0f}s "
+        f"→ {save_path}"
+    )
+    if failed:
+        reporter.warning(f"⚠️ {message}")
+    else:
+        reporter.success(f"✅ {message}")
+    return items
@@ -0,0 +1,457 @@
+"""Worker remoti: i chunk vengono trascritti da altre macchine via HTTP
+
+Su ogni nodo gira `python -m whisper_ultra.remote --port 8790 --slots 2`, che
+espone i suoi whisper-server (o whisper-cli) su due endpoint (solo su 127.0.0.1
+se non si passa --host; con --token, o WHISPER_ULTRA_REMOTE_TOKEN, ogni richiesta
+deve portare lo stesso token):
+
+    GET  /status      slot, slot occupati e modelli presenti (JSON)
+    POST /transcribe  audio del chunk nel corpo, modello, lingua e formato negli header
+
+Il client, RemoteWorkerPool, ha la stessa interfaccia di WhisperServerPool e si
+usa al suo posto in transcribe_file, transcribe_batch e transcribe_parallel:
+manda ogni chunk al nodo meno carico, con l'audio compresso, e lo rimanda a un
+altro nodo se quello scelto non è raggiungibile. Un chunk che va in timeout
+sul nodo è un fallimento del chunk, non del nodo: ci pensano i tentativi della
+pipeline, con il timeout scalato che il client manda al nodo. L'ordine dei risultati resta compito
+della pipeline, che li ricompone per numero di chunk.
+"""
+
+import os
+import sys
+import hmac
+import json
+import time
+import zlib
+import socket
+import logging
+import argparse
+import threading
+import http.client
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from . import tracing
+from .audio import (
+    PCM_BYTES_PER_SECOND, WAV_HEADER_BYTES, build_wav_header, read_wav_info
+)
+from .capabilities import get_capabilities
+from .whisper import (
+    WHISPER_SERVER_BINARY, WhisperServerPool, detect_language, transcribe_chunk, transcribe_segments
+)
+
+REMOTE_PORT = 8790
+REMOTE_HOST = "127.0.0.1"
+# Token condiviso tra client e nodi ("" = nessun controllo)
+REMOTE_TOKEN = os.environ.get("WHISPER_ULTRA_REMOTE_TOKEN", "")
+# Un nodo che non risponde resta escluso per questo tempo, poi viene riprovato
+REMOTE_RETRY_SECONDS = 30
+# Ogni quanto il client rilegge slot e disponibilità dei nodi (anche subito dopo un chunk rimandato)
+REMOTE_REFRESH_SECONDS = 60
+# Lo stato whisper "ha fallito su questo chunk" si distingue da "nodo non raggiungibile"
+WHISPER_FAILED_STATUS = 422
+# Margine oltre il timeout del nodo per trasferire audio e risposta
+TRANSFER_MARGIN_SECONDS = 15
+
+logger = logging.getLogger("whisper_ultra")
+
+def chunk_pcm(chunk):
+    """PCM del chunk (percorso WAV o WAV in memoria) senza header"""
+    if isinstance(chunk, str):
+        info = read_wav_info(chunk)
+        with open(chunk, "rb") as f:
+            f.seek(info["data_offset"])
+            return f.read(info["data_size"])
+    return bytes(memoryview(chunk)[WAV_HEADER_BYTES:])
+
+def encode_pcm(pcm):
+    """Compressione senza perdite: differenze tra campioni consecutivi, poi zlib
+
+    Nel parlato campioni vicini si somigliano, le differenze sono piccole e zlib le
+    comprime molto meglio del PCM grezzo. L'aritmetica a 16 bit con overflow rende
+    la trasformazione esattamente reversibile.
+    """
+    samples = np.frombuffer(pcm, dtype="<i2")
+    delta = np.empty_like(samples)
+    if len(samples):
+        delta[0] = samples[0]
+        np.subtract(samples[1:], samples[:-1], out=delta[1:])
+    return zlib.compress(delta.tobytes(), 6)
+
+def decode_pcm(data):
+    delta = np.frombuffer(zlib.decompress(data), dtype="<i2")
+    return np.cumsum(delta, dtype=np.int16).astype("<i2").tobytes()
+
+class RemoteWorker:
+    """Un nodo remoto visto dal client: capacità, carico e velocità misurata"""
+
+    def __init__(self, url, token=REMOTE_TOKEN):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.slots = 1
+        self.in_flight = 0
+        # Secondi di audio trascritti per secondo, media mobile (None finché non si misura)
+        self.speed = None
+        self.failures = 0
+        self.down_until = 0.0
+
+    def load(self):
+        """Carico relativo se gli si affida un altro chunk: più basso è meglio"""
+        return (self.in_flight + 1) / (self.slots * (self.speed or 1.0))
+
+    def _headers(self):
+        return {"Authorization": f"Bearer {self.token}"} if self.token else {}
+
+    def status(self, timeout=5):
+        request = urllib.request.Request(f"{self.url}/status", headers=self._headers())
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read().decode("utf-8"))
+
+    def post(self, body, encoding, language, model, response_format, timeout):
+        """Manda il chunk; il nodo usa timeout per whisper, il client aspetta un margine in più"""
+        headers = dict(self._headers())
+        headers.update({
+            "Content-Type": "application/octet-stream",
+            "X-Audio-Encoding": encoding,
+            "X-Language": language,
+            "X-Model": model,
+            "X-Response-Format": response_format,
+            "X-Timeout": f"{timeout:g}"
+        })
+        request = urllib.request.Request(f"{self.url}/transcribe", data=body, headers=headers)
+        with urllib.request.urlopen(request, timeout=timeout + TRANSFER_MARGIN_SECONDS) as response:
+            return response.read().decode("utf-8")
+
+class RemoteWorkerPool:
+    """Chunk distribuiti su worker remoti, con la stessa interfaccia di WhisperServerPool
+
+    Ogni chunk va al nodo con slot libero e carico relativo più basso (chunk in
+    volo diviso per slot e per velocità misurata); se il nodo non è raggiungibile,
+    il chunk viene rimandato subito a un altro e il nodo resta escluso per
+    retry_seconds. Se sono tutti esclusi, il chunk aspetta che uno torni, fino al
+    suo timeout. Slot e disponibilità dei nodi vengono riletti in background ogni
+    refresh_seconds e dopo ogni chunk rimandato: un nodo riavviato con più slot,
+    o tornato dopo essere stato escluso, viene usato per quello che offre.
+    """
+
+    remote = True
+
+    def __init__(self, urls, compress=True, retry_seconds=REMOTE_RETRY_SECONDS, token=REMOTE_TOKEN,
+                 refresh_seconds=REMOTE_REFRESH_SECONDS):
+        self.workers = [RemoteWorker(url, token) for url in urls]
+        self.compress = compress
+        self.retry_seconds = retry_seconds
+        self.refresh_seconds = refresh_seconds
+        self._available = threading.Condition()
+        self._refreshing = False
+        self._refreshed_at = 0.0
+        self.refresh()
+
+    @property
+    def size(self):
+        """Slot totali dei nodi raggiungibili"""
+        now = time.time()
+        return sum(worker.slots for worker in self.workers if worker.down_until <= now) or 1
+
+    def refresh(self):
+        """Rilegge slot e disponibilità di ogni nodo"""
+        for worker in self.workers:
+            try:
+                status = worker.status()
+                with self._available:
+                    worker.slots = max(1, int(status.get("slots", 1)))
+                    worker.down_until = 0.0
+            except (OSError, ValueError, http.client.HTTPException) as e:
+                logger.warning("Worker remoto %s non raggiungibile: %s", worker.url, e)
+                with self._available:
+                    worker.down_until = time.time() + self.retry_seconds
+        with self._available:
+            self._refreshed_at = time.time()
+            self._available.notify_all()
+
+    def _refresh_soon(self, force=False):
+        """refresh() in un thread se è passato refresh_seconds (o subito con force), uno alla volta"""
+        with self._available:
+            if self._refreshing or (not force and time.time() - self._refreshed_at < self.refresh_seconds):
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            finally:
+                with self._available:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name="remote-refresh", daemon=True).start()
+
+    def available(self):
+        now = time.time()
+        return any(worker.down_until <= now for worker in self.workers)
+
+    def resize(self, size, threads=None):
+        """La capacità la decidono i nodi (slot): niente da ridimensionare"""
+
+    def companion(self, threads=None):
+        """Pool per un secondo modello: i nodi tengono già un pool per modello"""
+        return self
+
+    def shutdown(self):
+        pass
+
+    def _acquire(self, deadline):
+        """Nodo raggiungibile con slot libero; se sono tutti esclusi aspetta che uno torni, fino a deadline"""
+        with self._available:
+            while True:
+                now = time.time()
+                candidates = [w for w in self.workers if w.down_until <= now]
+                free = [w for w in candidates if w.in_flight < w.slots]
+                if free:
+                    worker = min(free, key=lambda w: w.load())
+                    worker.in_flight += 1
+                    return worker
+                if now >= deadline:
+                    raise ConnectionError("Nessun worker remoto disponibile")
+                wait = deadline - now
+                if not candidates:
+                    # Si sveglia quando scade l'esclusione del primo nodo che torna
+                    wait = min(wait, min(w.down_until for w in self.workers) - now)
+                self._available.wait(timeout=max(0.05, min(wait, 1)))
+
+    def _release(self, worker, down=False, audio_seconds=0.0, seconds=0.0):
+        with self._available:
+            worker.in_flight -= 1
+            if down:
+                worker.failures += 1
+                worker.down_until = time.time() + self.retry_seconds
+            else:
+                worker.failures = 0
+                if audio_seconds > 0 and seconds > 0:
+                    speed = audio_seconds / seconds
+                    worker.speed = speed if worker.speed is None else 0.7 * worker.speed + 0.3 * speed
+            self._available.notify_all()
+
+    def transcribe(self, chunk_path, language, model, timeout=600, response_format="text", threads=None,
+                   cancel=None):
+        """threads e cancel non si usano: i thread li decide il nodo, che finisce comunque il chunk"""
+        pcm = chunk_pcm(chunk_path)
+        audio_seconds = len(pcm) / PCM_BYTES_PER_SECOND
+        if self.compress:
+            body, encoding = encode_pcm(pcm), "pcm-delta-zlib"
+        else:
+            body, encoding = pcm, "pcm"
+        tracing.annotate(sent_bytes=len(body), pcm_bytes=len(pcm))
+
+        deadline = time.time() + timeout
+        redispatched = 0
+        self._refresh_soon()
+        while True:
+            if redispatched:
+                # Un nodo è appena caduto: gli altri potrebbero essere cambiati anche loro
+                self._refresh_soon(force=True)
+            worker = self._acquire(deadline)
+            start = time.time()
+            try:
+                text = worker.post(body, encoding, language, model, response_format, timeout)
+            except urllib.error.HTTPError as e:
+                # Il nodo ha risposto: whisper o la richiesta hanno fallito sul chunk, il nodo sta bene
+                self._release(worker)
+                message = e.read().decode("utf-8", errors="replace")
+                if e.code != WHISPER_FAILED_STATUS:
+                    message = f"HTTP {e.code} da {worker.url}: {message}"
+                raise RuntimeError(message)
+            except urllib.error.URLError as e:
+                # Connessione non riuscita: nodo escluso, chunk subito a un altro
+                self._release(worker, down=True)
+                redispatched += 1
+                logger.warning("Worker %s non raggiungibile (%s), chunk rimandato", worker.url, e.reason)
+                tracing.annotate(redispatched=redispatched)
+                continue
+            except (socket.timeout, TimeoutError):
+                # Chunk troppo lento, non nodo guasto: ci pensano i tentativi della pipeline
+                self._release(worker)
+                raise TimeoutError(f"Timeout di {timeout:g}s su {worker.url}")
+            except (ConnectionError, http.client.HTTPException) as e:
+                # Connessione caduta a metà: il nodo è morto o riavviato
+                self._release(worker, down=True)
+                redispatched += 1
+                logger.warning("Worker %s non risponde (%s), chunk rimandato", worker.url, e)
+                tracing.annotate(redispatched=redispatched)
+                continue
+            self._release(worker, audio_seconds=audio_seconds, seconds=time.time() - start)
+            tracing.annotate(worker=worker.url)
+            return text
+
+class WorkerNode:
+    """Lato nodo: trascrive i chunk ricevuti con i whisper locali, al massimo slots alla volta"""
+
+    def __init__(self, slots=2, threads=2, use_server=True):
+        self.slots = slots
+        self.threads = threads
+        self.use_server = use_server and os.path.exists(WHISPER_SERVER_BINARY)
+        self.busy = 0
+        self._slots = threading.BoundedSemaphore(slots)
+        self._lock = threading.Lock()
+        # Un pool per modello: chunk e cascata non si contendono gli stessi server
+        self._pools = {}
+
+    def status(self):
+        with self._lock:
+            busy = self.busy
+        return {
+            "slots": self.slots,
+            "busy": busy,
+            "server": self.use_server,
+            "models": sorted(get_capabilities()["models"])
+        }
+
+    def _pool(self, model):
+        if not self.use_server:
+            return None
+        with self._lock:
+            if model not in self._pools:
+                self._pools[model] = WhisperServerPool(threads=self.threads, size=self.slots)
+            return self._pools[model]
+
+    def transcribe(self, wav, language, model, response_format="text", timeout=600):
+        with self._slots:
+            with self._lock:
+                self.busy += 1
+            try:
+                return self._transcribe(wav, language, model, response_format, timeout)
+            finally:
+                with self._lock:
+                    self.busy -= 1
+
+    def _transcribe(self, wav, language, model, response_format, timeout):
+        pool = self._pool(model)
+        if pool is not None:
+            return pool.transcribe(wav, language, model, timeout, response_format)
+
+        # whisper-cli riceve il WAV da stdin
+        if response_format == "verbose_json":
+            segments = transcribe_segments(wav, language, model, None, self.threads, timeout)
+            if language == "auto":
+                language = detect_language(wav, model, None, self.threads)
+            return json.dumps({
+                "language": language,
+                "segments": [
+                    {
+                        "start": segment["start"],
+                        "end": segment["end"],
+                        "text": segment["text"],
+                        "words": [{"probability": segment["confidence"]}]
+                        if segment["confidence"] is not None else []
+                    }
+                    for segment in segments
+                ]
+            })
+        _, text, success = transcribe_chunk((wav, language, model, 0, 1), None, self.threads, timeout)
+        if not success:
+            raise RuntimeError(text)
+        return text
+
+    def shutdown(self):
+        with self._lock:
+            for pool in self._pools.values():
+                pool.shutdown()
+
+    def serve(self, port=REMOTE_PORT, host=REMOTE_HOST, token=REMOTE_TOKEN):
+        node = self
+
+        class WorkerHandler(BaseHTTPRequestHandler):
+            def _authorized(self):
+                if not token:
+                    return True
+                if hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}"):
+                    return True
+                self._reply(401, "token mancante o errato")
+                return False
+
+            def _reply(self, status, body, content_type="text/plain; charset=utf-8"):
+                body = body.encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if not self._authorized():
+                    return
+                if self.path != "/status":
+                    self._reply(404, "not found")
+                    return
+                self._reply(200, json.dumps(node.status()), "application/json")
+
+            def do_POST(self):
+                if not self._authorized():
+                    return
+                if self.path != "/transcribe":
+                    self._reply(404, "not found")
+                    return
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                encoding = self.headers.get("X-Audio-Encoding", "pcm")
+                try:
+                    pcm = decode_pcm(body) if encoding == "pcm-delta-zlib" else body
+                except (zlib.error, ValueError) as e:
+                    self._reply(400, f"audio non valido: {e}")
+                    return
+
+                with tracing.span("remote_chunk", model=self.headers.get("X-Model"),
+                                  audio_seconds=len(pcm) / PCM_BYTES_PER_SECOND, received_bytes=len(body)):
+                    try:
+                        text = node.transcribe(
+                            build_wav_header(len(pcm)) + pcm,
+                            self.headers.get("X-Language", "auto"),
+                            self.headers.get("X-Model", "base"),
+                            self.headers.get("X-Response-Format", "text"),
+                            float(self.headers.get("X-Timeout") or 600)
+                        )
+                    except Exception as e:
+                        logger.exception("Chunk remoto fallito")
+                        tracing.annotate(error=str(e))
+                        self._reply(WHISPER_FAILED_STATUS, str(e))
+                        return
+                self._reply(200, text)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), WorkerHandler)
+        server.daemon_threads = True
+        return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m whisper_ultra.remote",
+        description="Nodo di trascrizione: riceve chunk via HTTP e li trascrive con whisper.cpp locale"
+    )
+    parser.add_argument("--host", default=REMOTE_HOST,
+                        help=f"indirizzo di ascolto (default: {REMOTE_HOST}; 0.0.0.0 per la rete)")
+    parser.add_argument("--port", type=int, default=REMOTE_PORT)
+    parser.add_argument("--token", default=REMOTE_TOKEN,
+                        help="token che i client devono mandare (default: WHISPER_ULTRA_REMOTE_TOKEN)")
+    parser.add_argument("--slots", type=int, default=2, help="chunk trascritti in parallelo")
+    parser.add_argument("-t", "--threads", type=int, default=2, help="thread per chunk")
+    parser.add_argument("--no-server", action="store_true", help="whisper-cli invece dei whisper-server residenti")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    node = WorkerNode(args.slots, args.threads, not args.no_server)
+    server = node.serve(args.port, args.host, args.token)
+    logger.info(f"🌐 Worker in ascolto su {args.host}:{args.port} ({args.slots} slot)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        node.shutdown()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
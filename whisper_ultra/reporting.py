@@ -0,0 +1,40 @@
+"""Messaggi e avanzamento della pipeline, indipendenti dall'interfaccia"""
+
+import sys
+import logging
+
+logger = logging.getLogger("whisper_ultra")
+
+class Reporter:
+    """Riceve messaggi e avanzamento: la base li scrive nel log, la UI Streamlit ne ha uno suo"""
+
+    def info(self, message):
+        logger.info(message)
+
+    def success(self, message):
+        logger.info(message)
+
+    def warning(self, message):
+        logger.warning(message)
+
+    def error(self, message):
+        logger.error(message)
+
+    def progress(self, fraction, text=""):
+        pass
+
+    def progress_done(self):
+        pass
+
+class ConsoleReporter(Reporter):
+    """Reporter per la CLI: messaggi nel log e avanzamento su una riga di stderr"""
+
+    def progress(self, fraction, text=""):
+        if sys.stderr.isatty():
+            sys.stderr.write(f"\r{fraction*100:5.1f}% {text}\033[K")
+            sys.stderr.flush()
+
+    def progress_done(self):
+        if sys.stderr.isatty():
+            sys.stderr.write("\r\033[K")
+            sys.stderr.flush()
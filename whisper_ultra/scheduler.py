@@ -0,0 +1,272 @@
+"""Budget di CPU e memoria condiviso da tutti i job del processo
+
+Ogni chunk, prima di andare a whisper, chiede al CpuScheduler tanti slot quanti
+thread userà e i modelli che gli servono; finché non li ottiene aspetta senza
+consumare CPU. Così più sessioni e job insieme non avviano più thread whisper
+dei core disponibili né più copie dei modelli di quante ne stiano in RAM.
+
+La memoria si conta per copia del modello, non per chunk: con i whisper-server
+residenti la copia resta caricata dopo il chunk e il successivo la riusa senza
+pagarla di nuovo; una copia residente libera che a nessuno serve si può
+sfrattare e il suo pool ferma davvero quel server. Le copie residenti si
+contano per (modello, pool, thread), la stessa chiave con cui il pool sceglie
+i worker da riusare: dove lo scheduler conta una copia libera il pool ha un
+server libero, e ne avvia uno nuovo solo dove lo scheduler l'ha contato. Con
+whisper-cli la copia vive quanto il processo del chunk.
+
+Gli slot liberi vanno al job che in quel momento ne tiene di meno: un job di
+quattro ore con tanti chunk in coda non affama quelli brevi arrivati dopo.
+"""
+
+import os
+import time
+import threading
+
+from .capabilities import get_capabilities
+from .whisper import model_path
+
+# Memoria di whisper.cpp per modello (README di whisper.cpp), se il file del modello manca
+MODEL_MEMORY_MB = {
+    "tiny": 273,
+    "base": 388,
+    "small": 852,
+    "medium": 2100,
+    "large": 3900,
+}
+# Memoria di un processo whisper rispetto al file del modello (pesi più buffer di calcolo)
+MODEL_FILE_MEMORY_FACTOR = 1.5
+# Quota della RAM riservata ai modelli se WHISPER_ULTRA_MEMORY_MB non è impostata
+MEMORY_BUDGET_FRACTION = 0.75
+
+def default_cpu_slots():
+    """WHISPER_ULTRA_CPU_SLOTS, altrimenti tutti i core tranne uno"""
+    slots = int(os.environ.get("WHISPER_ULTRA_CPU_SLOTS", "0"))
+    return slots or max(1, get_capabilities()["cores"] - 1)
+
+def default_memory_mb():
+    """WHISPER_ULTRA_MEMORY_MB, altrimenti una quota della RAM (None se non si ricava)"""
+    memory_mb = int(os.environ.get("WHISPER_ULTRA_MEMORY_MB", "0"))
+    if memory_mb:
+        return memory_mb
+    total_mb = get_capabilities()["memory_mb"]
+    return int(total_mb * MEMORY_BUDGET_FRACTION) if total_mb else None
+
+def model_memory_mb(model):
+    """Memoria stimata di una copia di model: file del modello × 1.5, altrimenti la tabella"""
+    try:
+        size = os.path.getsize(model_path(model))
+    except OSError:
+        size = 0
+    if size > 0:
+        return int(size * MODEL_FILE_MEMORY_FACTOR) // (1024 * 1024)
+    return MODEL_MEMORY_MB.get(model, MODEL_MEMORY_MB["base"])
+
+class SlotRequest:
+    """Richiesta di slot di un job; `with` la attende e la rilascia"""
+
+    def __init__(self, scheduler, owner, cpu, models, seq):
+        self.scheduler = scheduler
+        self.owner = owner
+        self.cpu = cpu
+        # {(modello, pool, thread): MB di una copia}; pool None = whisper-cli
+        self.models = models
+        self.seq = seq
+        self.waited = 0.0
+        self.granted_at = None
+
+    def __enter__(self):
+        self.scheduler._acquire(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.scheduler._release(self)
+        return False
+
+class CpuScheduler:
+    """Slot CPU (thread whisper) e memoria dei modelli assegnati ai job in modo equo"""
+
+    def __init__(self, cpu_slots=None, memory_mb=None):
+        self.cpu_slots = max(1, cpu_slots or default_cpu_slots())
+        self.memory_mb = memory_mb if memory_mb is not None else default_memory_mb()
+        self._changed = threading.Condition()
+        self._used_cpu = 0
+        self._used_memory = 0
+        self._held = {}
+        # Copie dei modelli caricate (contate in _used_memory) e quante sono al lavoro,
+        # per (modello, pool, thread)
+        self._copies = {}
+        self._busy = {}
+        self._copy_mb = {}
+        self._waiting = []
+        self._seq = 0
+        # Durata media di uno slot tenuto, per stimare l'attesa
+        self._hold_seconds = None
+
+    def slot(self, owner, threads=2, models=("base",), pools=()):
+        """Richiesta per un chunk di owner: threads slot CPU e una copia di ogni modello
+
+        pools, allineato a models, dice quale WhisperServerPool esegue ciascun
+        modello (None o mancante = whisper-cli). La copia di un modello nel pool
+        è un suo whisper-server: resta in memoria (e nel conto) anche dopo il
+        chunk. Il pool viene collegato allo scheduler (attach).
+        """
+        pools = tuple(pools) + (None,) * (len(models) - len(pools))
+        memory = {}
+        for model, pool in zip(models, pools):
+            if not model:
+                continue
+            if pool is not None:
+                self.attach(pool)
+            memory[(model, pool, threads if pool is not None else None)] = model_memory_mb(model)
+        with self._changed:
+            self._seq += 1
+            seq = self._seq
+        return SlotRequest(self, owner, min(max(threads, 1), self.cpu_slots), memory, seq)
+
+    def attach(self, pool):
+        """Collega un WhisperServerPool: sfratti e server fermati passano da qui in poi"""
+        pool.scheduler = self
+
+    def copy_stopped(self, pool, model, threads):
+        """Il pool ha fermato un suo server libero: la copia esce dal conto"""
+        key = (model, pool, threads)
+        with self._changed:
+            if self._copies.get(key, 0) > self._busy.get(key, 0):
+                self._drop_copy(key)
+                self._changed.notify_all()
+
+    def _next(self):
+        # Prima il job che tiene meno slot, a parità il più vecchio
+        return min(self._waiting, key=lambda r: (self._held.get(r.owner, 0), r.seq))
+
+    def _fits(self, request):
+        if not self._used_cpu:
+            # Una richiesta da sola passa sempre, anche se supera il budget di memoria
+            return True
+        if self._used_cpu + request.cpu > self.cpu_slots:
+            return False
+        if self.memory_mb is None:
+            return True
+        return self._used_memory + self._new_copies_mb(request) - self._evictable_mb(request) <= self.memory_mb
+
+    def _new_copies_mb(self, request):
+        # Memoria delle copie da caricare: i modelli senza una copia residente libera
+        return sum(mb for key, mb in request.models.items()
+                   if self._copies.get(key, 0) <= self._busy.get(key, 0))
+
+    def _evictable_mb(self, request):
+        # Copie residenti libere che a request non servono
+        return sum(self._copy_mb[key] * (copies - self._busy.get(key, 0))
+                   for key, copies in self._copies.items() if key not in request.models)
+
+    def _evict(self, request):
+        """Sfratta copie libere finché la memoria rientra: i server tolti ai pool, da fermare"""
+        evicted = []
+        for key in list(self._copies):
+            while (self.memory_mb is not None and self._used_memory > self.memory_mb
+                   and key not in request.models and self._copies.get(key, 0) > self._busy.get(key, 0)):
+                self._drop_copy(key)
+                model, pool, threads = key
+                worker = pool.take_idle(model, threads)
+                if worker is not None:
+                    evicted.append(worker)
+        return evicted
+
+    def _drop_copy(self, key):
+        self._used_memory -= self._copy_mb[key]
+        self._copies[key] -= 1
+        if not self._copies[key]:
+            del self._copies[key], self._copy_mb[key]
+
+    def _acquire(self, request):
+        start = time.time()
+        with self._changed:
+            self._waiting.append(request)
+            while self._next() is not request or not self._fits(request):
+                self._changed.wait()
+            self._waiting.remove(request)
+            self._used_cpu += request.cpu
+            for key, mb in request.models.items():
+                if self._copies.get(key, 0) <= self._busy.get(key, 0):
+                    self._copies[key] = self._copies.get(key, 0) + 1
+                    self._copy_mb[key] = mb
+                    self._used_memory += mb
+                self._busy[key] = self._busy.get(key, 0) + 1
+            evicted = self._evict(request)
+            self._held[request.owner] = self._held.get(request.owner, 0) + request.cpu
+            # La prossima in ordine potrebbe starci anche lei
+            self._changed.notify_all()
+        # Fermare un server può richiedere secondi: fuori dal lock
+        for worker in evicted:
+            worker.stop()
+        request.granted_at = time.time()
+        request.waited = request.granted_at - start
+
+    def _release(self, request):
+        with self._changed:
+            self._used_cpu -= request.cpu
+            for key in request.models:
+                self._busy[key] -= 1
+                if not self._busy[key]:
+                    del self._busy[key]
+                if key[1] is None:
+                    # Il processo whisper-cli è finito e con lui la sua copia
+                    self._drop_copy(key)
+            held = self._held[request.owner] - request.cpu
+            if held:
+                self._held[request.owner] = held
+            else:
+                del self._held[request.owner]
+            seconds = time.time() - request.granted_at
+            self._hold_seconds = seconds if self._hold_seconds is None else 0.8 * self._hold_seconds + 0.2 * seconds
+            self._changed.notify_all()
+
+    def _model_copies(self):
+        copies = {}
+        for (model, _, _), count in self._copies.items():
+            copies[model] = copies.get(model, 0) + count
+        return copies
+
+    def status(self, owner=None):
+        """Occupazione del budget e, per owner, chunk in attesa, posizione e attesa stimata
+
+        position è il numero di richieste servite prima della prima di owner (1 =
+        la prossima); eta_seconds stima quando partirà, None se manca una misura.
+        """
+        with self._changed:
+            status = {
+                "cpu_slots": self.cpu_slots,
+                "used_cpu": self._used_cpu,
+                "memory_mb": self.memory_mb,
+                "used_memory_mb": self._used_memory,
+                "model_copies": self._model_copies(),
+                "jobs": len(set(self._held) | {r.owner for r in self._waiting}),
+                "waiting": len(self._waiting)
+            }
+            if owner is None:
+                return status
+
+            mine = [r for r in self._waiting if r.owner == owner]
+            status["held"] = self._held.get(owner, 0)
+            status["owner_waiting"] = len(mine)
+            status["position"] = 0
+            status["eta_seconds"] = 0.0 if not mine else None
+            if mine:
+                # Ordine di servizio simulato: chi tiene meno slot passa prima
+                held = dict(self._held)
+                pending = list(self._waiting)
+                first = min(mine, key=lambda r: r.seq)
+                position = 0
+                while pending:
+                    nxt = min(pending, key=lambda r: (held.get(r.owner, 0), r.seq))
+                    position += 1
+                    if nxt is first:
+                        break
+                    pending.remove(nxt)
+                    held[nxt.owner] = held.get(nxt.owner, 0) + nxt.cpu
+                status["position"] = position
+                if self._hold_seconds is not None:
+                    # Si libera circa uno slot ogni hold_seconds / slot contemporanei
+                    concurrent = max(self.cpu_slots // max(first.cpu, 1), 1)
+                    status["eta_seconds"] = position * self._hold_seconds / concurrent
+            return status
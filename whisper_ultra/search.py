@@ -0,0 +1,289 @@
+"""Indice full-text (SQLite FTS5) delle trascrizioni salvate in trascrizioni/
+
+Ogni trascrizione viene indicizzata riga per riga (una riga ≈ un segmento di
+whisper) con la posizione nel testo e, quando la mappa dei chunk è nota (dal
+.json accanto alla trascrizione o dal manifest del job), l'istante nel file
+originale in millisecondi. Le righe non hanno
+tempi propri nel .txt: l'istante è interpolato sul parlato del chunk, quindi
+preciso a livello di chunk e approssimato dentro il chunk.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+import threading
+
+from .audio import chunk_time_to_source
+from .jobs import JOBS_DIR, manifest_chunks
+from .pipeline import TRANSCRIPTS_DIR, transcript_sidecar
+
+SEARCH_INDEX_DB = "cache/search.sqlite3"
+TRANSCRIPT_NAME_RE = re.compile(r"^(?P<name>.*)_(?P<timestamp>\d{8}_\d{6})(?:_\d+)?\.txt$")
+
+def transcript_segments(text, chunks=None):
+    """Righe della trascrizione: (chunk, offset nel testo, inizio ms, fine ms, testo)
+
+    Con chunks (dal manifest) i tempi vengono dalla mappa del parlato di ogni
+    chunk; se i chunk non ricompongono il testo, o mancano, i tempi sono None.
+    """
+    if chunks and "\n\n".join(chunk["text"] for chunk in chunks) != text:
+        chunks = None
+    if not chunks:
+        chunks = [{"text": paragraph, "segment_map": []} for paragraph in text.split("\n\n")]
+
+    segments = []
+    cursor = 0
+    for number, chunk in enumerate(chunks):
+        lines = [line for line in chunk["text"].split("\n") if line.strip()]
+        segment_map = chunk.get("segment_map") or []
+        speech = sum(length for _, _, length in segment_map)
+        total_chars = sum(len(line) for line in lines) or 1
+        chars = 0
+        for line in lines:
+            offset = text.find(line, cursor)
+            cursor = offset + len(line)
+            start_ms = end_ms = None
+            if segment_map:
+                start = chunk_time_to_source(segment_map, speech * chars / total_chars)
+                end = chunk_time_to_source(segment_map, speech * (chars + len(line)) / total_chars)
+                start_ms, end_ms = int(start * 1000), int(end * 1000)
+            chars += len(line)
+            segments.append((number, offset, start_ms, end_ms, line.strip()))
+    return segments
+
+def fts_query(query):
+    """Query FTS5 sicura dal testo dell'utente: ogni parola tra virgolette, * finale per i prefissi"""
+    terms = []
+    for term in query.split():
+        prefix = term.endswith("*")
+        term = term.rstrip("*").replace('"', '""')
+        if term:
+            terms.append(f'"{term}"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+class SearchIndex:
+    """Indice delle trascrizioni: aggiunta incrementale, reindicizzazione dell'archivio e ricerca"""
+
+    def __init__(self, path=SEARCH_INDEX_DB):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._db:
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY,
+                    path TEXT UNIQUE NOT NULL,
+                    video_name TEXT,
+                    model TEXT,
+                    language TEXT,
+                    duration REAL,
+                    created_at REAL,
+                    mtime_ns INTEGER,
+                    size INTEGER
+                );
+                CREATE TABLE IF NOT EXISTS segments (
+                    id INTEGER PRIMARY KEY,
+                    document_id INTEGER NOT NULL,
+                    chunk INTEGER NOT NULL,
+                    char_offset INTEGER NOT NULL,
+                    start_ms INTEGER,
+                    end_ms INTEGER
+                );
+                CREATE INDEX IF NOT EXISTS segments_document ON segments(document_id);
+                CREATE VIRTUAL TABLE IF NOT EXISTS segments_fts USING fts5(
+                    text, tokenize = 'unicode61 remove_diacritics 2'
+                );
+            """)
+
+    def _remove(self, path):
+        row = self._db.execute("SELECT id FROM documents WHERE path = ?", (path,)).fetchone()
+        if row is None:
+            return
+        self._db.execute(
+            "DELETE FROM segments_fts WHERE rowid IN (SELECT id FROM segments WHERE document_id = ?)", (row[0],)
+        )
+        self._db.execute("DELETE FROM segments WHERE document_id = ?", (row[0],))
+        self._db.execute("DELETE FROM documents WHERE id = ?", (row[0],))
+
+    def add(self, path, text, chunks=None, video_name=None, model=None, language=None, duration=None):
+        """Indicizza (o reindicizza) la trascrizione salvata in path; restituisce le righe indicizzate
+
+        chunks sono i chunk del manifest (manifest_chunks): danno gli istanti
+        delle righe e, se duration manca, la durata.
+        """
+        path = os.path.abspath(path)
+        segments = transcript_segments(text, chunks)
+        if duration is None and chunks:
+            ends = [source + length for chunk in chunks for _, source, length in chunk.get("segment_map") or []]
+            duration = max(ends) if ends else None
+        if video_name is None:
+            match = TRANSCRIPT_NAME_RE.match(os.path.basename(path))
+            video_name = match.group("name") if match else os.path.splitext(os.path.basename(path))[0]
+        try:
+            stat = os.stat(path)
+            mtime_ns, size = stat.st_mtime_ns, stat.st_size
+        except OSError:
+            mtime_ns, size = None, None
+
+        with self._lock, self._db:
+            self._remove(path)
+            document_id = self._db.execute(
+                "INSERT INTO documents (path, video_name, model, language, duration, created_at, mtime_ns, size) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, video_name, model, language, duration, time.time(), mtime_ns, size)
+            ).lastrowid
+            for chunk, offset, start_ms, end_ms, line in segments:
+                segment_id = self._db.execute(
+                    "INSERT INTO segments (document_id, chunk, char_offset, start_ms, end_ms) VALUES (?, ?, ?, ?, ?)",
+                    (document_id, chunk, offset, start_ms, end_ms)
+                ).lastrowid
+                self._db.execute("INSERT INTO segments_fts (rowid, text) VALUES (?, ?)", (segment_id, line))
+        return len(segments)
+
+    def index_archive(self, directory=TRANSCRIPTS_DIR, jobs_dir=JOBS_DIR):
+        """Indicizza in blocco le trascrizioni di directory: solo i file nuovi o cambiati
+
+        Tempi e metadati vengono dal .json salvato accanto alla trascrizione
+        (save_transcript) o, per le trascrizioni che non ce l'hanno, dal manifest
+        del job con lo stesso testo, se c'è ancora in jobs_dir. I documenti dei
+        file cancellati escono dall'indice.
+        Restituisce {"indexed", "unchanged", "removed"}.
+        """
+        manifests = {}
+        try:
+            job_ids = os.listdir(jobs_dir)
+        except OSError:
+            job_ids = []
+        for job_id in job_ids:
+            try:
+                with open(os.path.join(jobs_dir, job_id, "manifest.json")) as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            chunks = manifest_chunks(data)
+            joined = "\n\n".join(chunk["text"] for chunk in chunks)
+            manifests[hashlib.sha256(joined.encode("utf-8")).hexdigest()] = (data, chunks)
+
+        with self._lock:
+            known = {
+                path: (mtime_ns, size)
+                for path, mtime_ns, size in self._db.execute("SELECT path, mtime_ns, size FROM documents")
+            }
+
+        stats = {"indexed": 0, "unchanged": 0, "removed": 0}
+        directory = os.path.abspath(directory)
+        present = set()
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError:
+            names = []
+        for name in names:
+            if not name.endswith(".txt"):
+                continue
+            path = os.path.join(directory, name)
+            present.add(path)
+            stat = os.stat(path)
+            if known.get(path) == (stat.st_mtime_ns, stat.st_size):
+                stats["unchanged"] += 1
+                continue
+            with open(path, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+            try:
+                with open(transcript_sidecar(path), encoding="utf-8") as f:
+                    data = json.load(f)
+                chunks = data.get("chunks")
+            except (OSError, ValueError):
+                data, chunks = manifests.get(hashlib.sha256(text.encode("utf-8")).hexdigest(), ({}, None))
+            self.add(
+                path, text, chunks,
+                model=data.get("model"),
+                language=data.get("detected_language") or data.get("language"),
+                duration=data.get("duration")
+            )
+            stats["indexed"] += 1
+
+        with self._lock, self._db:
+            for path in known:
+                if os.path.dirname(path) == directory and path not in present:
+                    self._remove(path)
+                    stats["removed"] += 1
+        return stats
+
+    def search(self, query, limit=20, model=None, language=None, highlight=("**", "**")):
+        """Righe che contengono tutte le parole di query, le più pertinenti prima (BM25)
+
+        Ogni risultato ha path, video_name, model, language, duration, start_ms,
+        end_ms (None senza mappa dei chunk), char_offset, snippet e score.
+        """
+        match = fts_query(query)
+        if not match:
+            return []
+        sql = (
+            "SELECT d.path, d.video_name, d.model, d.language, d.duration, s.start_ms, s.end_ms, s.char_offset, "
+            "snippet(segments_fts, 0, ?, ?, '…', 16), bm25(segments_fts) "
+            "FROM segments_fts JOIN segments s ON s.id = segments_fts.rowid "
+            "JOIN documents d ON d.id = s.document_id "
+            "WHERE segments_fts MATCH ?"
+        )
+        params = [highlight[0], highlight[1], match]
+        if model:
+            sql += " AND d.model = ?"
+            params.append(model)
+        if language:
+            sql += " AND d.language = ?"
+            params.append(language)
+        sql += " ORDER BY bm25(segments_fts) LIMIT ?"
+        params.append(limit)
+
+        with self._lock:
+            rows = self._db.execute(sql, params).fetchall()
+        keys = ("path", "video_name", "model", "language", "duration", "start_ms", "end_ms", "char_offset",
+                "snippet", "score")
+        return [dict(zip(keys, row)) for row in rows]
+
+    def stats(self):
+        with self._lock:
+            documents = self._db.execute("SELECT COUNT(*) FROM documents").fetchone()[0]
+            segments = self._db.execute("SELECT COUNT(*) FROM segments").fetchone()[0]
+        return {"documents": documents, "segments": segments}
+
+def format_position(ms):
+    """Millisecondi come h:mm:ss o mm:ss ("--:--" se l'istante non è noto)"""
+    if ms is None:
+        return "--:--"
+    minutes, seconds = divmod(int(ms) // 1000, 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}:{minutes:02d}:{seconds:02d}" if hours else f"{minutes:02d}:{seconds:02d}"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m whisper_ultra.search",
+        description="Cerca una frase nelle trascrizioni salvate"
+    )
+    parser.add_argument("query", nargs="*", help="parole da cercare (parola* per i prefissi)")
+    parser.add_argument("-n", "--limit", type=int, default=20)
+    parser.add_argument("-m", "--model", help="solo trascrizioni fatte con questo modello")
+    parser.add_argument("-l", "--language", help="solo trascrizioni in questa lingua")
+    parser.add_argument("--reindex", metavar="DIR", nargs="?", const=TRANSCRIPTS_DIR,
+                        help=f"indicizza prima l'archivio (default: {TRANSCRIPTS_DIR})")
+    args = parser.parse_args(argv)
+
+    index = SearchIndex()
+    if args.reindex:
+        stats = index.index_archive(args.reindex)
+        print(f"🗂️ {stats['indexed']} indicizzate, {stats['unchanged']} invariate, {stats['removed']} rimosse")
+    if not args.query:
+        return 0
+
+    hits = index.search(" ".join(args.query), args.limit, args.model, args.language, highlight=("[", "]"))
+    for hit in hits:
+        print(f"{hit['path']} @ {format_position(hit['start_ms'])}  {hit['snippet']}")
+    return 0 if hits else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,351 @@
+"""Coda di chunk senza code lunghe: la fine del lavoro si divide, i chunk lenti si duplicano
+
+Con chunk di dimensione fissa l'ultimo chunk gira spesso da solo mentre gli
+altri worker aspettano, e un chunk che si blocca vicino al timeout ferma tutto
+il job. ChunkRunner trascrive i chunk con un numero fisso di worker e:
+
+- quando non arrivano più chunk e quelli in coda sono meno dei worker, divide
+  il prossimo in sottochunk (tagliando nelle pause) che i worker prendono in
+  parallelo man mano che si liberano;
+- quando un worker resta senza lavoro e un chunk in corso va molto più lento
+  dei suoi pari, ne lancia una copia: vale il risultato che arriva per primo.
+"""
+
+import time
+import logging
+import threading
+import statistics
+from collections import deque
+
+from . import tracing
+from .audio import chunk_seconds, span_audio, split_chunk
+
+# Sottochunk mai più corti di così: ogni chiamata a whisper ha un costo fisso
+MIN_PART_SECONDS = 60
+# Copia di un chunk che impiega più di SPECULATE_FACTOR volte il tempo atteso
+SPECULATE_FACTOR = 2.0
+# Margine assoluto prima di duplicare, per i chunk brevi
+SPECULATE_GRACE_SECONDS = 10.0
+# Ogni quanto un worker senza lavoro ricontrolla i chunk in corso
+SPECULATE_POLL_SECONDS = 0.5
+
+logger = logging.getLogger("whisper_ultra")
+
+class CancelToken:
+    """Annullamento di un tentativo: chi lavora registra come fermarsi (kill del processo, stop del server)
+
+    Le funzioni registrate con on_cancel() vengono chiamate una volta sola da
+    cancel(), o subito se il tentativo è già annullato; remove() le toglie a fine
+    lavoro e aspetta un cancel() in corso, così non si ferma un processo che
+    nel frattempo serve un altro chunk.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self.cancelled = False
+
+    def is_set(self):
+        return self.cancelled
+
+    def on_cancel(self, callback):
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    def cancel(self):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            callbacks, self._callbacks = self._callbacks, []
+            for callback in callbacks:
+                try:
+                    callback()
+                except Exception:
+                    logger.exception("Annullamento del tentativo fallito")
+
+class _Chunk:
+    def __init__(self, number, seconds, meta):
+        self.number = number
+        self.seconds = seconds
+        self.meta = meta
+        self.queued_at = time.time()
+        self.texts = [None]
+        self.successes = [False]
+        self.attempts = 0
+        self.remaining = 1
+        self.speculated = 0
+
+class _Part:
+    def __init__(self, chunk, index, audio, seconds, original=False):
+        self.chunk = chunk
+        self.index = index
+        self.audio = audio
+        self.seconds = seconds
+        self.original = original
+        self.started_at = None
+        self.running = 0
+        self.copies = 0
+        self.done = False
+        # Un CancelToken per tentativo in corso (originale e copie)
+        self.tokens = []
+
+class ChunkRunner:
+    """Trascrive i chunk aggiunti con add() usando workers thread
+
+    transcribe(audio, numero, secondi, started, cancel) restituisce (testo,
+    riuscito, tentativi) e chiama started() quando whisper parte davvero (dopo
+    eventuali attese di slot CPU, che non devono far sembrare lento il chunk);
+    cancel è il CancelToken del tentativo, annullato quando un'altra copia dello
+    stesso pezzo finisce prima: il perdente viene fermato e il suo risultato
+    scartato;
+    on_done(numero, testo, riuscito, meta, tentativi) viene chiamato, da un thread
+    worker, quando tutti i pezzi del chunk sono trascritti. release(audio), se c'è,
+    riceve l'audio originale di ogni chunk quando non serve più (per cancellare
+    il file). maxsize limita i chunk in attesa: add() si blocca oltre.
+    """
+
+    def __init__(self, transcribe, on_done, workers=4, split_tail=True, speculate=True, release=None,
+                 maxsize=0, min_part_seconds=MIN_PART_SECONDS, slow_factor=SPECULATE_FACTOR,
+                 grace_seconds=SPECULATE_GRACE_SECONDS):
+        self.transcribe = transcribe
+        self.on_done = on_done
+        self.workers = max(1, workers)
+        self.split_tail = split_tail
+        self.speculate = speculate
+        self.release = release
+        self.maxsize = maxsize
+        self.min_part_seconds = min_part_seconds
+        self.slow_factor = slow_factor
+        self.grace_seconds = grace_seconds
+        self.splits = 0
+        self.speculated = 0
+        self.speculation_wins = 0
+        self._changed = threading.Condition()
+        self._pending = deque()
+        self._running = []
+        self._open = 0
+        self._closed = False
+        self._cancelled = False
+        self._draining = False
+        self._busy = 0
+        # Secondi di audio per secondo di lavoro degli ultimi pezzi riusciti
+        self._speeds = deque(maxlen=20)
+        self._parent = tracing.current_span()
+        self._threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f"whisper-chunk-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def add(self, number, audio, seconds, meta=None, last=False):
+        """Mette in coda un chunk; last=True se è (probabilmente) l'ultimo
+
+        Col flag la coda finale si può dividere subito, senza aspettare close():
+        un worker libero prende l'ultimo chunk appena arriva.
+        """
+        with self._changed:
+            while self.maxsize and len(self._pending) >= self.maxsize and not self._cancelled:
+                self._changed.wait()
+            if self._cancelled:
+                return
+            chunk = _Chunk(number, seconds, meta)
+            self._pending.append(_Part(chunk, 0, audio, seconds, original=True))
+            self._open += 1
+            self._draining = self._draining or last
+            self._changed.notify_all()
+
+    def close(self):
+        """Non arrivano altri chunk: da qui la coda finale può essere divisa"""
+        with self._changed:
+            self._closed = True
+            self._draining = True
+            self._changed.notify_all()
+
+    def cancel(self):
+        """Abbandona i chunk non ancora finiti: coda svuotata, tentativi in corso annullati
+
+        on_done non viene più chiamato e i chunk aggiunti dopo vengono ignorati;
+        release riceve comunque l'audio dei chunk scartati dalla coda.
+        """
+        with self._changed:
+            dropped = [part.audio for part in self._pending if part.original]
+            self._pending.clear()
+            self._closed = True
+            self._cancelled = True
+            self._open = 0
+            tokens = [token for part in self._running for token in part.tokens]
+            self._changed.notify_all()
+        for token in tokens:
+            token.cancel()
+        if self.release is not None:
+            for audio in dropped:
+                self.release(audio)
+
+    def stats(self):
+        with self._changed:
+            return {"splits": self.splits, "speculated": self.speculated, "speculation_wins": self.speculation_wins}
+
+    def _tail_parts(self, part):
+        """In quanti pezzi dividere part appena tolto dalla coda (meno di 2: nessuna divisione)"""
+        if not (self.split_tail and self._draining and part.original):
+            return 1
+        # Meno chunk in coda che worker: i pezzi li prendono i worker man mano che si liberano
+        share = self.workers // (len(self._pending) + 1)
+        return min(share, int(part.seconds // self.min_part_seconds))
+
+    def _split(self, part, parts):
+        """Divide part fuori dal lock: la ricerca dei tagli legge e copia tutto il chunk"""
+        try:
+            pieces = split_chunk(part.audio, parts)
+        except Exception:
+            logger.exception("Divisione del chunk %d fallita, lo trascrivo intero", part.chunk.number)
+            return part
+
+        chunk = part.chunk
+        split = [
+            _Part(chunk, i, audio, chunk_seconds(audio))
+            for i, (audio, _) in enumerate(pieces)
+        ]
+        with self._changed:
+            self.splits += 1
+            chunk.texts = [None] * len(pieces)
+            chunk.successes = [False] * len(pieces)
+            chunk.remaining = len(pieces)
+            self._pending.extendleft(reversed(split[1:]))
+            self._changed.notify_all()
+        if self.release is not None:
+            self.release(part.audio)
+        return split[0]
+
+    def _straggler(self):
+        """Pezzo in corso da duplicare, con il suo audio in memoria (None se nessuno)"""
+        if not self.speculate or not self._speeds:
+            return None
+        speed = statistics.median(self._speeds)
+        now = time.time()
+        worst = None
+        worst_ratio = 1.0
+        for part in self._running:
+            if part.done or part.copies or part.started_at is None:
+                continue
+            expected = part.seconds / speed
+            if now - part.started_at < self.slow_factor * expected + self.grace_seconds:
+                continue
+            ratio = (now - part.started_at) / max(expected, 1e-6)
+            if ratio > worst_ratio:
+                worst, worst_ratio = part, ratio
+        if worst is None:
+            return None
+        worst.copies += 1
+        self.speculated += 1
+        worst.chunk.speculated += 1
+        # Copia in memoria: l'originale può finire (ed essere cancellato) mentre la copia gira
+        audio = worst.audio
+        if isinstance(audio, str):
+            audio = span_audio(audio, 0, worst.seconds + 1)
+        logger.info("Chunk %d lento (%.1fx il previsto): lancio una copia", worst.chunk.number, worst_ratio)
+        return worst, audio
+
+    def _work(self):
+        while True:
+            parts = 1
+            with self._changed:
+                task = None
+                while task is None:
+                    if self._pending:
+                        part = self._pending.popleft()
+                        parts = self._tail_parts(part)
+                        task = (part, part.audio, False)
+                    elif self._closed and not self._open:
+                        return
+                    else:
+                        straggler = self._straggler()
+                        if straggler is not None:
+                            task = (straggler[0], straggler[1], True)
+                        else:
+                            self._changed.wait(SPECULATE_POLL_SECONDS)
+            if parts >= 2:
+                part = self._split(task[0], parts)
+                task = (part, part.audio, False)
+
+            part = task[0]
+            token = CancelToken()
+            with self._changed:
+                self._busy += 1
+                part.running += 1
+                part.tokens.append(token)
+                if part.started_at is None:
+                    part.started_at = time.time()
+                    self._running.append(part)
+                self._changed.notify_all()
+            self._run(*task, token)
+
+    def _run(self, part, audio, copy, token):
+        chunk = part.chunk
+        start = [time.time()]
+
+        def started():
+            now = time.time()
+            start[0] = now
+            if not copy:
+                with self._changed:
+                    part.started_at = now
+
+        with tracing.span("chunk", self._parent, chunk=chunk.number, part=part.index,
+                          audio_seconds=round(part.seconds, 3), speculative=copy,
+                          queue_wait=round(start[0] - chunk.queued_at, 6)):
+            try:
+                text, success, attempts = self.transcribe(audio, chunk.number, part.seconds, started, token)
+            except Exception as e:
+                logger.exception("Chunk %d fallito", chunk.number)
+                text, success, attempts = f"[Errore {chunk.number}: {str(e)}]", False, 1
+            tracing.annotate(success=success)
+
+        finished = None
+        release = None
+        losers = []
+        with self._changed:
+            self._busy -= 1
+            part.running -= 1
+            part.tokens.remove(token)
+            if not token.is_set():
+                chunk.attempts = max(chunk.attempts, attempts)
+            # Vince la prima copia riuscita; un fallimento conta solo se non ne restano altre
+            if not part.done and (success or not part.running):
+                part.done = True
+                self._running.remove(part)
+                # Le altre copie ancora in corso hanno perso: vanno fermate
+                losers = list(part.tokens)
+                if success:
+                    self._speeds.append(part.seconds / max(time.time() - start[0], 1e-6))
+                    if copy:
+                        self.speculation_wins += 1
+                chunk.texts[part.index] = text
+                chunk.successes[part.index] = success
+                chunk.remaining -= 1
+                if not chunk.remaining and not self._cancelled:
+                    self._open -= 1
+                    finished = chunk
+            if part.done and not part.running and part.original:
+                release = part.audio
+            self._changed.notify_all()
+
+        for loser in losers:
+            loser.cancel()
+        if release is not None and self.release is not None:
+            self.release(release)
+        if finished is not None:
+            if len(finished.texts) == 1:
+                text = finished.texts[0]
+            else:
+                text = "".join(t if t.endswith("\n") else t + "\n" for t in finished.texts if t)
+            self.on_done(finished.number, text, all(finished.successes), finished.meta, finished.attempts)
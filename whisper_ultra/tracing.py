@@ -0,0 +1,178 @@
+"""Span per stadio e per chunk (JSON lines) e metriche aggregate in formato Prometheus"""
+
+import os
+import json
+import time
+import uuid
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# File degli span solo su richiesta: WHISPER_ULTRA_TRACE=percorso.jsonl (vuoto o assente = niente file)
+TRACE_FILE = os.environ.get("WHISPER_ULTRA_TRACE", "")
+METRICS_FILE = os.path.join("cache", "traces", "metrics.prom")
+# /metrics solo in locale: per un Prometheus su un'altra macchina va scelto un indirizzo esplicito
+METRICS_HOST = "127.0.0.1"
+DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 120, 300, 600, 1800)
+
+_local = threading.local()
+
+def _stack():
+    if not hasattr(_local, "spans"):
+        _local.spans = []
+    return _local.spans
+
+def current_span():
+    """Span aperto più interno del thread corrente (None fuori da ogni span)"""
+    stack = _stack()
+    return stack[-1] if stack else None
+
+def annotate(**attrs):
+    """Aggiunge attributi allo span corrente, se c'è (exit code, worker, ...)"""
+    span = current_span()
+    if span is not None:
+        span.attrs.update(attrs)
+
+class Span:
+    """Intervallo di lavoro: start, end, worker, esito e attributi liberi"""
+
+    def __init__(self, tracer, name, parent=None, **attrs):
+        self.tracer = tracer
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex[:16]
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attrs = attrs
+        self.worker = threading.current_thread().name
+        self.start = time.time()
+        self.end = None
+        self.status = "ok"
+
+    def finish(self, error=None):
+        if self.end is not None:
+            return
+        self.end = time.time()
+        if error is not None:
+            self.status = "error"
+            self.attrs["error"] = str(error)
+        self.tracer.record(self)
+
+    def __enter__(self):
+        _stack().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _stack().remove(self)
+        self.finish(exc)
+        return False
+
+    def to_dict(self):
+        data = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "end": round(self.end, 6),
+            "duration": round(self.end - self.start, 6),
+            "worker": self.worker,
+            "pid": os.getpid(),
+            "status": self.status
+        }
+        data.update(self.attrs)
+        return data
+
+class Tracer:
+    """Scrive gli span finiti su file e ne aggrega durate, audio ed errori per stadio"""
+
+    def __init__(self, path=TRACE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def span(self, name, parent=None, **attrs):
+        """Nuovo span; senza parent è figlio dello span corrente del thread"""
+        return Span(self, name, parent if parent is not None else current_span(), **attrs)
+
+    def record(self, span):
+        data = span.to_dict()
+        with self._lock:
+            stats = self._stats.setdefault(span.name, {
+                "count": 0, "errors": 0, "seconds": 0.0, "audio_seconds": 0.0,
+                "queue_wait": 0.0, "buckets": [0] * len(DURATION_BUCKETS)
+            })
+            stats["count"] += 1
+            stats["errors"] += span.status == "error"
+            stats["seconds"] += data["duration"]
+            stats["audio_seconds"] += span.attrs.get("audio_seconds") or 0
+            stats["queue_wait"] += span.attrs.get("queue_wait") or 0
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if data["duration"] <= bound:
+                    stats["buckets"][i] += 1
+
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a") as f:
+                    f.write(json.dumps(data, ensure_ascii=False) + "\n")
+
+    def metrics_text(self):
+        """Contatori aggregati nel formato di esposizione testuale di Prometheus"""
+        with self._lock:
+            stats = {name: dict(values, buckets=list(values["buckets"])) for name, values in self._stats.items()}
+
+        lines = []
+        counters = (
+            ("whisper_ultra_spans_total", "Span completati per stadio", "count"),
+            ("whisper_ultra_span_errors_total", "Span finiti con errore per stadio", "errors"),
+            ("whisper_ultra_span_seconds_total", "Tempo totale per stadio", "seconds"),
+            ("whisper_ultra_audio_seconds_total", "Secondi di audio elaborati per stadio", "audio_seconds"),
+            ("whisper_ultra_queue_wait_seconds_total", "Attesa in coda prima dello stadio", "queue_wait"),
+        )
+        for metric, help_text, field in counters:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for name in sorted(stats):
+                lines.append(f'{metric}{{stage="{name}"}} {stats[name][field]:g}')
+
+        metric = "whisper_ultra_span_duration_seconds"
+        lines.append(f"# HELP {metric} Durata degli span per stadio")
+        lines.append(f"# TYPE {metric} histogram")
+        for name in sorted(stats):
+            for bound, count in zip(DURATION_BUCKETS, stats[name]["buckets"]):
+                lines.append(f'{metric}_bucket{{stage="{name}",le="{bound:g}"}} {count}')
+            lines.append(f'{metric}_bucket{{stage="{name}",le="+Inf"}} {stats[name]["count"]}')
+            lines.append(f'{metric}_sum{{stage="{name}"}} {stats[name]["seconds"]:g}')
+            lines.append(f'{metric}_count{{stage="{name}"}} {stats[name]["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def write_metrics(self, path=METRICS_FILE):
+        """Salva le metriche per il textfile collector di node_exporter (scrittura atomica)"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.metrics_text())
+        os.replace(tmp_path, path)
+
+    def serve_metrics(self, port, host=METRICS_HOST):
+        """Espone /metrics su un thread in background (di default solo su loopback)"""
+        tracer = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = tracer.metrics_text().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+        return server
+
+tracer = Tracer()
+
+def span(name, parent=None, **attrs):
+    return tracer.span(name, parent, **attrs)
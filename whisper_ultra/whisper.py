@@ -0,0 +1,456 @@
+"""Esecuzione di whisper.cpp: whisper-cli per chunk o pool di whisper-server residenti"""
+
+import os
+import re
+import json
+import time
+import socket
+import uuid
+import tempfile
+import threading
+import subprocess
+import http.client
+import urllib.request
+import urllib.error
+
+from . import tracing
+from .audio import RAM_DIR, span_audio
+
+WHISPER_CPP_DIR = os.environ.get("WHISPER_CPP_DIR", "whisper.cpp")
+WHISPER_CLI_BINARY = os.path.join(WHISPER_CPP_DIR, "build", "bin", "whisper-cli")
+WHISPER_SERVER_BINARY = os.path.join(WHISPER_CPP_DIR, "build", "bin", "whisper-server")
+
+# Parametri whisper che influenzano il testo: cambiarli invalida la cache
+WHISPER_PARAMS = "txt;temperature=0"
+# Audio usato per riconoscere la lingua (whisper ne guarda comunque al massimo 30 s)
+LANGUAGE_SAMPLE_SECONDS = 30
+
+def model_path(model):
+    return os.path.join(WHISPER_CPP_DIR, "models", f"ggml-{model}.bin")
+
+def _cli_input(chunk):
+    """Ingresso e uscita di whisper-cli per un chunk (percorso WAV o WAV in memoria)
+
+    Il WAV in memoria arriva da stdin (-f -): su file finisce solo l'output,
+    sotto un prefisso temporaneo (-of) che chi chiama rimuove quando stdin non è
+    None. Restituisce (argomenti, byte per stdin o None, prefisso dei file di output).
+    """
+    if isinstance(chunk, str):
+        return ['-f', chunk], None, chunk
+    fd, prefix = tempfile.mkstemp(prefix="whisper_", dir=RAM_DIR)
+    os.close(fd)
+    return ['-f', '-', '-of', prefix], bytes(chunk), prefix
+
+def _free_port(host="127.0.0.1"):
+    """Porta TCP libera su cui avviare un whisper-server"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+def _multipart_body(fields, file_field, file_path):
+    """Corpo multipart/form-data per l'endpoint /inference (file_path o WAV in memoria)"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    if isinstance(file_path, str):
+        filename = os.path.basename(file_path)
+        with open(file_path, "rb") as f:
+            data = f.read()
+    else:
+        filename = "chunk.wav"
+        data = file_path
+    parts.append(
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+        f'filename="{filename}"\r\n'
+        f'Content-Type: audio/wav\r\n\r\n'.encode() + data + b"\r\n"
+    )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+class WhisperServerWorker:
+    """Un whisper-server residente che tiene in memoria un solo modello"""
+    
+    def __init__(self, binary=WHISPER_SERVER_BINARY, host="127.0.0.1", threads=2):
+        self.binary = binary
+        self.host = host
+        self.threads = threads
+        self.process = None
+        self.model = None
+        self.port = None
+        # stop() arriva anche da altri thread (tentativo annullato, pool che ricicla il worker)
+        self._process_lock = threading.Lock()
+    
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+    
+    def start(self, model, threads=None, timeout=120):
+        """Avvia (o riavvia) il server se è morto o ha modello o thread diversi"""
+        threads = threads or self.threads
+        if self.alive() and (self.model, self.threads) == (model, threads):
+            return
+        
+        self.stop()
+        self.port = _free_port(self.host)
+        self.model = model
+        self.threads = threads
+        process = subprocess.Popen(
+            [
+                self.binary,
+                '-m', model_path(model),
+                '--host', self.host,
+                '--port', str(self.port),
+                '-t', str(self.threads),
+                '-p', '1'
+            ],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL
+        )
+        with self._process_lock:
+            self.process = process
+        
+        # Il server apre la porta solo dopo aver caricato il modello
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"whisper-server terminato all'avvio (codice {process.returncode})")
+            try:
+                socket.create_connection((self.host, self.port), timeout=0.5).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        
+        self.stop()
+        raise RuntimeError("whisper-server non risponde")
+    
+    def stop(self):
+        """Ferma il server; sicuro da più thread insieme e ripetibile"""
+        with self._process_lock:
+            process, self.process = self.process, None
+        # Solo chi ha preso il processo lo ferma: gli altri trovano None
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    
+    def transcribe(self, chunk_path, language, timeout=600, response_format="text"):
+        body, content_type = _multipart_body(
+            {"language": language, "response_format": response_format, "temperature": "0.0"},
+            "file", chunk_path
+        )
+        request = urllib.request.Request(
+            f"http://{self.host}:{self.port}/inference",
+            data=body,
+            headers={"Content-Type": content_type}
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=timeout) as response:
+                return response.read().decode("utf-8")
+        except socket.timeout:
+            # Il server è ancora occupato sul chunk: va riavviato
+            self.stop()
+            raise TimeoutError(f"whisper-server oltre {timeout}s")
+        except urllib.error.URLError as e:
+            if isinstance(e.reason, socket.timeout):
+                self.stop()
+                raise TimeoutError(f"whisper-server oltre {timeout}s")
+            raise
+
+class WhisperServerPool:
+    """Pool di whisper-server residenti: ogni worker carica il modello una volta sola
+
+    I worker si riusano per (modello, thread): job con thread diversi sullo stesso
+    pool condiviso si prendono ciascuno i propri server e un server con un'altra
+    configurazione viene riavviato solo se non ci sono posti liberi. size lo
+    decide chi crea il pool, non i singoli job.
+    
+    Con uno scheduler collegato (CpuScheduler.attach) i server seguono il suo
+    conto delle copie: quelli che sfratta gli vengono tolti da fermare
+    (take_idle) e quelli che il pool ferma da sé escono dal conto.
+    """
+    
+    remote = False
+    
+    def __init__(self, binary=WHISPER_SERVER_BINARY, host="127.0.0.1", threads=2, size=1):
+        self.binary = binary
+        self.host = host
+        self.threads = threads
+        self.size = size
+        self.scheduler = None
+        self._available = threading.Condition()
+        self._idle = []
+        self._count = 0
+    
+    def available(self):
+        return os.path.exists(self.binary)
+    
+    def resize(self, size, threads=None):
+        with self._available:
+            self.size = max(size, 1)
+            if threads:
+                self.threads = threads
+            self._available.notify_all()
+    
+    def companion(self, threads=None):
+        """Pool separato con gli stessi binari e la stessa dimensione, per un secondo modello (cascata)"""
+        return WhisperServerPool(self.binary, self.host, threads or self.threads, self.size)
+    
+    def _stopped(self, model, threads):
+        # Da chiamare fuori da _available: lo scheduler prende il suo lock e poi il nostro
+        if self.scheduler is not None and model is not None:
+            self.scheduler.copy_stopped(self, model, threads)
+    
+    def take_idle(self, model, threads):
+        """Toglie dal pool un server libero con questa configurazione (sfratto); chi lo riceve lo ferma"""
+        with self._available:
+            for i, worker in enumerate(self._idle):
+                if (worker.model, worker.threads) == (model, threads):
+                    self._count -= 1
+                    self._available.notify()
+                    return self._idle.pop(i)
+        return None
+    
+    def acquire(self, model, threads=None):
+        threads = threads or self.threads
+        replaced = None
+        with self._available:
+            while True:
+                # Preferisce un worker che ha già caricato questo modello con questi thread
+                for i, worker in enumerate(self._idle):
+                    if (worker.model, worker.threads) == (model, threads) and worker.alive():
+                        return self._idle.pop(i)
+                if self._count < self.size:
+                    self._count += 1
+                    worker = WhisperServerWorker(self.binary, self.host, threads)
+                    break
+                if self._idle:
+                    # Worker con un'altra configurazione (o morto): verrà sostituito
+                    worker = self._idle.pop(0)
+                    replaced = (worker.model, worker.threads)
+                    break
+                self._available.wait()
+        if replaced is not None:
+            self._stopped(*replaced)
+        
+        try:
+            worker.start(model, threads)
+        except Exception:
+            worker.stop()
+            with self._available:
+                self._count -= 1
+                self._available.notify()
+            raise
+        return worker
+    
+    def release(self, worker):
+        with self._available:
+            shrink = self._count > self.size
+            if shrink:
+                self._count -= 1
+            else:
+                self._idle.append(worker)
+            self._available.notify()
+        if shrink:
+            worker.stop()
+            self._stopped(worker.model, worker.threads)
+    
+    def transcribe(self, chunk_path, language, model, timeout=600, response_format="text", threads=None,
+                   cancel=None):
+        """Con cancel (CancelToken) annullato il server viene fermato e il chunk abbandonato"""
+        worker = self.acquire(model, threads)
+        if cancel is not None:
+            cancel.on_cancel(worker.stop)
+        try:
+            tracing.annotate(server=f"{worker.host}:{worker.port}")
+            try:
+                return worker.transcribe(chunk_path, language, timeout, response_format)
+            except (urllib.error.URLError, ConnectionError, http.client.HTTPException):
+                if cancel is not None and cancel.is_set():
+                    raise RuntimeError("Tentativo annullato: un'altra copia del chunk è finita prima")
+                # Server crashato o non raggiungibile: riavvio e un secondo tentativo
+                worker.stop()
+                worker.start(model, worker.threads)
+                tracing.annotate(server=f"{worker.host}:{worker.port}", restarted=True)
+                return worker.transcribe(chunk_path, language, timeout, response_format)
+        finally:
+            if cancel is not None:
+                cancel.remove(worker.stop)
+            self.release(worker)
+    
+    def shutdown(self):
+        with self._available:
+            idle, self._idle = self._idle, []
+            self._count -= len(idle)
+        for worker in idle:
+            worker.stop()
+            self._stopped(worker.model, worker.threads)
+
+def transcribe_chunk(args, pool=None, threads=2, timeout=600, cancel=None):
+    """Trascrivi un singolo chunk - ottimizzato per parallelizzazione
+
+    cancel (CancelToken) ferma whisper-cli o il server se il tentativo viene annullato.
+    """
+    chunk_path, language, model, chunk_number, total_chunks = args
+    
+    if pool is not None:
+        try:
+            text = pool.transcribe(chunk_path, language, model, timeout, threads=threads, cancel=cancel)
+            return (chunk_number, text, True)
+        except TimeoutError:
+            return (chunk_number, f"[Timeout chunk {chunk_number}]", False)
+        except Exception as e:
+            return (chunk_number, f"[Errore {chunk_number}: {str(e)}]", False)
+    
+    cli_input, data, prefix = _cli_input(chunk_path)
+    command = [
+        WHISPER_CLI_BINARY,
+        '-m', model_path(model),
+        *cli_input,
+        '--output-txt',
+        '--language', language,
+        '-t', str(threads),
+        '-p', '1'
+    ]
+    transcript_file = f"{prefix}.txt"
+    
+    try:
+        process = subprocess.Popen(
+            command, stdin=subprocess.PIPE if data is not None else None,
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+        if cancel is not None:
+            cancel.on_cancel(process.kill)
+        try:
+            process.communicate(data, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.communicate()
+            raise
+        finally:
+            if cancel is not None:
+                cancel.remove(process.kill)
+        tracing.annotate(exit_code=process.returncode)
+        
+        if cancel is not None and cancel.is_set():
+            if os.path.exists(transcript_file):
+                os.remove(transcript_file)
+            return (chunk_number, f"[Annullato chunk {chunk_number}]", False)
+        
+        if os.path.exists(transcript_file):
+            with open(transcript_file, "r") as f:
+                text = f.read()
+            
+            try:
+                os.remove(transcript_file)
+            except:
+                pass
+            
+            return (chunk_number, text, True)
+        else:
+            return (chunk_number, f"[Errore chunk {chunk_number}]", False)
+    
+    except subprocess.TimeoutExpired:
+        return (chunk_number, f"[Timeout chunk {chunk_number}]", False)
+    except Exception as e:
+        return (chunk_number, f"[Errore {chunk_number}: {str(e)}]", False)
+    finally:
+        if data is not None:
+            # Prefisso temporaneo di -of (il .txt, se c'è, resta solo dopo un errore)
+            for path in (transcript_file, prefix):
+                if os.path.exists(path):
+                    os.remove(path)
+
+def _segment(start, end, text, probabilities):
+    probabilities = [p for p in probabilities if p is not None]
+    return {
+        "start": start,
+        "end": end,
+        "text": text,
+        # Media delle probabilità dei token: None se whisper non le fornisce
+        "confidence": sum(probabilities) / len(probabilities) if probabilities else None
+    }
+
+def transcribe_segments(chunk_path, language, model, pool=None, threads=2, timeout=600):
+    """Segmenti del chunk con tempi in secondi e confidenza media dei token
+
+    Restituisce [{"start", "end", "text", "confidence"}]; solleva un'eccezione se
+    whisper fallisce. Con il pool usa il verbose_json di whisper-server, altrimenti
+    il JSON completo di whisper-cli (--output-json-full).
+    """
+    if pool is not None:
+        data = json.loads(pool.transcribe(chunk_path, language, model, timeout, "verbose_json", threads))
+        return [
+            _segment(
+                segment.get("start", 0.0), segment.get("end", 0.0), segment.get("text", ""),
+                [word.get("probability") for word in segment.get("words") or []]
+            )
+            for segment in data.get("segments") or []
+        ]
+    
+    cli_input, wav, prefix = _cli_input(chunk_path)
+    command = [
+        WHISPER_CLI_BINARY,
+        '-m', model_path(model),
+        *cli_input,
+        '--output-json-full',
+        '--language', language,
+        '-t', str(threads),
+        '-p', '1'
+    ]
+    json_file = f"{prefix}.json"
+    try:
+        result = subprocess.run(command, input=wav, capture_output=True, timeout=timeout)
+        tracing.annotate(exit_code=result.returncode)
+        
+        if not os.path.exists(json_file):
+            raise RuntimeError(f"whisper-cli terminato con codice {result.returncode}")
+        # I token possono spezzare caratteri UTF-8 a metà
+        with open(json_file, encoding="utf-8", errors="replace") as f:
+            data = json.load(f)
+    finally:
+        for path in (json_file, prefix) if wav is not None else (json_file,):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    return [
+        _segment(
+            segment["offsets"]["from"] / 1000, segment["offsets"]["to"] / 1000, segment["text"],
+            # Token speciali ([_BEG_], [_TT_...]) esclusi dalla confidenza
+            [token.get("p") for token in segment.get("tokens") or [] if not token.get("text", "").startswith("[_")]
+        )
+        for segment in data.get("transcription") or []
+    ]
+
+def detect_language(chunk, model, pool=None, threads=2, timeout=120):
+    """Lingua parlata nei primi secondi del chunk (percorso WAV o WAV in memoria), None se non si ricava
+
+    whisper-cli si ferma dopo il riconoscimento (--detect-language) e restituisce il
+    codice (it, en, ...); whisper-server il nome completo (italian, ...). whisper.cpp
+    accetta entrambi come --language.
+    """
+    sample = span_audio(chunk, 0, LANGUAGE_SAMPLE_SECONDS)
+    if pool is not None:
+        data = json.loads(pool.transcribe(sample, "auto", model, timeout, "verbose_json", threads))
+        return data.get("language") or None
+    
+    # Il campione arriva da stdin; --detect-language non scrive file di output
+    command = [
+        WHISPER_CLI_BINARY,
+        '-m', model_path(model),
+        '-f', '-',
+        '--language', 'auto',
+        '--detect-language',
+        '-t', str(threads)
+    ]
+    result = subprocess.run(command, input=sample, capture_output=True, timeout=timeout)
+    tracing.annotate(exit_code=result.returncode)
+    
+    output = (result.stderr + result.stdout).decode("utf-8", errors="replace")
+    match = re.search(r"auto-detected language: (\w+)", output)
+    return match.group(1) if match else None